@@ -6,10 +6,133 @@
 # @File    : gis_apis.py
 # @Description :
 
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+GOOGLE_GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+GOOGLE_PLACES_NEARBY_URL = "https://places.googleapis.com/v1/places:searchNearby"
+GOOGLE_STATIC_MAP_URL = "https://maps.googleapis.com/maps/api/staticmap"
+AMAP_STATIC_MAP_URL = "https://restapi.amap.com/v3/staticmap"
+
+# Status codes worth retrying: rate limited or temporary server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
 
 
-def get_location_name(latitude, longitude, api_key):
+class TokenBucket:
+    """
+    A thread-safe token bucket limiting the request rate.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Parameters:
+        - rate (float): Tokens added per second, i.e. the sustained requests per second.
+        - capacity (int): Maximum burst size, defaults to max(1, rate).
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Block until one token is available
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class GisClient:
+    """
+    A shared HTTP client for the GIS APIs with connection pooling, bounded concurrency, rate limiting and
+    retries with exponential backoff.
+    """
+
+    def __init__(self, max_workers=8, rate=None, burst=None, retries=3, backoff_factor=0.5, timeout=None):
+        """
+        Parameters:
+        - max_workers (int): Maximum number of concurrent requests in batch calls, also the connection pool size.
+        - rate (float): Maximum requests per second, None for no limit.
+        - burst (int): Maximum burst of requests above the rate.
+        - retries (int): Number of retries on connection errors and on RETRY_STATUS_CODES.
+        - backoff_factor (float): Retry i waits backoff_factor * 2 ** i seconds, or the server's Retry-After.
+        - timeout (float): Timeout of each request in seconds.
+        """
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate, burst) if rate is not None else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            last_attempt = attempt == self.retries
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+                time.sleep(self.backoff_factor * 2 ** attempt)
+                continue
+            if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                return response
+            retry_after = response.headers.get('Retry-After')
+            time.sleep(float(retry_after) if retry_after and retry_after.isdigit()
+                       else self.backoff_factor * 2 ** attempt)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def map(self, func, items):
+        """
+        Apply func to every item with at most max_workers concurrent calls.
+
+        Returns:
+        - list: The results, in the order of items.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def close(self):
+        self.session.close()
+
+
+default_client = None
+default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    # A pooled client shared by all calls that do not pass their own, so connections are reused
+    global default_client
+    with default_client_lock:
+        if default_client is None:
+            default_client = GisClient(retries=0)
+        return default_client
+
+
+def get_location_name(latitude, longitude, api_key, cache=None, base_url=GOOGLE_GEOCODE_URL, client=None):
     """
     Get the location name using Google Maps Geocoding API.
 
@@ -17,30 +140,41 @@ def get_location_name(latitude, longitude, api_key):
     - latitude (float): Latitude of the location.
     - longitude (float): Longitude of the location.
     - api_key (str): API key for Google Maps.
+    - cache (GeoCache): Optional cache of earlier lookups around the same coordinate.
+    - base_url (str): The API endpoint, e.g. a local server for testing.
+    - client (GisClient): The HTTP client, defaults to the shared client.
 
     Returns:
     - str: The name of the location.
     """
-    base_url = "https://maps.googleapis.com/maps/api/geocode/json"
+    if cache is not None:
+        location_name = cache.get('location_name', latitude, longitude)
+        if location_name is not None:
+            return location_name
     params = {
         "latlng": f"{latitude},{longitude}",
         "key": api_key
     }
 
-    response = requests.get(base_url, params=params)
+    client = client if client is not None else get_default_client()
+    response = client.get(base_url, params=params)
 
     if response.status_code == 200:
         results = response.json()['results']
         if results:
             # Return the formatted address of the first result
-            return results[0]['formatted_address']
+            location_name = results[0]['formatted_address']
         else:
-            return "No location found"
+            location_name = "No location found"
+        if cache is not None:
+            cache.put('location_name', latitude, longitude, location_name)
+        return location_name
     else:
         return "Error: Unable to connect to the API"
 
 
-def get_point_of_interest_new(latitude, longitude, api_key):
+def get_point_of_interest_new(latitude, longitude, api_key, cache=None, base_url=GOOGLE_PLACES_NEARBY_URL,
+                              client=None):
     """
     Get the location name using Google Maps Geocoding API.
 
@@ -48,11 +182,17 @@ def get_point_of_interest_new(latitude, longitude, api_key):
     - latitude (float): Latitude of the location.
     - longitude (float): Longitude of the location.
     - api_key (str): API key for Google Maps.
+    - cache (GeoCache): Optional cache of earlier lookups around the same coordinate.
+    - base_url (str): The API endpoint, e.g. a local server for testing.
+    - client (GisClient): The HTTP client, defaults to the shared client.
 
     Returns:
     - str: The name of the location.
     """
-    base_url = "https://places.googleapis.com/v1/places:searchNearby"
+    if cache is not None:
+        location_name = cache.get('point_of_interest', latitude, longitude)
+        if location_name is not None:
+            return location_name
     headers = {
         "Content-Type": "application/json",
         "X-Goog-Api-Key": api_key,
@@ -73,20 +213,24 @@ def get_point_of_interest_new(latitude, longitude, api_key):
         "languageCode": "en"
     }
 
-    response = requests.post(base_url, headers=headers, json=params)
+    client = client if client is not None else get_default_client()
+    response = client.post(base_url, headers=headers, json=params)
 
     if response.status_code == 200:
         results = response.json()
         if results:
             # Return the formatted address of the first result
-            return results[0]['formatted_address']
+            location_name = results[0]['formatted_address']
         else:
-            return "No location found"
+            location_name = "No location found"
+        if cache is not None:
+            cache.put('point_of_interest', latitude, longitude, location_name)
+        return location_name
     else:
         return "Error: Unable to connect to the API"
 
 def get_google_map_image(latitude, longitude, api_key, zoom=18, size='500x500', maptype='roadmap', language='en',
-                         save_path=None, marker=False):
+                         save_path=None, marker=False, base_url=GOOGLE_STATIC_MAP_URL, client=None, image_store=None):
     """
     Fetches a map image from Google Static Maps API.
 
@@ -98,11 +242,16 @@ def get_google_map_image(latitude, longitude, api_key, zoom=18, size='500x500',
     - size (str): The size of the map in pixels, formatted activity_sensing {width}x{height}.
     - maptype (str): The type of map to construct. Options are 'roadmap', 'satellite', 'hybrid', 'terrain'.
     - marker (bool): If True, place a red marker at the center of the map.
+    - base_url (str): The API endpoint, e.g. a local server for testing.
+    - client (GisClient): The HTTP client, defaults to the shared client.
+    - image_store (MapImageStore): Optional store of earlier downloaded images, which also rounds the center and
+      may snap it.
 
     Returns:
     - bytes: The image data in bytes. None if request fails.
     """
-    base_url = "https://maps.googleapis.com/maps/api/staticmap?"
+    if image_store is not None:
+        latitude, longitude = image_store.snap(latitude, longitude, zoom)
 
     # Adding marker parameters if marker is True
     markers_param = f"color:red|{latitude},{longitude}" if marker else ""
@@ -117,23 +266,26 @@ def get_google_map_image(latitude, longitude, api_key, zoom=18, size='500x500',
         "markers": markers_param  # Add this only if there are markers to display
     }
 
-    response = requests.get(base_url, params=params)
+    content = image_store.get(base_url, params) if image_store is not None else None
+    if content is None:
+        client = client if client is not None else get_default_client()
+        response = client.get(base_url, params=params)
+        if response.status_code != 200:
+            print(f"Failed to fetch the map image. Status code: {response.status_code}")
+            return None
+        content = response.content
+        if image_store is not None:
+            image_store.put(base_url, params, content)
 
-    if response.status_code == 200:
-        if save_path is not None:
-            with open(save_path, "wb") as file:
-                file.write(response.content)
-                print(f"Fetch the map image at {save_path}")
-            return response.content
-        else:
-            return response.content
-    else:
-        print(f"Failed to fetch the map image. Status code: {response.status_code}")
-        return None
+    if save_path is not None:
+        with open(save_path, "wb") as file:
+            file.write(content)
+            print(f"Fetch the map image at {save_path}")
+    return content
 
 
 def get_google_map_image_markers(coords, api_key, zoom=19, size='500x500', maptype='roadmap', language='en',
-                                 save_path=None):
+                                 save_path=None, base_url=GOOGLE_STATIC_MAP_URL, client=None, image_store=None):
     """
     Fetches a static Google Map image with markers for the given coordinates.
 
@@ -144,36 +296,48 @@ def get_google_map_image_markers(coords, api_key, zoom=19, size='500x500', mapty
     - size: String, size of the map image in format 'widthxheight'.
     - maptype: String, type of map. Options are 'roadmap', 'satellite', 'hybrid', 'terrain'.
     - language: String, language used for map labels.
+    - base_url: String, the API endpoint, e.g. a local server for testing.
+    - client: GisClient, the HTTP client, defaults to the shared client.
+    - image_store: MapImageStore, optional store of earlier downloaded images.
 
     Returns:
     - A requests.Response object containing the map image or error.
     """
-    # Base URL for the Google Maps Static API
-    base_url = "https://maps.googleapis.com/maps/api/staticmap?"
 
     # Constructing the markers parameter
     markers_params = '|'.join(f"color:red%7Clabel:{idx + 1}%7C{lat},{lon}" for idx, (lon, lat) in enumerate(coords))
 
     # Constructing the full URL
-    map_url = f"{base_url}size={size}&maptype={maptype}&language={language}&zoom={zoom}&markers={markers_params}&key={api_key}"
-
-    # Making the request to get the map image
-    response = requests.get(map_url)
-
-    if response.status_code == 200:
-        if save_path is not None:
-            with open(save_path, "wb") as file:
-                file.write(response.content)
-        return response.content
-    else:
-        print(f"Failed to fetch the map image. Status code: {response.status_code}")
-        return None
+    map_url = f"{base_url}?size={size}&maptype={maptype}&language={language}&zoom={zoom}&markers={markers_params}&key={api_key}"
+
+    # Markers are part of the image, so they are not snapped
+    store_params = {"coords": [list(coord) for coord in coords], "size": size, "maptype": maptype,
+                    "language": language, "zoom": zoom}
+    content = image_store.get(base_url, store_params) if image_store is not None else None
+    if content is None:
+        # Making the request to get the map image
+        client = client if client is not None else get_default_client()
+        response = client.get(map_url)
+        if response.status_code != 200:
+            print(f"Failed to fetch the map image. Status code: {response.status_code}")
+            return None
+        content = response.content
+        if image_store is not None:
+            image_store.put(base_url, store_params, content)
+
+    if save_path is not None:
+        with open(save_path, "wb") as file:
+            file.write(content)
+    return content
 
 
 def get_amap_image(latitude, longitude, api_key, zoom=17, size='500*500', scale=1, maptype='roadmap',
-                   save_path=None):
+                   save_path=None, base_url=AMAP_STATIC_MAP_URL, client=None, image_store=None):
+    if image_store is not None:
+        latitude, longitude = image_store.snap(latitude, longitude, zoom)
+
     # Construct the Amap API URL
-    url = f'https://restapi.amap.com/v3/staticmap'
+    url = base_url
 
     # Set the parameters for the API request
     params = {
@@ -184,19 +348,72 @@ def get_amap_image(latitude, longitude, api_key, zoom=17, size='500*500', scale=
         'key': api_key  # Your Amap API Key
     }
 
-    # Send the request and get the response
-    response = requests.get(url, params=params)
+    content = image_store.get(url, params) if image_store is not None else None
+    if content is None:
+        # Send the request and get the response
+        client = client if client is not None else get_default_client()
+        response = client.get(url, params=params)
+        if response.status_code != 200:
+            print('Error: Failed to get map image')
+            return None
+        content = response.content
+        if image_store is not None:
+            image_store.put(url, params, content)
+
+    # If the request is successful, save the map image
+    if save_path is not None:
+        with open(save_path, 'wb') as f:
+            f.write(content)
+        print(f'Map image saved to {save_path}')
+    return content
+
+
+def get_location_names(coords, api_key, client=None, cache=None, base_url=GOOGLE_GEOCODE_URL):
+    """
+    Get the location names of many coordinates with concurrent, rate-limited requests.
 
-    if response.status_code == 200:
-        # If the request is successful, save the map image
-        if save_path is not None:
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
-            print(f'Map image saved to {save_path}')
-        return response.content
-    else:
-        print('Error: Failed to get map image')
-        return None
+    Parameters:
+    - coords: List of (latitude, longitude) tuples.
+    - api_key (str): API key for Google Maps.
+    - client (GisClient): The HTTP client setting concurrency, rate limit and retries.
+    - cache (GeoCache): Optional cache of earlier lookups.
+    - base_url (str): The API endpoint, e.g. a local server for testing.
+
+    Returns:
+    - list: The location name of each coordinate, in the order of coords.
+    """
+    client = client if client is not None else get_default_client()
+    # Each distinct coordinate is only requested once
+    unique_coords = list(dict.fromkeys(tuple(coord) for coord in coords))
+    names = client.map(lambda coord: get_location_name(coord[0], coord[1], api_key, cache=cache, base_url=base_url,
+                                                       client=client), unique_coords)
+    name_map = dict(zip(unique_coords, names))
+    return [name_map[tuple(coord)] for coord in coords]
+
+
+def get_map_images(coords, api_key, client=None, save_paths=None, **kwargs):
+    """
+    Fetch the Google static map images centered at many coordinates with concurrent, rate-limited requests.
+
+    Parameters:
+    - coords: List of (latitude, longitude) tuples.
+    - api_key (str): API key for Google Maps.
+    - client (GisClient): The HTTP client setting concurrency, rate limit and retries.
+    - save_paths: Optional list of paths to save each image at.
+    - kwargs: Other arguments of get_google_map_image, e.g. zoom, size, maptype or image_store.
+
+    Returns:
+    - list: The image data of each coordinate in bytes (None if its request fails), in the order of coords.
+    """
+    client = client if client is not None else get_default_client()
+    save_paths = save_paths if save_paths is not None else [None] * len(coords)
+    # Each distinct request is only sent once
+    items = [(tuple(coord), save_path) for coord, save_path in zip(coords, save_paths)]
+    unique_items = list(dict.fromkeys(items))
+    images = client.map(lambda item: get_google_map_image(item[0][0], item[0][1], api_key, save_path=item[1],
+                                                          client=client, **kwargs), unique_items)
+    image_map = dict(zip(unique_items, images))
+    return [image_map[item] for item in items]
 
 
 if __name__ == "__main__":
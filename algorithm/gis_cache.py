@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @File    : gis_cache.py
+# @Description : On-disk caches for the GIS API helpers in gis_apis.py
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(latitude, longitude, precision=8):
+    """
+    Encode a coordinate as a geohash string.
+
+    Parameters:
+    - latitude (float): Latitude of the location.
+    - longitude (float): Longitude of the location.
+    - precision (int): Number of characters. 7 is a cell of about 150 m, 8 about 38 x 19 m, 9 about 5 m.
+
+    Returns:
+    - str: The geohash of the cell containing the coordinate.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits, bit_count, even = 0, 0, True
+    while len(geohash) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits = bits << 1
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+class GeoCache:
+    """
+    A persistent cache of GIS lookups keyed by the geohash cell of the queried coordinate.
+
+    Nearby coordinates falling in the same cell share one entry, so a user staying at one place only triggers
+    one API call. Entries expire after ttl seconds, and the least recently used entries are evicted once the
+    cache holds more than max_entries. The cache is stored in a SQLite file and is safe to share between threads.
+    """
+
+    def __init__(self, path, precision=8, ttl=30 * 24 * 3600, max_entries=100000):
+        """
+        Parameters:
+        - path (str): SQLite file of the cache, created if missing.
+        - precision (int): Geohash precision of the cache cells.
+        - ttl (float): Seconds before an entry expires, None to never expire.
+        - max_entries (int): Number of entries kept before evicting the least recently used ones.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.precision = precision
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Access times of hits, written back in batches so that a hit does not cost a disk write
+        self.pending_access = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS geo_cache (namespace TEXT, cell TEXT, value TEXT, created REAL, "
+                "accessed REAL, PRIMARY KEY (namespace, cell))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS geo_cache_accessed ON geo_cache (accessed)")
+
+    def cell(self, latitude, longitude):
+        return geohash_encode(latitude, longitude, self.precision)
+
+    def get(self, namespace, latitude, longitude):
+        """
+        Look up the cached value of the cell containing a coordinate.
+
+        Parameters:
+        - namespace (str): The kind of lookup, e.g. 'location_name'.
+        - latitude (float): Latitude of the location.
+        - longitude (float): Longitude of the location.
+
+        Returns:
+        - The cached value, or None on a miss or an expired entry.
+        """
+        cell = self.cell(latitude, longitude)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, created FROM geo_cache WHERE namespace = ? AND cell = ?",
+                                          (namespace, cell)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                with self.connection:
+                    self.connection.execute("DELETE FROM geo_cache WHERE namespace = ? AND cell = ?",
+                                            (namespace, cell))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.pending_access[(namespace, cell)] = now
+            if len(self.pending_access) >= 1000:
+                self.flush_access()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def flush_access(self):
+        # Write back the access times of recent hits, called with the lock held
+        if self.pending_access:
+            with self.connection:
+                self.connection.executemany("UPDATE geo_cache SET accessed = ? WHERE namespace = ? AND cell = ?",
+                                            [(accessed, namespace, cell) for (namespace, cell), accessed
+                                             in self.pending_access.items()])
+            self.pending_access.clear()
+
+    def put(self, namespace, latitude, longitude, value):
+        """
+        Store the value of the cell containing a coordinate, evicting the least recently used entries if full.
+
+        Parameters:
+        - namespace (str): The kind of lookup, e.g. 'location_name'.
+        - latitude (float): Latitude of the location.
+        - longitude (float): Longitude of the location.
+        - value: A JSON serializable value.
+        """
+        cell = self.cell(latitude, longitude)
+        now = time.time()
+        with self.lock:
+            # Access times must be up to date before choosing which entries to evict
+            self.flush_access()
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO geo_cache VALUES (?, ?, ?, ?, ?)",
+                                        (namespace, cell, json.dumps(value), now, now))
+                excess = self.connection.execute("SELECT COUNT(*) FROM geo_cache").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    self.connection.execute(
+                        "DELETE FROM geo_cache WHERE rowid IN (SELECT rowid FROM geo_cache ORDER BY accessed LIMIT ?)",
+                        (excess,))
+
+    def stats(self):
+        with self.lock:
+            size = self.connection.execute("SELECT COUNT(*) FROM geo_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total > 0 else 0.0,
+                'entries': size}
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.pending_access.clear()
+            self.connection.execute("DELETE FROM geo_cache")
+        self.hits, self.misses = 0, 0
+
+    def close(self):
+        with self.lock:
+            self.flush_access()
+        self.connection.close()
+
+
+def snap_to_pixel_grid(latitude, longitude, zoom, grid_pixels):
+    """
+    Snap a coordinate to a grid of Web Mercator pixels at a zoom level, as used by static map tiles.
+
+    Parameters:
+    - latitude (float): Latitude of the location.
+    - longitude (float): Longitude of the location.
+    - zoom (int): The zoom level of the map.
+    - grid_pixels (int): Spacing of the grid in map pixels.
+
+    Returns:
+    - (float, float): The latitude and longitude of the nearest grid point.
+    """
+    scale = 256 * 2 ** zoom
+    x = (longitude + 180) / 360 * scale
+    sin_latitude = min(max(math.sin(math.radians(latitude)), -0.9999), 0.9999)
+    y = (0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)) * scale
+    x = round(x / grid_pixels) * grid_pixels
+    y = round(y / grid_pixels) * grid_pixels
+    longitude = x / scale * 360 - 180
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale))))
+    return round(latitude, 7), round(longitude, 7)
+
+
+def normalize_floats(value):
+    # Round the floats of a request parameter, including those in lists such as marker coordinates
+    if isinstance(value, float):
+        return round(value, 7)
+    if isinstance(value, (list, tuple)):
+        return [normalize_floats(item) for item in value]
+    return value
+
+
+class MapImageStore:
+    """
+    A disk store of static map images addressed by a hash of the normalized request parameters.
+
+    The API key is not part of the address, so the same map requested with different keys is stored once. Map
+    centers are rounded to 7 decimals before they are formatted into the request, and when snap_pixels is set they
+    are snapped to a pixel grid at the requested zoom level, so nearby centers share one image. Once the store
+    exceeds max_bytes, the least recently used images are evicted until it is below low_water * max_bytes, so that
+    a full store does not scan its folder on every new image.
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 ** 2, snap_pixels=None, low_water=0.9):
+        """
+        Parameters:
+        - root (str): Folder of the store, created if missing.
+        - max_bytes (int): Maximum total size of the stored images.
+        - snap_pixels (int): Grid spacing in map pixels for snapping map centers, None to disable snapping.
+        - low_water (float): Fraction of max_bytes the store is brought down to when it is full.
+        """
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.snap_pixels = snap_pixels
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.total_bytes = sum(size for _, size, _ in self.list_images())
+
+    @staticmethod
+    def address(url, params):
+        # Float parameters, e.g. the marker coordinates, are rounded so that equal coordinates computed differently map
+        # to the same image. Centers are already rounded by snap before they are formatted.
+        normalized = {key: normalize_floats(value) for key, value in params.items() if key != 'key'}
+        request = json.dumps([url, normalized], sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def image_path(self, address):
+        return os.path.join(self.root, address[:2], address + '.png')
+
+    def list_images(self):
+        # (last access time, size, path) of every stored image
+        images = []
+        for folder in os.listdir(self.root):
+            folder_path = os.path.join(self.root, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for file_name in os.listdir(folder_path):
+                if file_name.endswith('.png'):
+                    stat = os.stat(os.path.join(folder_path, file_name))
+                    images.append((stat.st_mtime, stat.st_size, os.path.join(folder_path, file_name)))
+        return images
+
+    def snap(self, latitude, longitude, zoom):
+        # The center of a map request, rounded and optionally snapped to the pixel grid
+        if not self.snap_pixels:
+            return round(latitude, 7), round(longitude, 7)
+        return snap_to_pixel_grid(latitude, longitude, zoom, self.snap_pixels)
+
+    def get(self, url, params):
+        """
+        Look up a stored image.
+
+        Parameters:
+        - url (str): The API endpoint.
+        - params (dict): The request parameters.
+
+        Returns:
+        - bytes: The image data, or None if it is not stored.
+        """
+        path = self.image_path(self.address(url, params))
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+            # The modification time tracks the last access for eviction
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return content
+
+    def put(self, url, params, content):
+        """
+        Store an image and evict the least recently used images if the store is full.
+
+        Parameters:
+        - url (str): The API endpoint.
+        - params (dict): The request parameters.
+        - content (bytes): The image data.
+        """
+        path = self.image_path(self.address(url, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+            self.total_bytes += len(content) - previous_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Remove the least recently used images until the store is below its low-water mark, called with the lock held
+        target = self.low_water * self.max_bytes
+        for _, size, path in sorted(self.list_images()):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total > 0 else 0.0,
+                'bytes': self.total_bytes}
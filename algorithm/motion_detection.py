@@ -6,11 +6,11 @@
 # @File    : motion detection related algorithms
 # @Description : the step count refers to https://github.com/location-competition/indoor-location-competition-20
 
+from functools import lru_cache
+
 import numpy as np
 from scipy import signal
 
-from scipy.interpolate import interp1d
-
 
 NAMES_MOTIONS = ['not determined.', 'stationary', 'limited motion', 'walking', 'jogging/running', 'cycling', 'being in a vehicle/subway/ferry/train', 'being on an escalator or in an elevator']
 
@@ -49,6 +49,109 @@ def detect_motion_rule(step_count, acceleration, barometer_altitude_change, sate
     return motion_results
 
 
+# Labels given by detect_motion_rule, in the order it lists them
+RULE_MOTIONS = ['stationary', 'limited motion', 'walking', 'jogging/running/cycling',
+                'being in a vehicle/subway/ferry/train', 'being on an escalator or in an elevator']
+
+# Thresholds of detect_motion_rule, step counts are per minute, accelerations in m/s^2, altitude changes in m and
+# speeds in m/s
+MOTION_RULE_THRESHOLDS = {
+    'stationary_steps': 2, 'stationary_acceleration': 0.1, 'stationary_altitude': 0.1, 'stationary_speed': 0.1,
+    'limited_steps': 10, 'limited_altitude': 1, 'limited_speed': 0.5,
+    'walking_steps': 30, 'walking_acceleration': 0.5, 'walking_speed': 1.8,
+    'jogging_steps': 70, 'jogging_acceleration': 2.0, 'jogging_speed_min': 2.0, 'jogging_speed_max': 8.0,
+    'running_steps': 140, 'running_acceleration': 3.0,
+    'vehicle_steps': 5, 'vehicle_acceleration': 2, 'vehicle_speed': 2, 'vehicle_speed_fast': 5,
+    'escalator_steps': 10, 'escalator_altitude': 2, 'escalator_speed': 2,
+}
+
+
+def detect_motion_rule_batch(step_count, acceleration, barometer_altitude_change=None, satellite_speed=None,
+                             thresholds=None):
+    """
+    detect_motion_rule over arrays of windows, e.g. to sweep its thresholds over a whole dataset.
+
+    Missing values are NaN, with the meaning of None in detect_motion_rule. Threshold values may be arrays that
+    broadcast against the inputs, e.g. an array of shape (G, 1) with inputs of shape (N,) evaluates G settings at
+    once and gives a (G, N, 6) matrix.
+
+    The scalar rule raises ValueError when the running rule removes a 'walking' label that was not given (more than
+    140 steps and a speed in [1.8, 2) or >= 8 m/s), here these windows are labeled 'jogging/running/cycling' only.
+
+    Parameters:
+        step_count (numpy.ndarray): Step rate of each window.
+        acceleration (numpy.ndarray): Mean linear acceleration of each window.
+        barometer_altitude_change (numpy.ndarray): Barometric altitude change of each window, None if unavailable.
+        satellite_speed (numpy.ndarray): Satellite speed of each window, None if unavailable.
+        thresholds (dict): Overrides of MOTION_RULE_THRESHOLDS.
+
+    Returns:
+        numpy.ndarray: Boolean matrix, True where a window gets the label of RULE_MOTIONS in the last axis.
+        numpy.ndarray: Boolean array, False for the windows without step count or acceleration, which are
+                       'not determined.'.
+    """
+    t = {**MOTION_RULE_THRESHOLDS, **(thresholds or {})}
+    step_count = np.asarray(step_count, dtype=np.float64)
+    acceleration = np.asarray(acceleration, dtype=np.float64)
+    altitude_change = np.abs(np.asarray(np.nan if barometer_altitude_change is None else barometer_altitude_change,
+                                        dtype=np.float64))
+    speed = np.asarray(np.nan if satellite_speed is None else satellite_speed, dtype=np.float64)
+    no_altitude = np.isnan(altitude_change)
+    no_speed = np.isnan(speed)
+
+    stationary = (step_count <= t['stationary_steps']) & (acceleration <= t['stationary_acceleration']) \
+        & (no_altitude | (altitude_change < t['stationary_altitude'])) & (no_speed | (speed < t['stationary_speed']))
+    limited = ~stationary & (step_count <= t['limited_steps']) & (no_altitude | (altitude_change < t['limited_altitude'])) \
+        & (no_speed | (speed < t['limited_speed']))
+    walking = (step_count >= t['walking_steps']) & (acceleration >= t['walking_acceleration']) \
+        & (no_speed | (speed < t['walking_speed']))
+    jogging = (step_count >= t['jogging_steps']) & (acceleration >= t['jogging_acceleration']) \
+        & (no_speed | ((speed < t['jogging_speed_max']) & (speed >= t['jogging_speed_min'])))
+    running = (step_count > t['running_steps']) & (acceleration >= t['running_acceleration']) & ~jogging
+    jogging = jogging | running
+    walking = walking & ~running
+    vehicle = ((step_count <= t['vehicle_steps'])
+               & ((acceleration > t['vehicle_acceleration']) | (~no_speed & (speed >= t['vehicle_speed'])))) \
+        | (~no_speed & (speed > t['vehicle_speed_fast']))
+    escalator = (step_count <= t['escalator_steps']) & (no_altitude | (altitude_change >= t['escalator_altitude'])) \
+        & (no_speed | (speed < t['escalator_speed']))
+
+    determined = ~(np.isnan(step_count) | np.isnan(acceleration))
+    motions = np.stack(np.broadcast_arrays(stationary, limited, walking, jogging, vehicle, escalator), axis=-1)
+    determined = np.broadcast_to(determined, motions.shape[:-1])
+    return motions & determined[..., None], determined
+
+
+def format_motions(motions, determined, return_str=False, motion_previous=None):
+    """
+    Turn rows of detect_motion_rule_batch into the results of detect_motion_rule, e.g. for the selected windows only.
+
+    Parameters:
+        motions (numpy.ndarray): N*6 boolean matrix of detect_motion_rule_batch.
+        determined (numpy.ndarray): N boolean array of detect_motion_rule_batch.
+        return_str (bool): Format the labels as a numbered string.
+        motion_previous (list): Labels of windows without any label, as in detect_motion_rule.
+
+    Returns:
+        list: The output of detect_motion_rule for each window.
+    """
+    results = []
+    for row, is_determined in zip(motions, determined):
+        if not is_determined:
+            results.append(['not determined.'])
+            continue
+        motion_results = [RULE_MOTIONS[k] for k in np.flatnonzero(row)]
+        if len(motion_results) == 0:
+            if motion_previous is None:
+                results.append('not determined.')
+                continue
+            motion_results = motion_previous
+        if return_str and isinstance(motion_results, list):
+            motion_results = "; ".join(f"{i+1}.{x}" for i, x in enumerate(motion_results)) + "."
+        results.append(motion_results)
+    return results
+
+
 def resample_data(data, target_rate):
     """
     Resamples the input data to the specified target sampling rate.
@@ -71,11 +174,8 @@ def resample_data(data, target_rate):
     # Generate new timestamps for the target sampling rate
     new_timestamps = np.arange(timestamps[0], timestamps[-1], 1 / target_rate)
 
-    # Perform interpolation for each column of sensor data
-    interpolated_data = np.zeros((len(new_timestamps), sensor_data.shape[1]))
-    for i in range(sensor_data.shape[1]):
-        interpolator = interp1d(timestamps, sensor_data[:, i], kind='linear', fill_value="extrapolate")
-        interpolated_data[:, i] = interpolator(new_timestamps)
+    # Interpolate all columns of sensor data at once
+    interpolated_data = interpolate_linear(timestamps, sensor_data, new_timestamps)
 
     # Combine new timestamps (converted back to milliseconds) and interpolated data
     resampled_data = np.column_stack((new_timestamps * 1000, interpolated_data))
@@ -83,6 +183,34 @@ def resample_data(data, target_rate):
     return resampled_data
 
 
+def interpolate_linear(x, y, x_new):
+    """
+    Linear interpolation of every column of y, extrapolating linearly outside of x.
+
+    Gives the same values as interp1d(x, y[:, i], kind='linear', fill_value="extrapolate")(x_new) for each column i,
+    with one search of x_new instead of one interp1d object per column.
+
+    Parameters:
+        x (numpy.ndarray): Sample positions, of length N.
+        y (numpy.ndarray): N*C array of sample values.
+        x_new (numpy.ndarray): Positions to interpolate at, of length M.
+
+    Returns:
+        numpy.ndarray: M*C float64 array of interpolated values.
+    """
+    # Same steps as interp1d: stable sort by x, then the segment of x_new found by searchsorted, clipped to the
+    # first and last segments for extrapolation
+    order = np.argsort(x, kind="mergesort")
+    x, y = x[order], y[order]
+    if not np.issubdtype(y.dtype, np.inexact):
+        y = y.astype(np.float64)
+    hi = np.searchsorted(x, x_new).clip(1, len(x) - 1)
+    lo = hi - 1
+    x_lo, y_lo = x[lo], y[lo]
+    slope = (y[hi] - y_lo) / (x[hi] - x_lo)[:, None]
+    return (slope * (x_new - x_lo)[:, None] + y_lo).astype(np.float64, copy=False)
+
+
 def step_pick(signals, thre=0.3):
     sm1 = signals - np.roll(signals, -1)
     sm1[-1] = 0.0
@@ -92,26 +220,157 @@ def step_pick(signals, thre=0.3):
     return peaks
 
 
+@lru_cache(maxsize=32)
+def butter_lowpass(filter_frequency, fs, order=2):
+    # Second-order sections of a low-pass Butterworth filter, designed once per (cutoff, rate, order).
+    # The array is shared by all callers and must not be modified (sosfilt needs it writable, so it is not locked).
+    return signal.butter(order, filter_frequency, btype='lowpass', output='sos', fs=fs)
+
+
 def step_detect(acce, filter_frequency=2.0, fs=None, fs_default=30, count=True):
-    if acce.size == 0:
-        return None
-    if fs is None:
-        acc = resample_data(acce, fs_default)[:, 1:]
-        fs = fs_default
-    else:
-        acc = acce[:, 1:]
-    def filter(signals):
-        sos = signal.butter(2, filter_frequency, btype='lowpass', output='sos', fs=fs)  # [0.1, 0.9]
-        return signal.sosfilt(sos, signals)
-
-    acce_processed = np.linalg.norm(acc, axis=1)
-    acce_processed -= np.mean(acce_processed)
-    acce_filtered = filter(acce_processed)
-    # plot_sensor_peaks(acce_filtered)
-    peaks = step_pick(acce_filtered, thre=0.3)
-    if count:
-        return np.sum(peaks)
-    return peaks
+    return step_detect_batch([acce], filter_frequency, fs, fs_default, count)[0]
+
+
+def step_detect_batch(acces, filter_frequency=2.0, fs=None, fs_default=30, count=True):
+    """
+    Step detection of many accelerometer windows at once, same results as calling step_detect on each window.
+
+    The low-pass filter is designed once and all windows are filtered in a single sosfilt call.
+
+    Parameters:
+        acces (list): N*4 accelerometer arrays [timestamp, acc_x, acc_y, acc_z], one per window.
+        filter_frequency (float): Cutoff frequency of the low-pass filter in Hz.
+        fs (float): Sampling rate of the windows, None to resample them to fs_default first.
+        fs_default (float): Resampling rate in Hz when fs is None.
+        count (bool): Return step counts instead of the boolean peak arrays.
+
+    Returns:
+        list: Step count (or peaks) of each window, None for empty windows.
+    """
+    signals = []
+    for acce in acces:
+        if acce.size == 0:
+            signals.append(None)
+            continue
+        acc = resample_data(acce, fs_default)[:, 1:] if fs is None else acce[:, 1:]
+        if len(acc) == 0:
+            # Raised by sosfilt in the former per-window implementation
+            raise ValueError("no accelerometer sample after resampling, the window spans less than 1 / fs")
+        acce_processed = np.linalg.norm(acc, axis=1)
+        acce_processed -= np.mean(acce_processed)
+        signals.append(acce_processed)
+    results = [None] * len(signals)
+    indices = [i for i, acce_processed in enumerate(signals) if acce_processed is not None]
+    if len(indices) == 0:
+        return results
+
+    sos = butter_lowpass(filter_frequency, fs_default if fs is None else fs)  # [0.1, 0.9]
+    # The filter is causal, so the zeros padding the shorter windows do not change their filtered samples
+    lengths = [len(signals[i]) for i in indices]
+    padded = np.zeros((len(indices), max(lengths)), dtype=np.result_type(*[signals[i] for i in indices]))
+    for row, (i, length) in enumerate(zip(indices, lengths)):
+        padded[row, :length] = signals[i]
+    acce_filtered = signal.sosfilt(sos, padded, axis=-1)
+    for row, (i, length) in enumerate(zip(indices, lengths)):
+        # plot_sensor_peaks(acce_filtered[row, :length])
+        peaks = step_pick(acce_filtered[row, :length], thre=0.3)
+        results[i] = np.sum(peaks) if count else peaks
+    return results
+
+
+class StepDetector:
+    """
+    Streaming step detection over consecutive accelerometer chunks, e.g. the sessions of a long recording.
+
+    Same pipeline as step_detect (resampling, norm, low-pass filter, peak picking), but the state is carried from
+    one chunk to the next: the resampling grid and the last sample for interpolation, the filter state zi, and the
+    last filtered samples whose peak status depends on the next sample. A recording can thus be processed chunk by
+    chunk in constant memory, without filter start-up transients at chunk boundaries, and the detected steps do not
+    depend on how the recording is cut into chunks. Steps are returned as timestamps, so the steps of any window can
+    be counted later from them without running the detection again.
+
+    step_detect removes the mean of the whole window, which is not available while streaming. StepDetector removes
+    an exponential moving average of the norm instead, so its counts are close to but not the same as step_detect.
+    """
+
+    def __init__(self, fs=30, filter_frequency=2.0, thre=0.3, mean_window=10.0, resample=True):
+        """
+        Parameters:
+            fs (float): Sampling rate of the filtered signal in Hz.
+            filter_frequency (float): Cutoff frequency of the low-pass filter in Hz.
+            thre (float): Minimum filtered amplitude of a step peak.
+            mean_window (float): Time constant in seconds of the moving average removed from the norm.
+            resample (bool): Resample the chunks to fs, set False if they are already sampled at fs.
+        """
+        self.fs = fs
+        self.thre = thre
+        self.resample = resample
+        self.sos = butter_lowpass(filter_frequency, fs)
+        alpha = 1.0 / (mean_window * fs)
+        self.mean_coefficients = ([alpha], [1.0, alpha - 1.0])
+        self.reset()
+
+    def reset(self):
+        # Forget the previous chunks, to start a new recording
+        self.zi = np.zeros((self.sos.shape[0], 2))
+        self.mean_zi = None
+        self.last_sample = None
+        self.grid_start = None
+        self.grid_index = 0
+        self.tail = np.zeros(0)
+        self.tail_times = np.zeros(0)
+        self.steps = 0
+
+    def resample_chunk(self, acce):
+        # Samples of the chunk on the grid grid_start + k / fs, interpolated from the raw samples of this chunk and
+        # the last raw sample of the previous one
+        data = acce if self.last_sample is None else np.vstack([self.last_sample, acce])
+        self.last_sample = np.array(acce[-1], dtype=np.float64)
+        if self.grid_start is None:
+            self.grid_start = float(data[0, 0])
+        period = 1000.0 / self.fs
+        grid_end = int(np.ceil((float(data[-1, 0]) - self.grid_start) / period))
+        times = self.grid_start + np.arange(self.grid_index, max(grid_end, self.grid_index)) * period
+        # Like resample_data, the grid stops before the last timestamp
+        times = times[times < data[-1, 0]]
+        self.grid_index += len(times)
+        return times, interpolate_linear(np.asarray(data[:, 0], dtype=np.float64), data[:, 1:], times)
+
+    def process(self, acce):
+        """
+        Detect the steps of the next chunk of the recording.
+
+        Parameters:
+            acce (numpy.ndarray): N*4 array [timestamp, acc_x, acc_y, acc_z] following the previous chunk in time.
+
+        Returns:
+            numpy.ndarray: Timestamps in milliseconds of the steps detected so far and not returned before. The step
+            at the very end of a chunk is only returned with the next chunk, once the following sample is known.
+        """
+        if acce.size == 0:
+            return np.zeros(0)
+        if self.resample:
+            times, acc = self.resample_chunk(acce)
+        else:
+            times, acc = np.asarray(acce[:, 0], dtype=np.float64), acce[:, 1:]
+        if len(times) == 0:
+            return np.zeros(0)
+
+        norm = np.linalg.norm(acc, axis=1)
+        if self.mean_zi is None:
+            # The moving average starts at the first sample
+            self.mean_zi = np.array([-self.mean_coefficients[1][1] * norm[0]])
+        mean, self.mean_zi = signal.lfilter(*self.mean_coefficients, norm, zi=self.mean_zi)
+        filtered, self.zi = signal.sosfilt(self.sos, norm - mean, zi=self.zi)
+
+        # Peaks as in step_pick, with the last two filtered samples of the previous chunk in front
+        values = np.concatenate([self.tail, filtered])
+        value_times = np.concatenate([self.tail_times, times])
+        center = values[1:-1]
+        peaks = np.flatnonzero((center > self.thre) & (center > values[:-2]) & (center > values[2:])) + 1
+        self.tail, self.tail_times = values[-2:], value_times[-2:]
+        self.steps += len(peaks)
+        return value_times[peaks]
 
 
 def step_counter(data):
@@ -144,10 +403,12 @@ def step_counter(data):
     steps = 0
     last_step_time = None
 
-    for i in range(1, len(acc_centered) - 1):
-        if acc_centered[i] > threshold and acc_centered[i] > acc_centered[i - 1] and acc_centered[i] > acc_centered[i + 1]:
-            current_time = data[i, 0]
-            if last_step_time is None or (current_time - last_step_time) > min_step_interval:
-                steps += 1
-                last_step_time = current_time
+    # Candidate peaks: above the threshold and above both neighbours
+    center = acc_centered[1:-1]
+    candidates = np.flatnonzero((center > threshold) & (center > acc_centered[:-2]) & (center > acc_centered[2:])) + 1
+    # A candidate is a step if it comes more than min_step_interval after the previous step
+    for current_time in data[candidates, 0].tolist():
+        if last_step_time is None or (current_time - last_step_time) > min_step_interval:
+            steps += 1
+            last_step_time = current_time
     return steps
\ No newline at end of file
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @File    : bench_quote_repair.py
+# @Description : Benchmark of loading WiFi.csv with quote repair, against the former join-and-StringIO path
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sensortool import Experiment
+
+SSIDS = ['"HKUST"', '"eduroam"', '', '"Cafe "bad', '"powan"phone"', '"小龙翻大江"', '"Universities WiFi"']
+
+
+def write_wifi_file(path, num_rows, seed=0):
+    rng = random.Random(seed)
+    timestamp = 1736679625787
+    with open(path, 'w', encoding='utf-8') as file:
+        for i in range(num_rows):
+            if i % 20 == 0:
+                timestamp += 5000
+            file.write('%d,%d,%d,%s,aa:bb:cc:%02x:%02x:%02x,%d,%d\n' % (
+                timestamp, 20, timestamp - 500, rng.choice(SSIDS), rng.randrange(256), rng.randrange(256),
+                rng.randrange(256), rng.choice([2437, 5745]), rng.randrange(-95, -40)))
+
+
+def read_with_string_io(file_path):
+    # The repair path before QuoteRepairReader
+    fixed_lines = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.count('"') % 2 != 0:
+                line = line.replace('"', '')
+            fixed_lines.append(line.strip())
+    fixed_data = "\n".join(fixed_lines)
+    return pd.read_csv(StringIO(fixed_data), header=None).values
+
+
+def measure(function, file_path, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = function(file_path)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function(file_path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return data, min(times), peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the quote repair of WiFi.csv')
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of rows of the generated WiFi.csv')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs, the best one is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = os.path.join(folder, 'WiFi.csv')
+        write_wifi_file(file_path, args.rows)
+        print('WiFi.csv: %d rows, %.1f MB' % (args.rows, os.path.getsize(file_path) / 1024 ** 2))
+        data_old, time_old, peak_old = measure(read_with_string_io, file_path, args.repeat)
+        data_new, time_new, peak_new = measure(lambda path: Experiment.read_from_file(path, fix=True), file_path,
+                                               args.repeat)
+
+    print('StringIO:          %.3f s, peak Python memory %.1f MB' % (time_old, peak_old / 1024 ** 2))
+    print('QuoteRepairReader: %.3f s, peak Python memory %.1f MB' % (time_new, peak_new / 1024 ** 2))
+    print('Same output: %s' % pd.DataFrame(data_old).equals(pd.DataFrame(data_new)))
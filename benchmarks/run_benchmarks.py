@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @File    : run_benchmarks.py
+# @Description : Benchmarks of the loading, preprocessing and evaluation stages, recorded in a JSONL history
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import process_template
+from algorithm.motion_detection import step_detect
+from journal_evaluation import evaluate
+from sensortool import Experiment
+from synthetic import generate_experiment
+
+HISTORY_PATH = os.path.join(ROOT, 'benchmarks', 'history.jsonl')
+
+
+def measure(function, repeat):
+    """
+    Time a function several times.
+
+    Parameters:
+    - function (callable): Called without arguments, returns the number of calls it made to the measured code.
+    - repeat (int): Number of timed runs.
+
+    Returns:
+    - dict: The best and median run times in seconds and the number of calls of a run.
+    """
+    times = []
+    for _ in range(repeat):
+        # The progress messages of the measured code are discarded to keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            calls = function()
+            times.append(time.perf_counter() - start)
+    return {'best': min(times), 'median': float(np.median(times)), 'calls': calls}
+
+
+def window_experiments(experiments, time_window):
+    # Sub-experiments of every time window, as passed to the preprocess_* functions
+    windows = []
+    for exp in experiments:
+        _, time_start, time_end = process_template.preprocess_time(exp.label)
+        for window_start in range(int(time_start), int(time_end), time_window * 1000):
+            windows.append(exp.filter_by_timestamp(window_start, window_start + time_window * 1000))
+    return windows
+
+
+def preprocess_cases(time_window):
+    # Name -> function of one window sub-experiment, calling one preprocess_* function
+    return {
+        'preprocess_linear_accelerometer': lambda w: process_template.preprocess_linear_accelerometer(
+            w.linear_accelerometer),
+        'preprocess_step_counter': lambda w: process_template.preprocess_step_counter(
+            w.step_counter, time_window, w.accelerometer),
+        'preprocess_pressure': lambda w: process_template.preprocess_pressure(w.pressure, time_window),
+        'preprocess_light': lambda w: process_template.preprocess_light(w.light),
+        'preprocess_location': lambda w: process_template.preprocess_location(w.location, time_window),
+        'preprocess_satellite': lambda w: process_template.preprocess_satellite(w.satellite),
+        'preprocess_wifi': lambda w: process_template.preprocess_wifi(w.wifi, schema=w.schema('wifi')),
+        'preprocess_time': lambda w: process_template.preprocess_time(w.label),
+        'preprocess_label': lambda w: process_template.preprocess_label(w.label),
+    }
+
+
+def run_benchmarks(data_path, repeat=3, time_window=20, metrics=('chrF', 'ROUGE'), evaluation=True):
+    """
+    Run every benchmark on an experiment folder.
+
+    Returns:
+    - dict: Benchmark name -> result of measure.
+    """
+    results = {}
+
+    def load(**kwargs):
+        # Sessions are loaded with their text columns encoded, as in process_template
+        return lambda: len(Experiment.from_directories(data_path, encode=True, **kwargs))
+
+    print('Benchmarking the loading of %s' % data_path)
+    results['from_directories_uncached'] = measure(load(use_cache=False), repeat)
+    # The first cached load writes the cache files, the timed ones read them
+    measure(load(use_cache=True), 1)
+    results['from_directories_cached'] = measure(load(use_cache=True), repeat)
+    results['from_directories_lazy'] = measure(load(use_cache=True, lazy=True), repeat)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        experiments = Experiment.from_directories(data_path, use_cache=False, encode=True)
+    results['filter_by_timestamp'] = measure(lambda: len(window_experiments(experiments, time_window)), repeat)
+
+    print('Benchmarking the preprocessing')
+    windows = [w for w in window_experiments(experiments, time_window) if w.label.size > 0]
+    for name, case in preprocess_cases(time_window).items():
+        results[name] = measure(lambda: sum(1 for w in windows if case(w) is not None), repeat)
+    results['step_detect'] = measure(lambda: sum(1 for exp in experiments if step_detect(exp.accelerometer) >= 0),
+                                     repeat)
+    results['journal_experiment'] = measure(
+        lambda: sum(len(process_template.journal_experiment(exp, time_window)[0]) for exp in experiments), repeat)
+
+    if evaluation:
+        print('Benchmarking the evaluation with %s' % ', '.join(metrics))
+        # Every reference key is given its own reference journals as generated journals, so that all keys are matched
+        path_ref = os.path.join(ROOT, 'journals_reference.json')
+        with open(path_ref, 'r', encoding='utf-8') as file:
+            generated = {key: value['reference_journals'] for key, value in json.load(file).items()}
+        with tempfile.TemporaryDirectory() as folder:
+            path_generated = os.path.join(folder, 'journals_generated.json')
+            with open(path_generated, 'w', encoding='utf-8') as file:
+                json.dump(generated, file, ensure_ascii=False)
+            results['evaluate'] = measure(lambda: len(evaluate(path_ref, path_generated, list(metrics))[0]), repeat)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def append_history(path, record):
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def compare(results, previous, threshold=1.2):
+    """
+    Print the best times next to those of a previous record of the same configuration.
+
+    Parameters:
+    - results (dict): The current results.
+    - previous (dict): A previous history record, or None.
+    - threshold (float): Ratio to the previous time above which a benchmark is flagged as a regression.
+    """
+    previous_results = previous['results'] if previous is not None else {}
+    if previous is not None:
+        print('Compared with %s (commit %s)' % (previous['time'], previous['commit']))
+    for name, result in results.items():
+        line = '%-34s %10.4f s  x%d' % (name, result['best'], result['calls'])
+        if name in previous_results:
+            ratio = result['best'] / max(previous_results[name]['best'], 1e-12)
+            line += '   %6.2fx%s' % (ratio, '  REGRESSION' if ratio > threshold else '')
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the AutoLife processing stages')
+    parser.add_argument('--data', help='Experiment folder to benchmark, a synthetic one is generated if not given')
+    parser.add_argument('--sessions', type=int, default=30, help='Number of generated sessions')
+    parser.add_argument('--duration', type=float, default=15.0, help='Duration of generated sessions in seconds')
+    parser.add_argument('--imu-rate', type=float, default=50.0, help='Motion sensor rate of generated sessions in Hz')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs, the best one is recorded')
+    parser.add_argument('--time-window', type=int, default=20)
+    parser.add_argument('--metrics', nargs='+', default=['chrF', 'ROUGE'], help='Metrics of the evaluate benchmark')
+    parser.add_argument('--no-evaluate', action='store_true', help='Skip the evaluate benchmark')
+    parser.add_argument('--history', default=HISTORY_PATH, help='JSONL file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help='Print the results without recording them')
+    args = parser.parse_args()
+
+    config = {'data': args.data, 'sessions': args.sessions, 'duration': args.duration, 'imu_rate': args.imu_rate,
+              'time_window': args.time_window, 'metrics': None if args.no_evaluate else args.metrics}
+    if args.data is not None:
+        config.update(sessions=None, duration=None, imu_rate=None)
+        results = run_benchmarks(args.data, args.repeat, args.time_window, args.metrics, not args.no_evaluate)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            generate_experiment(folder, args.sessions, duration=args.duration, rates={'imu': args.imu_rate})
+            results = run_benchmarks(folder, args.repeat, args.time_window, args.metrics, not args.no_evaluate)
+
+    record = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+              'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.node(),
+              'config': config, 'results': results}
+    # Only runs of the same configuration on the same machine are comparable
+    previous = [r for r in read_history(args.history) if r['config'] == config and r['machine'] == record['machine']]
+    compare(results, previous[-1] if previous else None)
+    if not args.no_save:
+        append_history(args.history, record)
+        print('Results appended to %s' % args.history)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @File    : synthetic.py
+# @Description : Generator of synthetic AutoLife experiments following the CSV formats of data/README.md
+import argparse
+import datetime
+import os
+
+import numpy as np
+import pytz
+
+# Sampling rates in Hz of the streaming sensors, and scan intervals in seconds of the scanning sensors
+DEFAULT_RATES = {
+    'imu': 50.0,
+    'light': 5.0,
+    'pressure': 5.0,
+    'wifi_interval': 5.0,
+    'bluetooth_interval': 3.0,
+    'cellular_interval': 5.0,
+    'satellite_interval': 5.0,
+    'location_interval': 1.0,
+}
+
+SSIDS = ['"HKUST"', '"eduroam"', '', '"Universities WiFi"', '"Cafe "bad', '"小龙翻大江深圳店"', '"MTR Free Wi-Fi"']
+DEVICE_NAMES = ['Reyee-4594', 'null', 'Mi Band 7', 'null', 'JBL Flip 5']
+
+
+def write_rows(path, rows, fmt):
+    # rows is a float64 array whose first column is the millisecond timestamp
+    with open(path, 'w', encoding='utf-8') as file:
+        if len(rows) > 0:
+            np.savetxt(file, rows, fmt=fmt, delimiter=',')
+
+
+def stream_timestamps(rng, start, duration, rate):
+    num = int(duration * rate)
+    return np.sort(rng.integers(start, start + int(duration * 1000), num))
+
+
+def scan_times(start, duration, interval, offset):
+    return np.arange(start + offset, start + int(duration * 1000), int(interval * 1000), dtype=np.int64)
+
+
+def generate_session(dir_path, start, duration=15.0, rates=None, walking=False, seed=0):
+    """
+    Write one session folder with all sensor CSV files.
+
+    Parameters:
+    - dir_path (str): The session folder, created if missing.
+    - start (int): Unix timestamp of the session start in milliseconds.
+    - duration (float): Session duration in seconds.
+    - rates (dict): Overrides of DEFAULT_RATES.
+    - walking (bool): Whether the user walks during the session, which drives the accelerometer and step counter.
+    - seed (int): Random seed of the session.
+    """
+    rates = {**DEFAULT_RATES, **(rates or {})}
+    rng = np.random.default_rng(seed)
+    os.makedirs(dir_path, exist_ok=True)
+    path = lambda file_name: os.path.join(dir_path, file_name)
+
+    # Motion sensors: walking adds a 2 Hz gait oscillation
+    timestamps = stream_timestamps(rng, start, duration, rates['imu'])
+    phase = 2 * np.pi * 2.0 * (timestamps - start) / 1000
+    gait = (2.5 * np.sin(phase))[:, None] if walking else 0.0
+    gravity = np.array([0.2, 0.3, 9.8])
+    for file_name, base, noise in [('Accelerometer.csv', gravity, 0.05), ('Linear_Accelerometer.csv', 0.0, 0.02),
+                                   ('Gyroscope.csv', 0.0, 0.01), ('Magnetometer.csv', np.array([5.0, -37.0, 100.0]), 1.0),
+                                   ('Gravity.csv', gravity, 0.01)]:
+        values = base + noise * rng.standard_normal((len(timestamps), 3))
+        if file_name in ('Accelerometer.csv', 'Linear_Accelerometer.csv'):
+            values = values + gait
+        write_rows(path(file_name), np.column_stack([timestamps, values.astype(np.float32)]), ['%d'] + ['%.8g'] * 3)
+    quaternion = np.column_stack([timestamps, rng.normal(0, 0.1, (len(timestamps), 3)).astype(np.float32),
+                                  np.full(len(timestamps), 0.99, dtype=np.float32)])
+    write_rows(path('Game_Rotation.csv'), quaternion, ['%d'] + ['%.8g'] * 4)
+    write_rows(path('Rotation.csv'), np.column_stack([quaternion, np.zeros(len(timestamps))]), ['%d'] + ['%.8g'] * 5)
+
+    # Environment sensors
+    for file_name, rate, value, noise in [('Light.csv', rates['light'], 320.0, 20.0),
+                                          ('Pressure.csv', rates['pressure'], 1015.39, 0.01)]:
+        times = stream_timestamps(rng, start, duration, rate)
+        write_rows(path(file_name), np.column_stack([times, value + noise * rng.standard_normal(len(times))]),
+                   ['%d', '%.8g'])
+    write_rows(path('Proximity.csv'), np.array([[start + 1, 8.000183]]), ['%d', '%.7f'])
+
+    # Step counter only logs a row when the count changes
+    if walking:
+        times = scan_times(start, duration, 3.0, 0)
+        write_rows(path('Step_Counter.csv'), np.column_stack([times, 200.0 + 6 * np.arange(len(times))]),
+                   ['%d', '%.1f'])
+    else:
+        write_rows(path('Step_Counter.csv'), np.array([]), '%s')
+
+    # Scanning sensors, several rows share the timestamp of a scan
+    with open(path('WiFi.csv'), 'w', encoding='utf-8') as file:
+        for scan in scan_times(start, duration, rates['wifi_interval'], 1000):
+            file.write('%d,0,0,"powanphone",3e:ac:ab:87:c6:08,2437,-61\n' % scan)
+            count = int(rng.integers(3, 12))
+            for k in range(count):
+                file.write('%d,%d,%d,%s,c2:a4:76:8b:%02x:%02x,%d,%d\n' % (
+                    scan + 10, count, scan - 500, SSIDS[rng.integers(len(SSIDS))], k, int(rng.integers(256)),
+                    [2437, 5745][k % 2], int(rng.integers(-95, -40))))
+    with open(path('Bluetooth.csv'), 'w', encoding='utf-8') as file:
+        for scan in scan_times(start, duration, rates['bluetooth_interval'], 100):
+            for k in range(int(rng.integers(1, 4))):
+                file.write('%d,%s,94:45:DB:76:A4:%02X,%d,,%d,10\n' % (
+                    scan + k, DEVICE_NAMES[rng.integers(len(DEVICE_NAMES))], k, int(rng.integers(-100, -60)), k % 3))
+    with open(path('Cellular.csv'), 'w', encoding='utf-8') as file:
+        for scan in scan_times(start, duration, rates['cellular_interval'], 200):
+            file.write('%d,1,5,2,GSM,%d,4271,%d,true\n' % (scan, 3739959650133 + scan - start, int(rng.integers(-110, -70))))
+            file.write('%d,1,5,2,GSM,%d,4261,%d,false\n' % (scan, 3739959650133 + scan - start, int(rng.integers(-110, -70))))
+    with open(path('Satellite.csv'), 'w', encoding='utf-8') as file:
+        for scan in scan_times(start, duration, rates['satellite_interval'], 500):
+            count = int(rng.integers(4, 20))
+            for k in range(count):
+                file.write('%d,%d,%d,%s,%.1f,1,%.1f,%.1f\n' % (
+                    scan, count, k + 1, 'true' if k % 4 == 0 else 'false', 0.0 if k % 3 == 0 else rng.uniform(10, 40),
+                    rng.uniform(0, 360), rng.uniform(0, 90)))
+    with open(path('Location.csv'), 'w', encoding='utf-8') as file:
+        speed = 1.2 if walking else 0.0
+        for k, scan in enumerate(scan_times(start, duration, rates['location_interval'], 2000)):
+            category, provider = (2, 'fused') if k % 2 == 0 else (1, 'network')
+            file.write('%d,%d,%d,%s,%.7f,%.7f,%.6f,%.1f,%.3f,0.0\n' % (
+                scan, category, scan - 200, provider, 114.0568172 + 1e-5 * k * speed, 22.5364385,
+                rng.uniform(-40, 40), speed, rng.uniform(5, 90)))
+    open(path('Activity.csv'), 'w').close()
+
+    with open(path('Label.csv'), 'w') as file:
+        file.write('%d,0,0,0\n%d,-1,-1,-1\n' % (start, start + int(duration * 1000)))
+
+
+def generate_experiment(root, num_sessions=60, start=1736679625787, session_interval=60.0, duration=15.0, rates=None,
+                        seed=0):
+    """
+    Write an experiment folder of sessions started every session_interval seconds, named by their start time in the
+    'HH_MM_SS' format (UTC+8) like the real dataset. Sessions alternate between walking and staying still.
+
+    Returns:
+    - list: The session folders.
+    """
+    folders = []
+    for i in range(num_sessions):
+        session_start = start + int(i * session_interval * 1000)
+        date = datetime.datetime.fromtimestamp(session_start / 1000, tz=pytz.timezone('Asia/Hong_Kong'))
+        folder = os.path.join(root, date.strftime('%H_%M_%S'))
+        generate_session(folder, session_start, duration, rates, walking=(i // 3) % 2 == 0, seed=seed + i)
+        folders.append(folder)
+    return folders
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic AutoLife experiment')
+    parser.add_argument('output_dir', help='Experiment folder to write the sessions to')
+    parser.add_argument('--sessions', type=int, default=60, help='Number of sessions, one per session interval')
+    parser.add_argument('--duration', type=float, default=15.0, help='Session duration in seconds')
+    parser.add_argument('--interval', type=float, default=60.0, help='Seconds between session starts')
+    parser.add_argument('--imu-rate', type=float, default=DEFAULT_RATES['imu'], help='Motion sensor rate in Hz')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    folders = generate_experiment(args.output_dir, args.sessions, session_interval=args.interval,
+                                  duration=args.duration, rates={'imu': args.imu_rate}, seed=args.seed)
+    print('Generated %d sessions in %s' % (len(folders), args.output_dir))
@@ -5,21 +5,26 @@
 # @Email   : 735820057@qq.com
 # @File    : 
 # @Description :
+import hashlib
+import importlib.metadata
 import json
+import math
 import os
 import re
-import nltk
-import numpy as np
-from collections import defaultdict
-from nltk.translate.bleu_score import sentence_bleu
-from nltk.translate.chrf_score import sentence_chrf, corpus_chrf
-from nltk.tokenize import word_tokenize
-from rouge import Rouge
-from nltk.translate import meteor
-from bert_score import score
-
-os.environ["HTTP_PROXY"] = "http://127.0.0.1:7890"
-os.environ["HTTPS_PROXY"] = "http://127.0.0.1:7890"
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from collections import Counter, defaultdict
+
+
+def use_proxy(proxy="http://127.0.0.1:7890"):
+    """
+    Route HTTP requests through a proxy, e.g. for downloading the BERTScore model or nltk data.
+    """
+    os.environ["HTTP_PROXY"] = proxy
+    os.environ["HTTPS_PROXY"] = proxy
+
 
 def extract_time_interval(name: str) -> int:
     """
@@ -50,6 +55,36 @@ def extract_time_interval(name: str) -> int:
     return end_min - start_min
 
 
+def build_key_index(keys):
+    """
+    Index journal keys by every time interval they contain, e.g. 'autolife_j240322_[1717-1746]'
+    is indexed under ('1717', '1746'), using the same pattern as extract_time_interval.
+
+    Returns:
+    dict: (start, end) -> keys containing that interval, in their original order.
+    """
+    index = defaultdict(list)
+    for key in keys:
+        for interval in dict.fromkeys(re.findall(r'\[(\d{4})-(\d{4})\]', key)):
+            index[interval].append(key)
+    return index
+
+
+def find_matching_key(key_ref, keys, key_index):
+    """
+    Find the first key that contains key_ref, i.e. the same experiment and time range.
+
+    Only the keys sharing the time interval of key_ref are scanned. Reference keys without an interval fall back
+    to scanning all keys.
+    """
+    match = re.search(r'\[(\d{4})-(\d{4})\]', key_ref)
+    candidates = key_index.get(match.groups(), []) if match else keys
+    for key in candidates:
+        if key_ref in key:
+            return key
+    return None
+
+
 def determine_interval(time, time_intervals):
     # Check if the time is beyond the last interval
     if time >= time_intervals[-1]:
@@ -76,52 +111,398 @@ def ensure_nltk_resource(resource_name: str, resource_path: str):
     Ensure that an NLTK resource is available.
     If not, download it automatically.
     """
+    import nltk
     try:
         nltk.data.find(resource_path)
     except LookupError:
         nltk.download(resource_name)
 
-def evaluate_metrics(reference_text, candidate_text, metric_names, device='cuda:0'):
-    # ensure_nltk_resource("punkt", "tokenizers/punkt")
-    # ensure_nltk_resource("punkt_tab", "tokenizers/punkt_tab")
-    candidate_text = candidate_text.lower()
-    reference_text = reference_text.lower()
+# Bump when a change to MetricEngine changes the scores, so that MetricStore does not return stale results
+METRIC_ENGINE_VERSION = 1
+
+
+def ngram_counts(sequence, n):
+    return Counter(zip(*[sequence[i:] for i in range(n)]))
+
+
+def overlap_count(counts, reference_counts):
+    # Number of n-grams of counts that are clipped by reference_counts, i.e. sum((counts & reference_counts).values())
+    if len(counts) > len(reference_counts):
+        counts, reference_counts = reference_counts, counts
+    return sum(min(count, reference_counts[ngram]) for ngram, count in counts.items() if ngram in reference_counts)
+
+
+def lcs_words(x, y):
+    """
+    Words of the longest common subsequence of x and y, reconstructed in the same way as the rouge package so that
+    ROUGE-L matches it on ties.
+    """
+    n, m = len(x), len(y)
+    table = [[0] * (m + 1)]
+    for i in range(1, n + 1):
+        previous, row = table[-1], [0]
+        word = x[i - 1]
+        for j in range(1, m + 1):
+            if word == y[j - 1]:
+                row.append(previous[j - 1] + 1)
+            else:
+                row.append(max(previous[j], row[j - 1]))
+        table.append(row)
+    words = set()
+    i, j = n, m
+    while i > 0 and j > 0:
+        if x[i - 1] == y[j - 1]:
+            words.add(x[i - 1])
+            i, j = i - 1, j - 1
+        elif table[i - 1][j] > table[i][j - 1]:
+            i -= 1
+        else:
+            j -= 1
+    return words
+
+
+def f_score(precision, recall):
+    return 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+
+
+# name -> (load, text statistics, included in 'ALL', batch) of every metric backend, see register_metric
+METRIC_BACKENDS = {}
+# name -> score function of the backends loaded so far
+LOADED_METRICS = {}
+
+
+def register_metric(name, load, stats=(), default=True, batch=False):
+    """
+    Register a metric backend that MetricEngine computes when name is in metric_names.
+
+    Parameters:
+    name (str): Name of the metric in metric_names.
+    load (callable): Imports what the metric needs and returns a function score(engine, reference, candidate)
+        returning a dict of scores, where reference and candidate are text statistics from MetricEngine.stats. It is
+        only called the first time the metric is requested.
+    stats (tuple): Text statistics the metric needs, among 'tokens', 'bleu', 'chrf' and 'rouge'.
+    default (bool): Whether 'ALL' includes the metric.
+    batch (bool): Whether the score function takes lists of references and candidates and returns a list of dicts,
+        for metrics that are much faster on batches, e.g. model-based ones.
+    """
+    METRIC_BACKENDS[name] = (load, tuple(stats), default, batch)
+    LOADED_METRICS.pop(name, None)
+
+
+def resolve_metric_names(metric_names):
+    """
+    Returns:
+    list: The registered metrics selected by metric_names, in the order of registration.
+    """
+    unknown = set(metric_names) - set(METRIC_BACKENDS) - {'ALL'}
+    if unknown:
+        raise ValueError("Unknown metrics %s, available: %s" % (sorted(unknown), list(METRIC_BACKENDS)))
+    return [name for name, (_, _, default, _) in METRIC_BACKENDS.items()
+            if name in metric_names or ('ALL' in metric_names and default)]
+
+
+def load_metric(name):
+    if name not in LOADED_METRICS:
+        LOADED_METRICS[name] = METRIC_BACKENDS[name][0]()
+    return LOADED_METRICS[name]
+
+
+class MetricEngine:
+    """
+    Computes the registered metrics (BLEU, chrF, ROUGE, METEOR and optionally BERTScore) for many
+    (reference, candidate) pairs.
+
+    Each unique text is tokenized and its n-grams are counted once, and every pair is scored from these shared counts.
+    The scores are the same as nltk's sentence_bleu, sentence_chrf and meteor and the rouge package with their
+    default settings. The libraries a metric needs are only imported when it is requested.
+    """
+
+    def __init__(self, metric_names, device=None):
+        self.metric_names = resolve_metric_names(metric_names)
+        self.device = device
+        self.scorers = [(load_metric(name), METRIC_BACKENDS[name][3]) for name in self.metric_names]
+        self.stat_names = {stat for name in self.metric_names for stat in METRIC_BACKENDS[name][1]}
+        self.text_stats = {}
+
+    def stats(self, text):
+        stats = self.text_stats.get(text)
+        if stats is not None:
+            return stats
+        text_lower = text.lower()
+        stats = {'text': text_lower}
+        if 'tokens' in self.stat_names or 'bleu' in self.stat_names:
+            from nltk.tokenize import word_tokenize
+            stats['tokens'] = word_tokenize(text_lower)
+        if 'bleu' in self.stat_names:
+            stats['bleu'] = [ngram_counts(stats['tokens'], n) for n in range(1, 5)]
+        if 'chrf' in self.stat_names:
+            chars = re.sub(r"\s+", "", text_lower)
+            stats['chrf'] = [Counter(chars[i:i + n] for i in range(len(chars) - n + 1)) for n in range(1, 7)]
+        if 'rouge' in self.stat_names:
+            sentences = [" ".join(s.split()).split(" ") for s in text_lower.split(".") if len(s) > 0]
+            words = [word for sentence in sentences for word in sentence]
+            stats['sentences'] = sentences
+            stats['rouge'] = [set(words), set(zip(words, words[1:]))]
+        self.text_stats[text] = stats
+        return stats
+
+    @staticmethod
+    def bleu(reference, candidate):
+        # sentence_bleu with one reference, uniform weights up to 4-grams and no smoothing
+        hyp_len, ref_len = len(candidate['tokens']), len(reference['tokens'])
+        log_precisions = []
+        for n in range(1, 5):
+            numerator = overlap_count(candidate['bleu'][n - 1], reference['bleu'][n - 1])
+            if n == 1 and numerator == 0:
+                return 0
+            denominator = max(1, hyp_len - n + 1)
+            # Orders without any match count as the smallest positive float, as in nltk
+            log_precisions.append(0.25 * math.log(numerator / denominator if numerator != 0 else sys.float_info.min))
+        if hyp_len > ref_len:
+            brevity_penalty = 1
+        else:
+            brevity_penalty = math.exp(1 - ref_len / hyp_len)
+        return brevity_penalty * math.exp(math.fsum(log_precisions))
+
+    @staticmethod
+    def chrf(reference, candidate, beta=3.0, epsilon=1e-16):
+        # sentence_chrf with character n-grams of order 1 to 6, whitespace ignored
+        fscores = []
+        for ref_counts, hyp_counts in zip(reference['chrf'], candidate['chrf']):
+            tp = overlap_count(hyp_counts, ref_counts)
+            if tp == 0:
+                fscores.append(epsilon)
+                continue
+            precision, recall = tp / sum(hyp_counts.values()), tp / sum(ref_counts.values())
+            factor = beta ** 2
+            fscores.append((1 + factor) * (precision * recall) / (factor * precision + recall))
+        return sum(fscores) / len(fscores)
+
+    @staticmethod
+    def rouge(reference, candidate):
+        # Rouge().get_scores with exclusive n-grams and summary level ROUGE-L
+        if len(candidate['sentences']) == 0:
+            raise ValueError("Hypothesis is empty.")
+        if len(reference['sentences']) == 0:
+            raise ValueError("Reference is empty.")
+        scores = []
+        for hyp_ngrams, ref_ngrams in zip(candidate['rouge'], reference['rouge']):
+            overlap = len(hyp_ngrams & ref_ngrams)
+            precision = overlap / len(hyp_ngrams) if len(hyp_ngrams) > 0 else 0.0
+            recall = overlap / len(ref_ngrams) if len(ref_ngrams) > 0 else 0.0
+            scores.append((f_score(precision, recall), precision, recall))
+        union = set()
+        for ref_sentence in reference['sentences']:
+            for hyp_sentence in candidate['sentences']:
+                union |= lcs_words(ref_sentence, hyp_sentence)
+        precision, recall = len(union) / len(candidate['rouge'][0]), len(union) / len(reference['rouge'][0])
+        scores.append((f_score(precision, recall), precision, recall))
+        return scores
+
+    def score(self, reference_text, candidate_text):
+        return self.score_pairs([(reference_text, candidate_text)])[0]
+
+    def score_pairs(self, pairs):
+        references = [self.stats(reference_text) for reference_text, _ in pairs]
+        candidates = [self.stats(candidate_text) for _, candidate_text in pairs]
+        metric_dicts = [{} for _ in pairs]
+        for scorer, batch in self.scorers:
+            if batch:
+                scores = scorer(self, references, candidates) if pairs else []
+            else:
+                scores = [scorer(self, reference, candidate) for reference, candidate in zip(references, candidates)]
+            for metric_dict, scores_pair in zip(metric_dicts, scores):
+                metric_dict.update(scores_pair)
+        return metric_dicts
+
+
+def score_bleu(engine, reference, candidate):
+    return {'BLEU': engine.bleu(reference, candidate)}
+
+
+def score_chrf(engine, reference, candidate):
+    return {'chrF': engine.chrf(reference, candidate)}
+
+
+def score_rouge(engine, reference, candidate):
     metric_dict = {}
-    if 'BLEU' in metric_names or 'ALL' in metric_names:
-        candidate_tokens = word_tokenize(candidate_text)
-        reference_tokens = [word_tokenize(reference_text)]
-        bleu_score = sentence_bleu(reference_tokens, candidate_tokens)
-        metric_dict['BLEU'] = bleu_score
-    if 'chrF' in metric_names or 'ALL' in metric_names:
-        chrf_score = sentence_chrf(reference_text, candidate_text)
-        metric_dict['chrF'] = chrf_score
-    if 'ROUGE' in metric_names or 'ALL' in metric_names:
-        rouge_score = Rouge().get_scores(candidate_text, reference_text)
-        metric_dict['ROUGE-1 f'] = rouge_score[0]['rouge-1']['f']
-        metric_dict['ROUGE-1 p'] = rouge_score[0]['rouge-1']['p']
-        metric_dict['ROUGE-1 r'] = rouge_score[0]['rouge-1']['r']
-        metric_dict['ROUGE-2 f'] = rouge_score[0]['rouge-2']['f']
-        metric_dict['ROUGE-2 p'] = rouge_score[0]['rouge-2']['p']
-        metric_dict['ROUGE-2 r'] = rouge_score[0]['rouge-2']['r']
-        metric_dict['ROUGE-l f'] = rouge_score[0]['rouge-l']['f']
-        metric_dict['ROUGE-l p'] = rouge_score[0]['rouge-l']['p']
-        metric_dict['ROUGE-l r'] = rouge_score[0]['rouge-l']['r']
-    if 'METEOR' in metric_names or 'ALL' in metric_names:
-        candidate_tokens = word_tokenize(candidate_text)
-        reference_tokens = [word_tokenize(reference_text)]
-        me_score = meteor(reference_tokens, candidate_tokens)
-        metric_dict['METEOR'] = me_score
-    # if 'BERTScore' in metric_names or 'ALL' in metric_names:
-    #     # model_type = "bert-base-uncased" "microsoft/deberta-xlarge-mnli" | r"C:\Users\73582\Downloads\bert"
-    #     P, R, F1 = score([candidate_text], [reference_text], lang="en", model_type="bert-base-uncased",
-    #                      verbose=True)
-    #     # P, R, F1 = score([candidate_text], [reference_text], lang="en", model_type=r"C:\Users\73582\Downloads\bert", verbose=True, device=device, num_layers=9)
-    #     metric_dict['BERTScore p'] = P.item()
-    #     metric_dict['BERTScore r'] = R.item()
-    #     metric_dict['BERTScore f'] = F1.item()
+    for name, (f, p, r) in zip(['ROUGE-1', 'ROUGE-2', 'ROUGE-l'], engine.rouge(reference, candidate)):
+        metric_dict[name + ' f'] = f
+        metric_dict[name + ' p'] = p
+        metric_dict[name + ' r'] = r
     return metric_dict
 
 
+def load_meteor():
+    from nltk.translate import meteor
+
+    def score_meteor(engine, reference, candidate):
+        return {'METEOR': meteor([reference['tokens']], candidate['tokens'])}
+    return score_meteor
+
+
+def default_device():
+    # The first GPU if torch can use one, otherwise the CPU
+    try:
+        import torch
+    except ImportError:
+        return 'cpu'
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def load_bertscore():
+    # Needs bert_score and torch, downloads the model on first use (see use_proxy)
+    from bert_score import BERTScorer
+    # device -> BERTScorer, so that the model is only loaded once per device
+    scorers = {}
+
+    def score_bertscore(engine, references, candidates):
+        device = engine.device if engine.device is not None else default_device()
+        if device not in scorers:
+            # model_type = "bert-base-uncased" "microsoft/deberta-xlarge-mnli" | r"C:\Users\73582\Downloads\bert"
+            scorers[device] = BERTScorer(lang="en", model_type="bert-base-uncased", device=device)
+        P, R, F1 = scorers[device].score([candidate['text'] for candidate in candidates],
+                                         [reference['text'] for reference in references])
+        return [{'BERTScore p': p, 'BERTScore r': r, 'BERTScore f': f}
+                for p, r, f in zip(P.tolist(), R.tolist(), F1.tolist())]
+    return score_bertscore
+
+
+register_metric('BLEU', lambda: score_bleu, stats=('bleu',))
+register_metric('chrF', lambda: score_chrf, stats=('chrf',))
+register_metric('ROUGE', lambda: score_rouge, stats=('rouge',))
+register_metric('METEOR', load_meteor, stats=('tokens',))
+register_metric('BERTScore', load_bertscore, default=False, batch=True)
+
+
+def package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return 'none'
+
+
+def score_pairs(pairs, metric_names):
+    """
+    Score a list of (reference, candidate) pairs with a MetricEngine, so that texts shared between pairs are only
+    tokenized once.
+    """
+    return MetricEngine(metric_names).score_pairs(pairs)
+
+
+class MetricStore:
+    """
+    An on-disk memo of metric results, keyed by a hash of the reference text, the candidate text, the metric set and
+    the version of the metric implementations.
+
+    evaluate only scores the pairs missing from the store, so re-evaluating after regenerating a few journals only
+    costs time for the changed pairs.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+        path (str): SQLite file of the store, created if missing.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.version = '%d-nltk%s-bert_score%s' % (METRIC_ENGINE_VERSION, package_version('nltk'),
+                                                    package_version('bert_score'))
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS metric_cache (key TEXT PRIMARY KEY, value TEXT)")
+
+    def key(self, reference_text, candidate_text, metric_names):
+        request = json.dumps([reference_text, candidate_text, sorted(set(metric_names)), self.version])
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Returns:
+        dict: key -> metric dict of the keys found in the store.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        # Stay below the SQLite limit on the number of query parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute("SELECT key, value FROM metric_cache WHERE key IN (%s)"
+                                           % ','.join('?' * len(chunk)), chunk).fetchall()
+            found.update((key, json.loads(value)) for key, value in rows)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        Parameters:
+        items (iterable): (key, metric dict) tuples.
+        """
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO metric_cache VALUES (?, ?)",
+                                        [(key, json.dumps(value)) for key, value in items])
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM metric_cache")
+        self.hits, self.misses = 0, 0
+
+    def close(self):
+        self.connection.close()
+
+
+def score_matches(pairs, metric_names, workers=None, store=None):
+    """
+    Score the (reference, candidate) pairs of every matched journal.
+
+    Parameters:
+    pairs (list): One list of (reference, candidate) pairs per match.
+    metric_names (list): Names of the metrics to compute.
+    workers (int): Number of worker processes, None to score in this process.
+    store (MetricStore): Memo of earlier results. Only the pairs missing from it are scored, and their results are
+        added to it.
+
+    Returns:
+    list: One list of metric dicts per match, in the order of pairs.
+    """
+    metric_dicts = [[None] * len(pairs_key) for pairs_key in pairs]
+    if store is not None:
+        store_keys = [[store.key(j_ref, j_gen, metric_names) for j_ref, j_gen in pairs_key] for pairs_key in pairs]
+        found = store.get_many(key for keys in store_keys for key in keys)
+        metric_dicts = [[found.get(key) for key in keys] for keys in store_keys]
+
+    # Only the pairs without a result are scored
+    missing = [[i for i, metric_dict in enumerate(metric_dicts_key) if metric_dict is None]
+               for metric_dicts_key in metric_dicts]
+    matches = [m for m in range(len(pairs)) if missing[m]]
+    pairs_missing = [[pairs[m][i] for i in missing[m]] for m in matches]
+    if workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            scored = list(executor.map(partial(score_pairs, metric_names=metric_names), pairs_missing,
+                                       chunksize=max(1, len(pairs_missing) // (workers * 4))))
+    else:
+        engine = MetricEngine(metric_names)
+        scored = [engine.score_pairs(pairs_key) for pairs_key in pairs_missing]
+
+    for m, scored_key in zip(matches, scored):
+        for i, metric_dict in zip(missing[m], scored_key):
+            metric_dicts[m][i] = metric_dict
+    if store is not None:
+        store.put_many((store_keys[m][i], metric_dicts[m][i]) for m in matches for i in missing[m])
+    return metric_dicts
+
+
+def evaluate_metrics(reference_text, candidate_text, metric_names, device=None):
+    # ensure_nltk_resource("punkt", "tokenizers/punkt")
+    # ensure_nltk_resource("punkt_tab", "tokenizers/punkt_tab")
+    # device is where BERTScore runs, by default 'cuda' if torch has a GPU and 'cpu' otherwise
+    return MetricEngine(metric_names, device=device).score(reference_text, candidate_text)
+
+
 def average_dicts(dict_list, precision=3):
     average_dict = {}
 
@@ -143,21 +524,13 @@ def average_dicts(dict_list, precision=3):
 
 
 def max_dicts(dict_list, precision=3):
-    max_dict = {}
-
     if not dict_list:
-        return max_dict
-
-    for key in dict_list[0]:
-        max_dict[key] = 0.0
-
-    for d in dict_list:
-        for key, value in d.items():
-            max_dict[key] = max(value, max_dict[key])
-    return max_dict
+        return {}
+    return {key: max(0.0, *(d[key] for d in dict_list)) for key in dict_list[0]}
 
 
-def evaluate(path_ref, path_estimate, metric_list, time_interval_bins=[0, 30, 60, 90, 120, 150]):
+def evaluate(path_ref, path_estimate, metric_list, time_interval_bins=[0, 30, 60, 90, 120, 150], workers=None,
+             store=None):
     metric_dict_list = []
     metric_dict_time_list = [[] for i in range(len(time_interval_bins))]
     with open(path_estimate, 'r', encoding='utf-8') as file:
@@ -165,29 +538,174 @@ def evaluate(path_ref, path_estimate, metric_list, time_interval_bins=[0, 30, 60
     with open(path_ref, 'r', encoding='utf-8') as file:
         journal_ref = json.load(file)
     fail_list = []
+
+    # Match every reference key to a generated key, then score the (reference, candidate) pairs of all matches
+    keys_estimate = list(journal_estimate)
+    key_index = build_key_index(keys_estimate)
+    durations, pairs = [], []
     for key_ref, value_refs in journal_ref.items():
-        match = False
-        for key, value in journal_estimate.items():
-            if key_ref in key:
-                match = True
-                print("Match found: %s to %s" % (key_ref, key))
-                time_interval = value_refs['duration']
-                tidx = determine_interval(time_interval, time_interval_bins)
-                metric_dict_list_temp = []
-                for j_ref in value_refs['reference_journals']:
-                    for j_gen in value:
-                        metric_dict_list_temp.append(evaluate_metrics(j_ref, j_gen, metric_list))
-                metric_dict_list_max = max_dicts(metric_dict_list_temp)
-                metric_dict_list.append(metric_dict_list_max)
-                metric_dict_time_list[tidx].append(metric_dict_list_max)
-                break
-        if not match:
+        key = find_matching_key(key_ref, keys_estimate, key_index)
+        if key is None:
             print("Match failed: [%s]" % key_ref)
             fail_list.append(key_ref)
+            continue
+        print("Match found: %s to %s" % (key_ref, key))
+        durations.append(value_refs['duration'])
+        pairs.append([(j_ref, j_gen) for j_ref in value_refs['reference_journals'] for j_gen in journal_estimate[key]])
+
+    metric_dicts = score_matches(pairs, metric_list, workers=workers, store=store)
+    for time_interval, metric_dicts_key in zip(durations, metric_dicts):
+        tidx = determine_interval(time_interval, time_interval_bins)
+        metric_dict_list_max = max_dicts(metric_dicts_key)
+        metric_dict_list.append(metric_dict_list_max)
+        metric_dict_time_list[tidx].append(metric_dict_list_max)
     print("Match failed keys: [%s]" % str(fail_list))
     return metric_dict_list, metric_dict_time_list
 
 
+def iter_journal_file(path):
+    """
+    Iterate over the (key, value) items of a journal file without loading it at once when it is a JSONL file.
+
+    A .jsonl file holds one record {"key": key, "value": value} per line, with the same keys and values as the JSON
+    object of a .json file (see json_to_jsonl). Other files are read with json.load.
+    """
+    if not path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as file:
+            yield from json.load(file).items()
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                yield record['key'], record['value']
+
+
+def json_to_jsonl(path_json, path_jsonl):
+    with open(path_json, 'r', encoding='utf-8') as file:
+        journals = json.load(file)
+    with open(path_jsonl, 'w', encoding='utf-8') as file:
+        for key, value in journals.items():
+            file.write(json.dumps({'key': key, 'value': value}, ensure_ascii=False) + '\n')
+
+
+def read_results(path_results):
+    """
+    Read the rows of a results file written by evaluate_stream.
+
+    Returns:
+    list: The complete rows.
+    int: Size in bytes of the complete rows. A row cut off by a crash is not counted, so that it can be truncated.
+    """
+    rows, size = [], 0
+    if not os.path.exists(path_results):
+        return rows, size
+    with open(path_results, 'rb') as file:
+        for line in file:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                break
+            if not line.endswith(b'\n'):
+                rows.pop()
+                break
+            size += len(line)
+    return rows, size
+
+
+def rewrite_results(path_results, rows):
+    # Atomically replace the results file with rows, returns its new size in bytes
+    lines = [(json.dumps(row) + '\n').encode('utf-8') for row in rows]
+    tmp_path = path_results + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.writelines(lines)
+    os.replace(tmp_path, path_results)
+    return sum(len(line) for line in lines)
+
+
+def evaluate_stream(path_ref, path_estimate, path_results, metric_list,
+                    time_interval_bins=[0, 30, 60, 90, 120, 150], store=None):
+    """
+    Evaluate generated journals one record at a time, appending one row per reference key to path_results as soon
+    as it is scored.
+
+    The generated journals are streamed, so memory does not grow with their number. Reference keys already scored in
+    path_results are skipped, so an interrupted evaluation resumes where it stopped, and keys that failed to match
+    are retried. Matching is the same as in
+    evaluate: each reference key is scored against the first generated key containing it.
+
+    Parameters:
+    path_ref (str): Reference journals, a .json or .jsonl file.
+    path_estimate (str): Generated journals, a .json or .jsonl file.
+    path_results (str): JSONL file of result rows {"index", "key", "generated_key", "duration", "metrics"}, with
+        "failed": true instead of the metrics for reference keys without a match.
+    metric_list (list): Names of the metrics to compute.
+    store (MetricStore): Optional memo of metric results.
+
+    Returns:
+    The same as evaluate, see summarize_results.
+    """
+    rows, size = read_results(path_results)
+    scored_rows = [row for row in rows if not row.get('failed')]
+    if len(scored_rows) < len(rows):
+        # Failed rows are dropped so that their keys are matched again, e.g. against newly generated journals
+        size = rewrite_results(path_results, scored_rows)
+    done = {row['key'] for row in scored_rows}
+    journal_ref = {key: (index, value) for index, (key, value) in enumerate(iter_journal_file(path_ref))
+                   if key not in done}
+    if done:
+        print("Resuming %s: %d keys done, %d left" % (path_results, len(done), len(journal_ref)))
+    # Reference keys without a time interval are checked against every generated key
+    ref_index = build_key_index(journal_ref)
+    ref_no_interval = [key for key in journal_ref if not re.search(r'\[(\d{4})-(\d{4})\]', key)]
+
+    with open(path_results, 'ab') as file:
+        file.truncate(size)
+        for key, value in iter_journal_file(path_estimate):
+            if not journal_ref:
+                break
+            candidates = [key_ref for interval in dict.fromkeys(re.findall(r'\[(\d{4})-(\d{4})\]', key))
+                          for key_ref in ref_index.get(interval, [])] + ref_no_interval
+            for key_ref in dict.fromkeys(candidates):
+                if key_ref not in journal_ref or key_ref not in key:
+                    continue
+                print("Match found: %s to %s" % (key_ref, key))
+                index, value_refs = journal_ref.pop(key_ref)
+                pairs = [(j_ref, j_gen) for j_ref in value_refs['reference_journals'] for j_gen in value]
+                metric_dicts = score_matches([pairs], metric_list, store=store)[0]
+                row = {'index': index, 'key': key_ref, 'generated_key': key, 'duration': value_refs['duration'],
+                       'metrics': max_dicts(metric_dicts)}
+                file.write((json.dumps(row) + '\n').encode('utf-8'))
+                file.flush()
+
+        fail_list = sorted(journal_ref, key=lambda key_ref: journal_ref[key_ref][0])
+        for key_ref in fail_list:
+            print("Match failed: [%s]" % key_ref)
+            file.write((json.dumps({'index': journal_ref[key_ref][0], 'key': key_ref, 'failed': True}) + '\n')
+                       .encode('utf-8'))
+    print("Match failed keys: [%s]" % str(fail_list))
+    return summarize_results(path_results, time_interval_bins)
+
+
+def summarize_results(path_results, time_interval_bins=[0, 30, 60, 90, 120, 150]):
+    """
+    Rebuild the output of evaluate from a results file of evaluate_stream, in the order of the reference keys.
+
+    Returns:
+    list: The metrics of every matched reference key.
+    list: The metrics of the matched reference keys in each bin of time_interval_bins.
+    """
+    metric_dict_list = []
+    metric_dict_time_list = [[] for i in range(len(time_interval_bins))]
+    rows, _ = read_results(path_results)
+    for row in sorted(rows, key=lambda row: row['index']):
+        if row.get('failed'):
+            continue
+        metric_dict_list.append(row['metrics'])
+        metric_dict_time_list[determine_interval(row['duration'], time_interval_bins)].append(row['metrics'])
+    return metric_dict_list, metric_dict_time_list
+
+
 if __name__ == '__main__':
     metrics_all, metrics_all_time = evaluate('journals_reference.json', 'journals_generated_sample.json', metric_list=['ALL'])
     metrics_avg = average_dicts(metrics_all)
@@ -8,13 +8,20 @@
 import datetime
 import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
 import pytz
 
-from algorithm.motion_detection import detect_motion_rule, step_detect
-from sensortool import Experiment
+import profiling
+from algorithm.motion_detection import detect_motion_rule, step_detect, step_detect_batch
+from profiling import profiled
+from sensortool import Experiment, SessionWatcher, decode_column
 import numpy as np
 import argparse
-from utils import set_seeds, Printer, log_append, find_mode, save_journal, clean_sensor_data
+from utils import set_seeds, Printer, log_append, find_mode, open_journal_sink, clean_sensor_data
 
 
 def format_timestamp(timestamp_milliseconds):
@@ -53,6 +60,7 @@ def duration_in_seconds(timestamp1, timestamp2):
     return duration
 
 
+@profiled
 def preprocess_linear_accelerometer(linear_acce):
     linear_acce = clean_sensor_data(linear_acce)
     if linear_acce is None:
@@ -64,25 +72,24 @@ def preprocess_linear_accelerometer(linear_acce):
     return mean_amplitude, standard_deviation
 
 
+@profiled
 def preprocess_step_counter(step_counter, time_duration, acce_backup):
     step_counter = clean_sensor_data(step_counter)
     if step_counter is None:
-        return step_detect(acce_backup)
-    step_counter_formatted = [Experiment.format_simple_sensor(sc) for sc in step_counter]
-    step_count = step_counter_formatted[-1]['value'] - step_counter_formatted[0]['value']
+        with profiling.stage('step_detect'):
+            return step_detect(acce_backup)
+    step_count = step_counter[-1, 1] - step_counter[0, 1]
     return step_count / time_duration * 60
 
 
+@profiled
 def preprocess_pressure(pressure, time_duration=None, sea_level_pressure=1013.25, return_altitude=False):
     pressure = clean_sensor_data(pressure)
     if pressure is None:
         return None
-    pressure_formatted = [Experiment.format_simple_sensor(p) for p in pressure]
-    if len(pressure_formatted) > 0:
-        pressure_values = np.array([item['value'] for item in pressure_formatted])
-        altitudes = 44330 * (1 - (pressure_values / sea_level_pressure) ** (1 / 5.255))
-    else:
-        altitudes = np.array([0.0])
+    # Only the first and last samples are needed for the altitude change
+    pressure_values = np.asarray(pressure[[0, -1], 1], dtype=np.float64)
+    altitudes = 44330 * (1 - (pressure_values / sea_level_pressure) ** (1 / 5.255))
     if return_altitude:
         return altitudes[-1]
     if time_duration is None:
@@ -91,12 +98,12 @@ def preprocess_pressure(pressure, time_duration=None, sea_level_pressure=1013.25
         return (altitudes[-1] - altitudes[0]) / time_duration
 
 
+@profiled
 def preprocess_light(light):
     light = clean_sensor_data(light)
     if light is None:
         return None
-    light_formatted = [Experiment.format_simple_sensor(l) for l in light]
-    lights = [l['value'] for l in light_formatted]
+    lights = np.asarray(light[:, 1], dtype=np.float64)
     return format_number(np.mean(lights))
 
 
@@ -116,6 +123,7 @@ def filter_locations(data, target_types, time_shift=[15, 30]):
     return filtered_data
 
 
+@profiled
 def preprocess_location(locations, time_duration=None, transformer=None):
     if locations.size == 0:
         return None, None, None, None, None
@@ -124,56 +132,79 @@ def preprocess_location(locations, time_duration=None, transformer=None):
         location_filtered = filter_locations(locations, [1]) # Android locationManager.requestLocationUpdates API
     if location_filtered is None:
         return None, None, None, None, None
-    location_formatted = [Experiment.format_location(l) for l in location_filtered]
-    latitude = location_formatted[-1]['latitude']
-    longitude = location_formatted[-1]['longitude']
+    # Columns follow Experiment.format_location
+    location_latest = location_filtered[-1].tolist()
+    latitude = location_latest[5]
+    longitude = location_latest[4]
     if transformer is not None:
         latitude, longitude = transformer.transform(latitude, longitude)
-    speed = location_formatted[-1]['speed']
-    accuracy = location_formatted[-1]['accuracy']
-    if len(location_formatted) > 0:
-        altitudes = np.array([l['altitude'] for l in location_formatted])
-    else:
-        altitudes = np.array([0.0])
+    speed = location_latest[7]
+    accuracy = location_latest[8]
+    altitudes = np.asarray(location_filtered[[0, -1], 6], dtype=np.float64)
     if time_duration is None:
         return latitude, longitude, accuracy, speed, altitudes[-1] - altitudes[0]
     else:
         return latitude, longitude, accuracy, speed, (altitudes[-1] - altitudes[0]) / time_duration
 
 
+def latest_scan(data, count_column=1):
+    """
+    Select the rows of the latest scan from a sensor that logs one row per scanned item (satellite, WiFi).
+
+    Parameters:
+    data (np.ndarray): Non-empty sensor rows sorted by time.
+    count_column (int): Column holding the number of items in each scan.
+
+    Returns:
+    np.ndarray: The trailing run of rows sharing the latest count, latest row first.
+    count: The latest count, which callers use to cap the number of items taken from the run.
+    """
+    counts = data[:, count_column]
+    count_latest = counts[-1]
+    previous = np.flatnonzero(counts != count_latest)
+    run_start = previous[-1] + 1 if previous.size > 0 else 0
+    return data[run_start:][::-1], count_latest
+
+
+@profiled
 def preprocess_satellite(satellite):
     if satellite.size == 0:
         return None, None, None, None
-    satellite_format = [Experiment.format_satellite(sate) for sate in satellite]
-    # counts_unique = np.unique(np.array(counts))
-    # counts_unique_mean = np.mean(counts_unique)
-    sate_count_latest = satellite_format[-1]['count']
-    satellite_format_latest = []
-    for sate in satellite_format[::-1]:
-        if sate['count'] != sate_count_latest or len(satellite_format_latest) == sate_count_latest: break
-        satellite_format_latest.append(sate)
-    satellite_nonzero_snr_list = [sat for sat in satellite_format_latest if sat['snr'] != 0.0]
-    if len(satellite_nonzero_snr_list) == 0:
+    # Columns follow Experiment.format_satellite
+    satellite_latest, sate_count_latest = latest_scan(satellite)
+    if sate_count_latest >= 0:
+        satellite_latest = satellite_latest[:int(sate_count_latest)]
+    satellite_nonzero_snr = satellite_latest[satellite_latest[:, 4] != 0.0]
+    if len(satellite_nonzero_snr) == 0:
         return 0, None, None, None
-    snr_nonzero_mean_list = [sat['snr'] for sat in satellite_nonzero_snr_list]
-    azimuth_nonzero_list = [sat['azimuth'] for sat in satellite_nonzero_snr_list]
-    elevation_nonzero_list = [sat['elevation'] for sat in satellite_nonzero_snr_list]
-    return len(snr_nonzero_mean_list), np.mean(snr_nonzero_mean_list), azimuth_nonzero_list, elevation_nonzero_list
+    snr_nonzero_mean = np.mean(np.asarray(satellite_nonzero_snr[:, 4], dtype=np.float64))
+    azimuth_nonzero_list = satellite_nonzero_snr[:, 6].tolist()
+    elevation_nonzero_list = satellite_nonzero_snr[:, 7].tolist()
+    return len(satellite_nonzero_snr), snr_nonzero_mean, azimuth_nonzero_list, elevation_nonzero_list
 
 
-def preprocess_wifi(wifi, rssi_threshold=-85, contain_rssi=True, return_str=False):
+@profiled
+def preprocess_wifi(wifi, rssi_threshold=-85, contain_rssi=True, return_str=False, schema=None):
+    # schema is the SensorSchema of the WiFi array (Experiment.schema('wifi')), which encodes the SSIDs
     wifi_count = 0
     latest_ap_list = []
     if wifi.size > 0:
-        wifi_format = [Experiment.format_wifi(wi) for wi in wifi]
-        wifi_count_latest = wifi_format[-1]['count']
-        for wi in wifi_format[::-1]:
-            if wi['count'] != wifi_count_latest or len(latest_ap_list) == wifi_count_latest: break
-            if str(wi['ssid']) != 'nan' and 'powan' not in str(wi['ssid']) and str(wi['ssid']) != '': # powan is the hotspot name for experiment smartphone
-                latest_ap_list.append((str(wi['ssid']), wi['rssi']))
-        latest_ap_list = [item for item in latest_ap_list if item[1] >= rssi_threshold]
-        latest_ap_list = sorted(latest_ap_list, key=lambda x: x[1], reverse=True)
-        if not contain_rssi: latest_ap_list = [item[0] for item in latest_ap_list]
+        # Columns follow Experiment.format_wifi
+        wifi_latest, wifi_count_latest = latest_scan(wifi)
+        ssids = decode_column(wifi_latest, 3, schema).astype(str)
+        # powan is the hotspot name for experiment smartphone
+        keep = (ssids != 'nan') & (ssids != '') & (np.char.find(ssids, 'powan') < 0)
+        # The scan holds at most count named APs
+        keep &= np.cumsum(keep) <= wifi_count_latest
+        rssis = decode_column(wifi_latest, 6, schema)
+        rssi_values = np.asarray(rssis, dtype=np.float64)
+        keep &= rssi_values >= rssi_threshold
+        # Stable sort keeps the latest-first order among equal RSSIs
+        order = np.flatnonzero(keep)[np.argsort(-rssi_values[keep], kind='stable')]
+        if contain_rssi:
+            latest_ap_list = list(zip(ssids[order].tolist(), rssis[order].tolist()))
+        else:
+            latest_ap_list = ssids[order].tolist()
         wifi_count = len(latest_ap_list)
     if return_str:
         return format_number(wifi_count, 0), str(latest_ap_list)
@@ -181,6 +212,7 @@ def preprocess_wifi(wifi, rssi_threshold=-85, contain_rssi=True, return_str=Fals
         return wifi_count, latest_ap_list
 
 
+@profiled
 def preprocess_time(label):
     label_format = [Experiment.format_label(la) for la in label]
     time_start = label_format[0]['timestamp']
@@ -189,6 +221,7 @@ def preprocess_time(label):
     return time_duration, time_start, time_end
 
 
+@profiled
 def preprocess_label(label_raw, labels_previous=None):
     label_format = [Experiment.format_label(la) for la in label_raw]
     if len(label_format) == 0:
@@ -216,78 +249,363 @@ def decode_response(response, re_journal=r"Summary:[ \n]*(.*)"):
         return "None"
 
 
-def infer_daily_activity(path_dataset, path_save,time_window=20, seed=3432):
+def window_bounds(timestamps, window_starts, window_ends):
+    # Row ranges [lo, hi) of every window [start, end] in a sorted timestamp array
+    return np.searchsorted(timestamps, window_starts, side='left'), np.searchsorted(timestamps, window_ends, side='right')
+
+
+def segment_indices(lo, hi):
+    # Row indices of all windows concatenated, and where each window starts in them (windows may overlap)
+    lengths = hi - lo
+    offsets = np.cumsum(lengths) - lengths
+    indices = np.repeat(lo - offsets, lengths) + np.arange(lengths.sum())
+    return indices, offsets, lengths
+
+
+def segment_mean_std(values, lo, hi):
+    """
+    Mean and standard deviation of values over many row ranges at once, with np.add.reduceat.
+
+    Parameters:
+    values (np.ndarray): 1-D values of one sensor.
+    lo, hi (np.ndarray): Row range [lo, hi) of each window.
+
+    Returns:
+    np.ndarray, np.ndarray: Mean and standard deviation of each window, NaN for empty windows.
+    """
+    indices, offsets, lengths = segment_indices(lo, hi)
+    means = np.full(len(lo), np.nan)
+    stds = np.full(len(lo), np.nan)
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return means, stds
+    segment_values = values[indices]
+    # Empty windows take no room in segment_values, so only the offsets of non-empty windows are reduced
+    counts = lengths[nonempty]
+    means[nonempty] = np.add.reduceat(segment_values, offsets[nonempty]) / counts
+    deviations = (segment_values - np.repeat(means[nonempty], counts)) ** 2
+    stds[nonempty] = np.sqrt(np.add.reduceat(deviations, offsets[nonempty]) / counts)
+    return means, stds
+
+
+@profiled
+def extract_window_features(exp, time_window=20, sea_level_pressure=1013.25):
+    """
+    Compute the features of every time window of an experiment in one pass.
+
+    Window boundaries are found with np.searchsorted on each sensor once, numeric features are reduced over all
+    windows at once, and scan-based features (satellite, WiFi, location) are computed on views of the sensor
+    arrays. The results match the per-window preprocess_* functions, up to floating-point summation order in
+    the acceleration and light means.
+
+    Parameters:
+    exp (Experiment): One data collection session.
+    time_window (int): Window length in seconds.
+    sea_level_pressure (float): Reference pressure for the barometric altitude.
+
+    Returns:
+    dict: Feature name -> list with one entry per window, in time order.
+    """
+    _, time_start, time_end = preprocess_time(exp.label)
+    window_starts = np.arange(time_start, time_end, time_window * 1000)
+    window_ends = window_starts + time_window * 1000
+    num_windows = len(window_starts)
+
+    def bounds(data):
+        if data is None or data.size == 0:
+            return np.zeros(num_windows, dtype=np.int64), np.zeros(num_windows, dtype=np.int64)
+        return window_bounds(np.asarray(data[:, 0], dtype=np.float64), window_starts, window_ends)
+
+    features = {'time_start': list(window_starts), 'time_end': list(window_ends)}
+
+    # Step rate from the step counter, falling back to step detection on the accelerometer
+    step_counter = clean_sensor_data(exp.step_counter)
+    lo, hi = bounds(step_counter)
+    step_min = [None] * num_windows
+    if step_counter is not None:
+        has_steps = hi > lo
+        step_rates = (step_counter[hi[has_steps] - 1, 1] - step_counter[lo[has_steps], 1]) / time_window * 60
+        for w, step_rate in zip(np.flatnonzero(has_steps), step_rates):
+            step_min[w] = step_rate
+    acce_lo, acce_hi = bounds(exp.accelerometer)
+    fallback = np.flatnonzero(hi == lo)
+    with profiling.stage('step_detect'):
+        step_counts = step_detect_batch([exp.accelerometer[acce_lo[w]:acce_hi[w]] for w in fallback])
+    for w, step_count in zip(fallback, step_counts):
+        step_min[w] = step_count
+    features['step_min'] = step_min
+
+    # Linear acceleration amplitude
+    linear_acce = clean_sensor_data(exp.linear_accelerometer)
+    acce_mean, acce_std = [None] * num_windows, [None] * num_windows
+    if linear_acce is not None:
+        lo, hi = bounds(linear_acce)
+        means, stds = segment_mean_std(np.linalg.norm(linear_acce[:, 1:], axis=-1), lo, hi)
+        for w in np.flatnonzero(hi > lo):
+            acce_mean[w], acce_std[w] = means[w], stds[w]
+    features['acce_mean'], features['acce_std'] = acce_mean, acce_std
+
+    # Mean ambient light
+    light = clean_sensor_data(exp.light)
+    light_mean = [None] * num_windows
+    if light is not None:
+        lo, hi = bounds(light)
+        means, _ = segment_mean_std(np.asarray(light[:, 1], dtype=np.float64), lo, hi)
+        for w in np.flatnonzero(hi > lo):
+            light_mean[w] = format_number(means[w])
+    features['light'] = light_mean
+
+    # Barometric altitude change between the first and last sample of each window
+    pressure = clean_sensor_data(exp.pressure)
+    altitude_change = [None] * num_windows
+    if pressure is not None:
+        lo, hi = bounds(pressure)
+        altitudes = 44330 * (1 - (np.asarray(pressure[:, 1], dtype=np.float64) / sea_level_pressure) ** (1 / 5.255))
+        has_pressure = hi > lo
+        changes = altitudes[hi[has_pressure] - 1] - altitudes[lo[has_pressure]]
+        for w, change in zip(np.flatnonzero(has_pressure), changes):
+            altitude_change[w] = change
+    features['pressure_altitude_change'] = altitude_change
+
+    # Scan-based sensors only look at the latest scan or fix of each window
+    satellite_lo, satellite_hi = bounds(exp.satellite)
+    wifi_lo, wifi_hi = bounds(exp.wifi)
+    location_lo, location_hi = bounds(exp.location)
+    wifi_schema = exp.schema('wifi')
+    satellite_columns = [[] for _ in range(4)]
+    wifi_columns = [[] for _ in range(2)]
+    location_columns = [[] for _ in range(5)]
+    for w in range(num_windows):
+        satellite_features = preprocess_satellite(exp.satellite[satellite_lo[w]:satellite_hi[w]])
+        wifi_features = preprocess_wifi(exp.wifi[wifi_lo[w]:wifi_hi[w]], schema=wifi_schema)
+        location_features = preprocess_location(exp.location[location_lo[w]:location_hi[w]], time_duration=time_window)
+        for column, value in zip(satellite_columns + wifi_columns + location_columns,
+                                 satellite_features + wifi_features + location_features):
+            column.append(value)
+    for name, column in zip(['satellite_count', 'satellite_snr', 'azimuths', 'elevations', 'wifi_count',
+                             'wifi_ap_list', 'latitude', 'longitude', 'accuracy', 'speed',
+                             'satellite_altitude_change'], satellite_columns + wifi_columns + location_columns):
+        features[name] = column
+    return features
+
+
+def iterate_windows(features):
+    # Yield one dict per window from the columnar table of extract_window_features
+    names = list(features)
+    for values in zip(*features.values()):
+        yield dict(zip(names, values))
+
+
+@profiled
+def journal_experiment(exp, time_window=20):
+    """
+    Build the journals of every time window of one experiment.
+
+    Parameters:
+    exp (Experiment): One data collection session.
+    time_window (int): Window length in seconds.
+
+    Returns:
+    list: (journal name, journal log) of each window, in time order.
+    int: Token usage of the windows.
+    """
+    journals, usage_sum = [], 0
+    features = extract_window_features(exp, time_window)
+
+    for window in iterate_windows(features):
+        date_string, time_str, day_str = format_timestamp(window['time_end'])
+
+        step_min = window['step_min']
+        acce_mean = window['acce_mean']
+        light = window['light']
+        pressure_altitude_change = window['pressure_altitude_change']
+        satellite_count, satellite_snr = window['satellite_count'], window['satellite_snr']
+        azimuths, elevations = window['azimuths'], window['elevations']
+        wifi_last_count, latest_ap_list_filter = window['wifi_count'], window['wifi_ap_list']
+        wifi_ssid_list = [ap[0] for ap in latest_ap_list_filter] if len(latest_ap_list_filter) > 0 else []
+        wifi_rssi_list = [ap[1] for ap in latest_ap_list_filter] if len(latest_ap_list_filter) > 0 else []
+        latitude, longitude = window['latitude'], window['longitude']
+        accuracy, speed = window['accuracy'], window['speed']
+        speed_filter = speed if satellite_count is not None and satellite_count >= 5 else None
+        motion_detected = detect_motion_rule(step_min, acce_mean, pressure_altitude_change, speed_filter, return_str=True)
+
+
+        # Put your processing codes here
+        # (the raw sensor data of this window is exp.filter_by_timestamp(window['time_start'], window['time_end']))
+        #
+
+        journal_tag = date_string + " " + time_str
+
+        journal_log = ''
+        journal_log = log_append(journal_log, 'JOURNAL_TIME', journal_tag + " " + day_str)
+        journal_log = log_append(journal_log, 'RESPONSE_MOTION', motion_detected)
+        journal_log = log_append(journal_log, 'SENSOR_WIFI_SSID', str(wifi_ssid_list))
+        journal_log = log_append(journal_log, 'SENSOR_LOCATION', str((latitude, longitude)))
+        journal_log = log_append(journal_log, 'SENSOR_STEP', format_number(step_min, 2))
+        journal_log = log_append(journal_log, 'SENSOR_ACCE', format_number(acce_mean, 2))
+        journal_log = log_append(journal_log, 'SENSOR_LIGHT', light)
+        journal_log = log_append(journal_log, 'SENSOR_ALTI_PRESSURE', format_number(pressure_altitude_change, 2))
+        journal_log = log_append(journal_log, 'SENSOR_SPEED', format_number(speed_filter, 2))
+        other_info = ("(satellite count: %s, satellite SNR: %s, satellite azimuths: %s, satellite elevations: %s,"
+                      "wifi count: %s, wifi rssi: %s, location accuracy: %s)") % (
+                         satellite_count, satellite_snr, azimuths, elevations, wifi_last_count, wifi_rssi_list,
+                         accuracy)
+        journal_log = log_append(journal_log, 'OTHERS', other_info)
+
+        journals.append(("%s %s" % (date_string, time_str.replace(':', '')), journal_log))
+    return journals, usage_sum
+
+
+def journal_session(session, time_window=20):
+    # Load one (path, name) session folder and build its journals, so that workers never receive loaded sessions
+    dir_path, name = session
+    exp = Experiment.from_directory(dir_path, name, encode=True)
+    if exp is None:
+        return [], 0
+    return journal_experiment(exp, time_window)
+
+
+@profiled
+def write_journals(journals, journal_sink, printer):
+    for journal_name, journal_log in journals:
+        printer.print("------------------------------------")
+        journal_sink.write(journal_name, journal_log)
+        printer.print("Content:%s" % journal_log)
+
+
+def infer_daily_activity(path_dataset, path_save, time_window=20, seed=3432, jobs=1, sink='file', quiet=False,
+                         profile=False):
+    # With profile, the stage timings are written to profile.json and profile.trace.json in path_save
+    profiler = profiling.enable() if profile else None
     set_seeds(seed)
-    data = Experiment.from_directories(path_dataset)
-
-    printer = Printer()
-    i, usage_sum = 0, 0
-    while i < len(data):
-
-        exp = data[i]
-        time_duration, time_start, time_end = preprocess_time(exp.label)
-        time_tag = time_start  #
-
-        while time_tag < time_end:
-            time_tag_next = time_tag + time_window * 1000
-            exp_sliced = exp.filter_by_timestamp(time_tag, time_tag_next)
-
-            date_string, time_str, day_str = format_timestamp(time_tag_next)
-
-            step_min = preprocess_step_counter(exp_sliced.step_counter, time_window, exp_sliced.accelerometer)
-            acce_mean, acce_std = preprocess_linear_accelerometer(exp_sliced.linear_accelerometer)
-            light = preprocess_light(exp_sliced.light)
-            pressure_altitude_change = preprocess_pressure(exp_sliced.pressure, time_duration=None)
-            satellite_count, satellite_snr, azimuths, elevations = preprocess_satellite(exp_sliced.satellite)
-            wifi_last_count, latest_ap_list_filter = preprocess_wifi(exp_sliced.wifi)
-            wifi_ssid_list = [ap[0] for ap in latest_ap_list_filter] if len(latest_ap_list_filter) > 0 else []
-            wifi_rssi_list = [ap[1] for ap in latest_ap_list_filter] if len(latest_ap_list_filter) > 0 else []
-            latitude, longitude, accuracy, speed, satellite_altitude_change = preprocess_location(exp_sliced.location,
-                                                                                                  time_duration=time_window)
-            speed_filter = speed if satellite_count is not None and satellite_count >= 5 else None
-            motion_detected = detect_motion_rule(step_min, acce_mean, pressure_altitude_change, speed_filter, return_str=True)
-
-
-            # Put your processing codes here
-            #
-            #
-
-            printer.print("------------------------------------")
-            journal_tag = date_string + " " + time_str
-
-            journal_log = ''
-            journal_log = log_append(journal_log, 'JOURNAL_TIME', journal_tag + " " + day_str)
-            journal_log = log_append(journal_log, 'RESPONSE_MOTION', motion_detected)
-            journal_log = log_append(journal_log, 'SENSOR_WIFI_SSID', str(wifi_ssid_list))
-            journal_log = log_append(journal_log, 'SENSOR_LOCATION', str((latitude, longitude)))
-            journal_log = log_append(journal_log, 'SENSOR_STEP', format_number(step_min, 2))
-            journal_log = log_append(journal_log, 'SENSOR_ACCE', format_number(acce_mean, 2))
-            journal_log = log_append(journal_log, 'SENSOR_LIGHT', light)
-            journal_log = log_append(journal_log, 'SENSOR_ALTI_PRESSURE', format_number(pressure_altitude_change, 2))
-            journal_log = log_append(journal_log, 'SENSOR_SPEED', format_number(speed_filter, 2))
-            other_info = ("(satellite count: %s, satellite SNR: %s, satellite azimuths: %s, satellite elevations: %s,"
-                          "wifi count: %s, wifi rssi: %s, location accuracy: %s)") % (
-                             satellite_count, satellite_snr, azimuths, elevations, wifi_last_count, wifi_rssi_list,
-                             accuracy)
-            journal_log = log_append(journal_log, 'OTHERS', other_info)
-
-            save_journal(path_save, "%s %s" % (date_string, time_str.replace(':', '')), journal_log)
-
-            printer.print("Content:%s" % journal_log)
-            time_tag = time_tag_next
-
-        i += 1
+    print("Loading dataset {%s}." % path_dataset)
+    sessions = Experiment.sorted_sessions(path_dataset)
+
+    # The log is streamed to log.txt as the journals are written
+    printer = Printer(os.path.join(path_save, "log"), quiet=quiet)
+    usage_sum = 0
+    journal = partial(journal_session, time_window=time_window)
+    if profiler is not None and jobs > 1:
+        # Workers profile their sessions and send the stage runs back with the journals
+        journal = partial(profiling.call_with_profile, journal)
+    pool = ProcessPoolExecutor(max_workers=jobs, initializer=set_seeds, initargs=(seed,)) if jobs > 1 else nullcontext()
+    with pool as executor, open_journal_sink(sink, path_save) as journal_sink:
+        if executor is not None:
+            # Sessions are independent and each worker loads its own. map() yields results in input order, so journals
+            # and logs stay in time order.
+            results = executor.map(journal, sessions, chunksize=max(1, len(sessions) // (jobs * 4)))
+        else:
+            results = map(journal, sessions)
+
+        for result in results:
+            if profiler is not None and jobs > 1:
+                result, events = result
+                profiler.merge(events)
+            journals, usage = result
+            usage_sum += usage
+            write_journals(journals, journal_sink, printer)
+
     printer.print("------------------------------------")
     printer.print("Total usage token: %d" % usage_sum)
-    printer.save(os.path.join(path_save, "log"))
+    with profiling.stage('save_log'):
+        printer.save()
+    if profiler is not None:
+        profiling.disable()
+        profiler.save(os.path.join(path_save, "profile"))
+        print("\n".join(profiler.report()))
     return
 
 
+def follow_daily_activity(path_dataset, path_save, time_window=20, seed=3432, sink='file', quiet=False,
+                          poll_interval=5.0, settle_time=30.0, idle_timeout=None, profile=False):
+    """
+    Journal the sessions of an experiment while it is being recorded.
+
+    The experiment folder is polled every poll_interval seconds. Each newly completed session (see SessionWatcher) is
+    loaded with Experiment.from_directory and journaled right away, and the journals and the log are flushed, so a
+    journal is written at most about two poll intervals after its session ends. Only the sessions of one poll are held
+    in memory. A session that fails to load or journal is logged and skipped, and retried if its files change.
+    Processing stops after idle_timeout seconds without a new session, or on Ctrl+C.
+
+    Parameters:
+    path_dataset (str): The experiment folder, which may be empty at start.
+    path_save (str): The output folder, as in infer_daily_activity.
+    poll_interval (float): Seconds between two scans of the experiment folder.
+    settle_time (float): Seconds without change after which a session without end label is complete.
+    idle_timeout (float): Seconds without new session before stopping, None to run until interrupted.
+    """
+    profiler = profiling.enable() if profile else None
+    set_seeds(seed)
+    os.makedirs(path_dataset, exist_ok=True)
+    watcher = SessionWatcher(path_dataset, settle_time=settle_time)
+    printer = Printer(os.path.join(path_save, "log"), quiet=quiet)
+    print("Following dataset {%s}." % path_dataset)
+    usage_sum = 0
+    last_session = time.monotonic()
+    with open_journal_sink(sink, path_save) as journal_sink:
+        try:
+            while True:
+                experiments = []
+                for dir_path, name in watcher.poll():
+                    # A broken session, e.g. with a truncated CSV, is logged and skipped, it is retried if it changes
+                    try:
+                        experiments.append(Experiment.from_directory(dir_path, name, encode=True))
+                    except Exception as e:
+                        printer.print("Failed to load session {%s}: %r" % (dir_path, e))
+                experiments = sorted([exp for exp in experiments if exp is not None], key=lambda exp: exp.label[0, 0])
+                for exp in experiments:
+                    try:
+                        journals, usage = journal_experiment(exp, time_window)
+                    except Exception as e:
+                        printer.print("Failed to journal session {%s}: %r" % (exp.name, e))
+                        continue
+                    usage_sum += usage
+                    write_journals(journals, journal_sink, printer)
+                if len(experiments) > 0:
+                    journal_sink.flush()
+                    printer.flush()
+                    last_session = time.monotonic()
+                elif idle_timeout is not None and time.monotonic() - last_session >= idle_timeout:
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("Stopped following {%s}." % path_dataset)
+
+    printer.print("------------------------------------")
+    printer.print("Total usage token: %d" % usage_sum)
+    with profiling.stage('save_log'):
+        printer.save()
+    if profiler is not None:
+        profiling.disable()
+        profiler.save(os.path.join(path_save, "profile"))
+        print("\n".join(profiler.report()))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='AutoLife sensor processing')
     parser.add_argument('experiment_dir', help='Input experiment directory path')
     parser.add_argument('output_dir', help='Output log directory path')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes for loading and journaling')
+    parser.add_argument('--sink', choices=['file', 'jsonl', 'sqlite'], default='file',
+                        help='Where to write the journals: one .txt file per window, journals.jsonl or journals.db')
+    parser.add_argument('--quiet', action='store_true', help='Only write the log file, do not print it')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the pipeline stages and write profile.json and profile.trace.json to the output')
+
+    parser.add_argument('--follow', action='store_true',
+                        help='Keep watching the experiment directory and journal new sessions as they are completed')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds between two scans in follow mode')
+    parser.add_argument('--settle-time', type=float, default=30.0,
+                        help='Seconds without change after which a session without end label is complete')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='Stop following after this many seconds without new session')
 
     args = parser.parse_args()
 
-    infer_daily_activity(f"data/{args.experiment_dir}", f"saved/{args.output_dir}")
+    if args.follow:
+        follow_daily_activity(f"data/{args.experiment_dir}", f"saved/{args.output_dir}", sink=args.sink,
+                              quiet=args.quiet, poll_interval=args.poll_interval, settle_time=args.settle_time,
+                              idle_timeout=args.idle_timeout, profile=args.profile)
+    else:
+        infer_daily_activity(f"data/{args.experiment_dir}", f"saved/{args.output_dir}", jobs=args.jobs, sink=args.sink,
+                             quiet=args.quiet, profile=args.profile)
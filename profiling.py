@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @File    : profiling.py
+# @Description : Opt-in per-stage profiling of the journaling pipeline, exported as a JSON summary and a Chrome trace
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak memory is then not sampled
+    resource = None
+
+# The active Profiler, None when profiling is disabled
+PROFILER = None
+
+
+def max_rss():
+    # Peak resident set size of the process in MB, ru_maxrss is in bytes on macOS and in KB elsewhere
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class Stage:
+    """
+    Context manager timing one run of a stage and recording it in a Profiler.
+    """
+    __slots__ = ('profiler', 'name', 'start', 'cpu_start', 'rss_start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.rss_start = max_rss()
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        self.profiler.record((self.name, self.start, wall, cpu, self.rss_start, max_rss(), os.getpid(),
+                              threading.get_native_id()))
+        return False
+
+
+class NullStage:
+    # Shared do-nothing stage returned while profiling is disabled
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Profiler:
+    """
+    Aggregates the runs of named stages: call counts, wall and CPU time, and the peak memory of the process.
+
+    Wall and CPU times are inclusive, a stage run inside another one is counted in both. CPU time is the time of
+    the whole process, so it includes the other threads running meanwhile. Peak memory is the peak resident set
+    size of the process sampled when a stage ends, and the memory increase is how much the stage raised it.
+    """
+
+    def __init__(self, trace=True):
+        """
+        Parameters:
+        - trace (bool): Keep every stage run for the Chrome trace, otherwise only the aggregated statistics are kept.
+        """
+        self.trace = trace
+        self.origin = time.perf_counter()
+        self.cpu_origin = time.process_time()
+        self.stats = {}
+        self.events = []
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def record(self, event):
+        # event is (name, start, wall, cpu, rss_start, rss_end, pid, tid), start being a time.perf_counter value
+        name, _, wall, cpu, rss_start, rss_end, _, _ = event
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'wall_max': 0.0,
+                                            'peak_rss_mb': 0.0, 'rss_increase_mb': 0.0}
+            stats['calls'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            stats['wall_max'] = max(stats['wall_max'], wall)
+            stats['peak_rss_mb'] = max(stats['peak_rss_mb'], rss_end)
+            stats['rss_increase_mb'] += rss_end - rss_start
+            if self.trace:
+                self.events.append(event)
+
+    def merge(self, events):
+        """
+        Add the stage runs recorded by another process, see call_with_profile.
+        time.perf_counter is system-wide on Linux, so the runs of all processes share one timeline in the trace.
+        """
+        for event in events:
+            self.record(event)
+
+    def summary(self):
+        """
+        Returns:
+        - dict: Total wall and CPU time and peak memory of the profiled run, and the statistics of every stage,
+          slowest stage first.
+        """
+        with self.lock:
+            stages = {name: dict(stats, wall_mean=stats['wall'] / stats['calls'])
+                      for name, stats in sorted(self.stats.items(), key=lambda item: -item[1]['wall'])}
+        return {'wall': time.perf_counter() - self.origin, 'cpu': time.process_time() - self.cpu_origin,
+                'peak_rss_mb': max_rss(), 'stages': stages}
+
+    def chrome_trace(self):
+        # Complete events of the Trace Event Format, viewable in chrome://tracing or ui.perfetto.dev
+        with self.lock:
+            events = list(self.events)
+        return {'displayTimeUnit': 'ms', 'traceEvents': [
+            {'name': name, 'cat': 'autolife', 'ph': 'X', 'ts': (start - self.origin) * 1e6, 'dur': wall * 1e6,
+             'pid': pid, 'tid': tid, 'args': {'cpu_ms': cpu * 1000, 'peak_rss_mb': rss_end}}
+            for name, start, wall, cpu, _, rss_end, pid, tid in events]}
+
+    def save(self, path):
+        """
+        Write the summary to path + '.json' and the Chrome trace to path + '.trace.json'.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.json', 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, indent=2)
+        if self.trace:
+            with open(path + '.trace.json', 'w', encoding='utf-8') as file:
+                json.dump(self.chrome_trace(), file)
+
+    def report(self, top=15):
+        # Lines of a table of the slowest stages
+        summary = self.summary()
+        lines = ['Profile: %.2f s wall, %.2f s CPU, peak memory %.1f MB' % (
+            summary['wall'], summary['cpu'], summary['peak_rss_mb'])]
+        lines.append('%-40s %8s %10s %10s %10s' % ('stage', 'calls', 'wall (s)', 'cpu (s)', 'mem+ (MB)'))
+        for name, stats in list(summary['stages'].items())[:top]:
+            lines.append('%-40s %8d %10.3f %10.3f %10.1f' % (name, stats['calls'], stats['wall'], stats['cpu'],
+                                                            stats['rss_increase_mb']))
+        return lines
+
+
+def enable(trace=True):
+    """
+    Start profiling in this process.
+
+    Returns:
+    - Profiler: The new active profiler.
+    """
+    global PROFILER
+    PROFILER = Profiler(trace)
+    return PROFILER
+
+
+def disable():
+    """
+    Stop profiling in this process.
+
+    Returns:
+    - Profiler: The profiler that was active, or None.
+    """
+    global PROFILER
+    profiler, PROFILER = PROFILER, None
+    return profiler
+
+
+def stage(name):
+    """
+    Context manager timing a block of code as the stage name, a no-op while profiling is disabled.
+    """
+    profiler = PROFILER
+    return NULL_STAGE if profiler is None else profiler.stage(name)
+
+
+def profiled(function=None, name=None):
+    """
+    Decorator timing each call of a function as a stage, named after the function unless name is given.
+    While profiling is disabled, the only overhead is a check of the active profiler.
+    """
+    if function is None:
+        return functools.partial(profiled, name=name)
+    stage_name = name or function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profiler = PROFILER
+        if profiler is None:
+            return function(*args, **kwargs)
+        with profiler.stage(stage_name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def call_with_profile(function, *args, **kwargs):
+    """
+    Call a function under a fresh profiler, for functions run in worker processes.
+
+    Returns:
+    - The result of the function.
+    - list: The recorded stage runs, to be passed to Profiler.merge in the parent process.
+    """
+    global PROFILER
+    profiler = Profiler()
+    previous, PROFILER = PROFILER, profiler
+    try:
+        return function(*args, **kwargs), profiler.events
+    finally:
+        PROFILER = previous
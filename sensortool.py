@@ -5,14 +5,49 @@
 # @Email   : 735820057@qq.com
 # @File    : sensortool.py
 # @Description :
+import json
 import os
-from io import StringIO
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import pandas as pd
-from typing import Dict, Union, List
+from typing import Callable, Dict, Union, List
 from scipy.io import wavfile
 
+from profiling import profiled
+
+# Sensor attribute of Experiment -> (CSV file name, whether the file needs quote repair)
+SENSOR_FILES = {
+    'accelerometer': ('Accelerometer.csv', False),
+    'location': ('Location.csv', False),
+    'gyroscope': ('Gyroscope.csv', False),
+    'step_counter': ('Step_Counter.csv', False),
+    'game_rotation': ('Game_Rotation.csv', False),
+    'cellular': ('Cellular.csv', False),
+    'satellite': ('Satellite.csv', False),
+    'magnetometer': ('Magnetometer.csv', False),
+    'wifi': ('WiFi.csv', True),
+    'gravity': ('Gravity.csv', False),
+    'label': ('Label.csv', False),
+    'linear_accelerometer': ('Linear_Accelerometer.csv', False),
+    'bluetooth': ('Bluetooth.csv', True),
+    'rotation': ('Rotation.csv', False),
+    'proximity': ('Proximity.csv', False),
+    'light': ('Light.csv', False),
+    'pressure': ('Pressure.csv', False),
+}
+
+# Row of the label file in session signatures
+LABEL_INDEX = list(SENSOR_FILES).index('label')
+
+# Binary cache written next to the CSVs of each session folder
+CACHE_FILE_NAME = '.sensor_cache.npz'
+CACHE_VERSION = 4
+
 
 def is_file_empty(file_path):
     """
@@ -32,6 +67,260 @@ def is_file_empty(file_path):
     # Get the size of the file
     return os.path.getsize(file_path) == 0
 
+
+def session_signature(dir_path):
+    """
+    Build the (size, mtime) signature of all sensor CSV files in a session folder.
+
+    Parameters:
+    dir_path (str): The session folder holding the CSV files.
+
+    Returns:
+    np.ndarray: An int64 array of shape (number of sensors, 2), with -1 for missing files.
+    """
+    signature = np.full((len(SENSOR_FILES), 2), -1, dtype=np.int64)
+    for i, (file_name, _) in enumerate(SENSOR_FILES.values()):
+        try:
+            stat = os.stat(os.path.join(dir_path, file_name))
+        except OSError:
+            continue
+        signature[i] = stat.st_size, stat.st_mtime_ns
+    return signature
+
+
+def has_end_label(dir_path):
+    """
+    Check whether a session is over: Label.csv ends with the 'timestamp,-1,-1,-1' row written when it stops.
+    """
+    try:
+        with open(os.path.join(dir_path, SENSOR_FILES['label'][0]), 'r') as file:
+            lines = file.read().split()
+    except OSError:
+        return False
+    if len(lines) == 0:
+        return False
+    try:
+        return all(float(value) == -1 for value in lines[-1].split(',')[1:])
+    except ValueError:
+        return False
+
+
+class SessionWatcher:
+    """
+    Watches an experiment folder for session folders that are complete and not reported yet.
+
+    A session is complete once it has labels, its sensor files stopped changing between two polls and either
+    Label.csv holds its end row or the files have not changed for settle_time seconds, for sessions that were
+    interrupted. A reported session whose files change afterwards is watched again and reported once it is complete
+    again. Only the (size, mtime) signatures of the sessions are kept.
+    """
+
+    def __init__(self, parent_directory, settle_time=30.0):
+        """
+        Parameters:
+        parent_directory (str): The experiment folder, new session folders are expected to appear in it.
+        settle_time (float): Seconds without change after which a session without end row is complete.
+        """
+        self.parent_directory = parent_directory
+        self.settle_time = settle_time
+        # Session name -> signature when it was reported
+        self.reported = {}
+        # Session name -> (signature, time since which it is unchanged)
+        self.pending = {}
+
+    def poll(self):
+        """
+        Returns:
+        list: (session folder, session name) of the sessions completed since the last poll.
+        """
+        now = time.monotonic()
+        completed = []
+        for subdir in sorted(os.listdir(self.parent_directory)):
+            subdir_path = os.path.join(self.parent_directory, subdir)
+            if 'pycache' in subdir or not os.path.isdir(subdir_path):
+                continue
+            signature = session_signature(subdir_path)
+            if subdir in self.reported:
+                if np.array_equal(self.reported[subdir], signature):
+                    continue
+                # The session changed after it was reported, e.g. it was resumed or its files were still copied
+                del self.reported[subdir]
+            previous = self.pending.get(subdir)
+            if previous is None or not np.array_equal(previous[0], signature):
+                self.pending[subdir] = (signature, now)
+                continue
+            # A session without labels is not started yet, whatever the time it has been unchanged
+            if signature[LABEL_INDEX, 0] <= 0:
+                continue
+            if has_end_label(subdir_path) or now - previous[1] >= self.settle_time:
+                del self.pending[subdir]
+                self.reported[subdir] = signature
+                completed.append((subdir_path, subdir))
+        return completed
+
+
+class QuoteRepairReader:
+    """
+    A file-like reader that repairs a CSV file while pandas parses it.
+
+    Lines with an odd number of quotes (e.g. an SSID containing a quote) have all their quotes removed, and every
+    line is stripped. The file is repaired chunk by chunk as pd.read_csv reads it, so the file is never held in
+    memory twice.
+    """
+
+    def __init__(self, file, chunk_size=1 << 20):
+        """
+        Parameters:
+        file: A text file opened for reading.
+        chunk_size (int): Approximate number of characters repaired at a time.
+        """
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+
+    def repair_chunk(self):
+        lines = self.file.readlines(self.chunk_size)
+        if not lines:
+            return ''
+        return '\n'.join([(line.replace('"', '') if line.count('"') % 2 != 0 else line).strip() for line in lines]) + '\n'
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self.buffer]
+            chunk = self.repair_chunk()
+            while chunk:
+                chunks.append(chunk)
+                chunk = self.repair_chunk()
+            self.buffer = ''
+            return ''.join(chunks)
+        while len(self.buffer) < size:
+            chunk = self.repair_chunk()
+            if not chunk:
+                break
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def __iter__(self):
+        return iter(self.read().splitlines(keepends=True))
+
+
+@dataclass
+class SensorSchema:
+    """
+    Column types of a sensor array loaded from a CSV file with text columns (WiFi, Bluetooth, Cellular, Location,
+    Satellite).
+
+    When encoding is asked for (Experiment.from_directory(..., encode=True)), such files are stored as one float64
+    array instead of an object array of Python values: numbers as they are, booleans as 0/1 and text columns (SSID,
+    BSSID, device name, provider, ...) as integer codes into a table of their distinct values, with NaN for missing
+    values. decode_column and decode give back the original values. The session cache always holds the encoded form.
+    """
+    # Type of every column: 'int', 'float', 'bool' or 'category'
+    kinds: List[str]
+    # Column -> distinct values of a 'category' column, indexed by the codes stored in the array
+    categories: Dict[int, np.ndarray] = field(default_factory=dict)
+
+    @staticmethod
+    def encode(frame: pd.DataFrame):
+        """
+        Convert a parsed CSV file to a numeric array.
+
+        Returns:
+        np.ndarray: The values of the frame. Frames without text columns keep their numeric array as is.
+        SensorSchema or None: The column types, None if the array needs no decoding.
+        """
+        if all(dtype.kind in 'iuf' for dtype in frame.dtypes):
+            return frame.values, None
+        kinds, categories, columns = [], {}, []
+        for i, (_, column) in enumerate(frame.items()):
+            values = column.values
+            # Float64 holds integers exactly up to 2 ** 53, larger ones are kept as categories
+            if values.dtype.kind in 'iu' and (len(values) == 0 or np.abs(values).max() < 2 ** 53):
+                kinds.append('int')
+                columns.append(values.astype(np.float64))
+            elif values.dtype.kind == 'f':
+                kinds.append('float')
+                columns.append(values)
+            elif values.dtype.kind == 'b':
+                kinds.append('bool')
+                columns.append(values.astype(np.float64))
+            else:
+                codes, uniques = pd.factorize(column)
+                kinds.append('category')
+                categories[i] = np.asarray(uniques, dtype=object)
+                columns.append(np.where(codes >= 0, codes, np.nan))
+        return np.column_stack(columns).astype(np.float64), SensorSchema(kinds, categories)
+
+    def decode_column(self, data: np.ndarray, column: int) -> np.ndarray:
+        """
+        Returns:
+        np.ndarray: An object array with the original Python values of a column of data.
+        """
+        values = data[:, column]
+        kind = self.kinds[column]
+        if kind == 'int':
+            return values.astype(np.int64).astype(object)
+        if kind == 'bool':
+            return values.astype(bool).astype(object)
+        if kind == 'float':
+            return values.astype(object)
+        decoded = np.full(len(values), np.nan, dtype=object)
+        valid = ~np.isnan(values)
+        decoded[valid] = self.categories[column][values[valid].astype(np.int64)]
+        return decoded
+
+    def decode(self, data: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+        np.ndarray: The object array of Python values that pd.read_csv(...).values gives for the file.
+        """
+        if data.size == 0:
+            return data
+        decoded = np.empty(data.shape, dtype=object)
+        for column in range(data.shape[1]):
+            decoded[:, column] = self.decode_column(data, column)
+        return decoded
+
+    def to_cache(self, attr):
+        # Arrays saved in the binary cache of a session. Categories are saved as fixed-width strings so that the cache
+        # loads without pickle, each value as JSON to keep the values that are not strings, e.g. booleans of a column
+        # with missing values.
+        arrays = {f'{attr}__kinds': np.array(self.kinds, dtype=str)}
+        for column, values in self.categories.items():
+            arrays[f'{attr}__categories_{column}'] = np.array(
+                [json.dumps(value.item() if isinstance(value, np.generic) else value, ensure_ascii=False)
+                 for value in values], dtype=str)
+        return arrays
+
+    @staticmethod
+    def from_cache(cache, attr):
+        if f'{attr}__kinds' not in cache:
+            return None
+        kinds = [str(kind) for kind in cache[f'{attr}__kinds']]
+        categories = {}
+        for column, kind in enumerate(kinds):
+            if kind == 'category':
+                values = [json.loads(value) for value in cache[f'{attr}__categories_{column}'].tolist()]
+                categories[column] = np.array(values, dtype=object)
+        return SensorSchema(kinds, categories)
+
+
+def read_decoded(load, attr):
+    # Call a sensor loader returning an encoded array and its schema, and decode the array
+    data, schema = load(attr)
+    return (data, None) if schema is None else (schema.decode(data), None)
+
+
+def decode_column(data: np.ndarray, column: int, schema: SensorSchema = None) -> np.ndarray:
+    """
+    Original values of a sensor column, decoded with the schema of the sensor if it has one.
+    """
+    if schema is None:
+        return data[:, column]
+    return schema.decode_column(data, column)
+
+
 @dataclass
 class Experiment:
     name: str
@@ -53,44 +342,196 @@ class Experiment:
     proximity: np.ndarray
     light: np.ndarray
     pressure: np.ndarray
+    # Sensor attribute -> column types of sensors stored with encoded text columns, see SensorSchema
+    schemas: Dict[str, SensorSchema] = field(default_factory=dict, repr=False, compare=False)
+    # Sensor attribute -> sorted timestamps (column 0) used for binary-search slicing
+    time_index: Dict[str, np.ndarray] = field(default_factory=dict, init=False, repr=False, compare=False)
 
     @staticmethod
-    def read_from_file(file_path, fix=False):
+    @profiled
+    def read_frame(file_path, fix=False):
         if is_file_empty(file_path):
-            return np.array([])
+            return None
         else:
             if fix:
-                fixed_lines = []
                 with open(file_path, "r", encoding="utf-8") as file:
-                    for line in file:
-                        if line.count('"') % 2 != 0:
-                            line = line.replace('"', '')
-                        fixed_lines.append(line.strip())
-                fixed_data = "\n".join(fixed_lines)
-                return pd.read_csv(StringIO(fixed_data), header=None).values
-            return pd.read_csv(file_path, header=None).values
+                    return pd.read_csv(QuoteRepairReader(file), header=None)
+            return pd.read_csv(file_path, header=None)
 
     @staticmethod
-    def from_directory(dir_path: str, name: str, read_audio=False) -> 'Experiment':
-        # Loading CSVs
-        accelerometer = Experiment.read_from_file(os.path.join(dir_path, 'Accelerometer.csv'))
-        location = Experiment.read_from_file(os.path.join(dir_path, 'Location.csv'))
-        gyroscope = Experiment.read_from_file(os.path.join(dir_path, 'Gyroscope.csv'))
-        step_counter = Experiment.read_from_file(os.path.join(dir_path, 'Step_Counter.csv'))
-        game_rotation = Experiment.read_from_file(os.path.join(dir_path, 'Game_Rotation.csv'))
-        cellular = Experiment.read_from_file(os.path.join(dir_path, 'Cellular.csv'))
-        satellite = Experiment.read_from_file(os.path.join(dir_path, 'Satellite.csv'))
-        magnetometer = Experiment.read_from_file(os.path.join(dir_path, 'Magnetometer.csv'))
-        wifi = Experiment.read_from_file(os.path.join(dir_path, 'WiFi.csv'), True)
-        gravity = Experiment.read_from_file(os.path.join(dir_path, 'Gravity.csv'))
-        label = Experiment.read_from_file(os.path.join(dir_path, 'Label.csv'))
-        linear_accelerometer = Experiment.read_from_file(os.path.join(dir_path, 'Linear_Accelerometer.csv'))
-        bluetooth = Experiment.read_from_file(os.path.join(dir_path, 'Bluetooth.csv'), True)
-        rotation = Experiment.read_from_file(os.path.join(dir_path, 'Rotation.csv'))
-        proximity = Experiment.read_from_file(os.path.join(dir_path, 'Proximity.csv'))
-        light = Experiment.read_from_file(os.path.join(dir_path, 'Light.csv'))
-        pressure = Experiment.read_from_file(os.path.join(dir_path, 'Pressure.csv'))
+    def read_from_file(file_path, fix=False):
+        frame = Experiment.read_frame(file_path, fix)
+        return np.array([]) if frame is None else frame.values
+
+    @staticmethod
+    def sort_by_time(data: np.ndarray) -> np.ndarray:
+        # Rows are normally logged in time order, so this is only a check unless a file is out of order
+        if data.size == 0:
+            return data
+        timestamps = data[:, 0].astype(np.float64)
+        if np.all(timestamps[1:] >= timestamps[:-1]):
+            return data
+        return data[np.argsort(timestamps, kind='stable')]
+
+    @staticmethod
+    @profiled
+    def read_sensor_file(dir_path, attr, encode=False):
+        """
+        Parameters:
+        dir_path (str): The session folder holding the CSV files.
+        attr (str): The sensor attribute.
+        encode (bool): Encode the text columns, see SensorSchema.
+
+        Returns:
+        np.ndarray: The sensor array sorted by time, empty if the file is empty. With encode, it is numeric.
+        SensorSchema or None: The column types if the array was encoded.
+        """
+        file_name, fix = SENSOR_FILES[attr]
+        frame = Experiment.read_frame(os.path.join(dir_path, file_name), fix)
+        if frame is None:
+            return np.array([]), None
+        if not encode:
+            return Experiment.sort_by_time(frame.values), None
+        data, schema = SensorSchema.encode(frame)
+        return Experiment.sort_by_time(data), schema
+
+    @staticmethod
+    def is_cache_valid(dir_path):
+        """
+        Check whether the binary cache of a session exists and matches its CSV files.
 
+        Parameters:
+        dir_path (str): The session folder holding the CSV files.
+
+        Returns:
+        bool: True if the cache can be used instead of the CSV files.
+        """
+        cache_path = os.path.join(dir_path, CACHE_FILE_NAME)
+        if not os.path.exists(cache_path):
+            return False
+        try:
+            with np.load(cache_path) as cache:
+                return int(cache['__version__']) == CACHE_VERSION and \
+                    np.array_equal(cache['__signature__'], session_signature(dir_path))
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return False
+
+    @staticmethod
+    @profiled
+    def read_from_cache(dir_path, attrs=None):
+        """
+        Load sensor arrays of a session from its binary cache.
+
+        Parameters:
+        dir_path (str): The session folder holding the CSV files.
+        attrs (list): Sensor attributes to load. None loads all sensors.
+
+        Returns:
+        tuple or None: (sensor attribute -> array, sensor attribute -> SensorSchema of the sensors that have one),
+        or None if the cache is missing or stale.
+        """
+        cache_path = os.path.join(dir_path, CACHE_FILE_NAME)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with np.load(cache_path) as cache:
+                if int(cache['__version__']) != CACHE_VERSION:
+                    return None
+                if not np.array_equal(cache['__signature__'], session_signature(dir_path)):
+                    return None
+                attrs = SENSOR_FILES if attrs is None else attrs
+                schemas = {attr: SensorSchema.from_cache(cache, attr) for attr in attrs}
+                return {attr: cache[attr] for attr in attrs}, \
+                    {attr: schema for attr, schema in schemas.items() if schema is not None}
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+
+    @staticmethod
+    @profiled
+    def read_sensor_from_cache(dir_path, attr):
+        # npz members are decompressed one at a time, so this only reads the requested sensor
+        with np.load(os.path.join(dir_path, CACHE_FILE_NAME)) as cache:
+            return cache[attr], SensorSchema.from_cache(cache, attr)
+
+    @staticmethod
+    @profiled
+    def write_to_cache(dir_path, sensors, schemas=None, signature=None):
+        """
+        Save the sensor arrays of a session to its binary cache, tagged with the size and mtime of every CSV.
+
+        Parameters:
+        dir_path (str): The session folder holding the CSV files.
+        sensors (dict): Sensor attribute -> numeric array, as loaded from the CSV files with encode.
+        schemas (dict): Sensor attribute -> SensorSchema of the encoded sensors.
+        signature (np.ndarray): session_signature of the folder taken before the CSV files were read, so that a file
+            changed during the load makes the cache stale. Defaults to the current signature.
+        """
+        if signature is None:
+            signature = session_signature(dir_path)
+        arrays = dict(sensors)
+        for attr, schema in (schemas or {}).items():
+            arrays.update(schema.to_cache(attr))
+        cache_path = os.path.join(dir_path, CACHE_FILE_NAME)
+        try:
+            # Write to a temporary file first so that concurrent readers never see a partial cache
+            fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+        except OSError as e:
+            print(f"Failed to write sensor cache at {cache_path}: {e}")
+            return
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.savez(file, __version__=CACHE_VERSION, __signature__=signature, **arrays)
+            os.replace(tmp_path, cache_path)
+        except BaseException as e:
+            # Never leave the partial temporary file in the session folder
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            if not isinstance(e, OSError):
+                raise
+            print(f"Failed to write sensor cache at {cache_path}: {e}")
+
+    @staticmethod
+    def select_sensors(sensors=None):
+        """
+        Validate a sensor whitelist. The label is always selected since it defines the session time range.
+
+        Parameters:
+        sensors (list): Sensor attribute names, e.g. ['accelerometer', 'wifi']. None selects all sensors.
+
+        Returns:
+        list: The selected sensor attributes.
+        """
+        if sensors is None:
+            return list(SENSOR_FILES)
+        unknown = [attr for attr in sensors if attr not in SENSOR_FILES]
+        if unknown:
+            raise ValueError(f"Unknown sensors: {unknown}. Available sensors: {list(SENSOR_FILES)}")
+        return [attr for attr in SENSOR_FILES if attr in sensors or attr == 'label']
+
+    @staticmethod
+    @profiled
+    def from_directory(dir_path: str, name: str, read_audio=False, use_cache=True, lazy=False,
+                       sensors=None, encode=False) -> 'Experiment':
+        """
+        Load one session folder.
+
+        Parameters:
+        dir_path (str): The session folder holding the CSV files.
+        name (str): The session name.
+        read_audio (bool): Whether to read Audio.wav.
+        use_cache (bool): Whether to read and write the session binary cache.
+        lazy (bool): Return a LazyExperiment that only parses each sensor on first access.
+        sensors (list): Sensor attributes to load, the others are left empty. None loads all sensors.
+        encode (bool): Keep the text columns encoded as numbers, see SensorSchema. Faster and smaller, but the arrays
+            of the sensors with a schema must then be decoded with exp.decoded or decode_column. By default every
+            array holds the original values of its CSV file.
+
+        Returns:
+        Experiment or None: The session, or None if it has no labels.
+        """
+        selected = Experiment.select_sensors(sensors)
 
         # Loading Audio
         if read_audio:
@@ -98,78 +539,155 @@ class Experiment:
         else:
             audio = None
 
-        if label.size == 0:
+        if lazy:
+            if use_cache and Experiment.is_cache_valid(dir_path):
+                load = partial(Experiment.read_sensor_from_cache, dir_path)
+                if not encode:
+                    load = partial(read_decoded, load)
+            else:
+                load = partial(Experiment.read_sensor_file, dir_path, encode=encode)
+            experiment = LazyExperiment(name, {attr: partial(load, attr) for attr in selected}, audio=audio)
+            return None if experiment.label.size == 0 else experiment
+
+        # Loading CSVs, or their binary cache if it is still up to date
+        cached = Experiment.read_from_cache(dir_path, selected) if use_cache else None
+        if cached is not None:
+            loaded, schemas = cached
+        else:
+            loaded, schemas = {}, {}
+            signature = session_signature(dir_path)
+            for attr in selected:
+                loaded[attr], schema = Experiment.read_sensor_file(dir_path, attr, encode=True)
+                if schema is not None:
+                    schemas[attr] = schema
+            # Only a complete session is cached, so that the cache can serve any whitelist. A session whose files
+            # changed while they were read, e.g. one still being recorded, is not cached since its arrays may mix
+            # old and new contents.
+            if use_cache and len(selected) == len(SENSOR_FILES) and \
+                    np.array_equal(signature, session_signature(dir_path)):
+                Experiment.write_to_cache(dir_path, loaded, schemas, signature)
+
+        if loaded['label'].size == 0:
             return None
+        if not encode:
+            loaded = {attr: schemas[attr].decode(data) if attr in schemas else data for attr, data in loaded.items()}
+            schemas = {}
 
-        return Experiment(
-            name=name,
-            accelerometer=accelerometer,
-            location=location,
-            gyroscope=gyroscope,
-            step_counter=step_counter,
-            game_rotation=game_rotation,
-            cellular=cellular,
-            satellite=satellite,
-            magnetometer=magnetometer,
-            wifi=wifi,
-            gravity=gravity,
-            label=label,
-            linear_accelerometer=linear_accelerometer,
-            audio=audio,
-            bluetooth=bluetooth,
-            rotation=rotation,
-            proximity=proximity,
-            light=light,
-            pressure=pressure
-        )
+        sensors_all = {attr: loaded.get(attr, np.array([])) for attr in SENSOR_FILES}
+        return Experiment(name=name, audio=audio, schemas=schemas, **sensors_all)
 
     @staticmethod
-    def from_directories(parent_directory: str) -> List['Experiment']:
-        experiments = []
-        print("Loading dataset {%s}." % parent_directory)
-        # Iterate over all subdirectories in the provided directory
+    def session_folders(parent_directory: str) -> List[tuple]:
+        # (path, name) of every sub-folder of an experiment folder, in directory listing order
+        sessions = []
         for subdir in os.listdir(parent_directory):
             if 'pycache' in subdir:
                 continue
             subdir_path = os.path.join(parent_directory, subdir)
             if os.path.isdir(subdir_path):
-                experiment = Experiment.from_directory(subdir_path, subdir)
-                if experiment is not None:
-                    experiments.append(experiment)
+                sessions.append((subdir_path, subdir))
+        return sessions
+
+    @staticmethod
+    @profiled
+    def sorted_sessions(parent_directory: str) -> List[tuple]:
+        """
+        List the session folders of an experiment in the order of from_directories, reading only their labels, from
+        the session cache when it is up to date.
+
+        Returns:
+        List[tuple]: (path, name) of the sessions with labels, sorted by session start time.
+        """
+        starts = []
+        for path, name in Experiment.session_folders(parent_directory):
+            cached = Experiment.read_from_cache(path, ['label'])
+            label = cached[0]['label'] if cached is not None else Experiment.read_sensor_file(path, 'label')[0]
+            if label.size > 0:
+                starts.append((label[0, 0], path, name))
+        starts.sort(key=lambda start: start[0])
+        return [(path, name) for _, path, name in starts]
+
+    @staticmethod
+    @profiled
+    def from_directories(parent_directory: str, use_cache=True, workers=None, use_threads=False, lazy=False,
+                         sensors=None, encode=False) -> List['Experiment']:
+        """
+        Load every session folder of an experiment, sorted by session start time.
+
+        Parameters:
+        parent_directory (str): The experiment folder holding one sub-folder per session.
+        use_cache (bool): Whether to read and write the per-session binary cache.
+        workers (int): Number of sessions loaded in parallel. None or 1 loads them serially.
+        use_threads (bool): Use a thread pool instead of a process pool when workers > 1.
+        lazy (bool): Load LazyExperiment sessions that only parse each sensor on first access.
+        sensors (list): Sensor attributes to load, the others are left empty. None loads all sensors.
+        encode (bool): Keep the text columns encoded as numbers, see from_directory.
+
+        Returns:
+        List[Experiment]: The loaded sessions, skipping those without labels.
+        """
+        print("Loading dataset {%s}." % parent_directory)
+        sessions = Experiment.session_folders(parent_directory)
+        subdir_paths, subdirs = [path for path, _ in sessions], [name for _, name in sessions]
+
+        load = partial(Experiment.from_directory, use_cache=use_cache, lazy=lazy, sensors=sensors, encode=encode)
+        if workers is None or workers <= 1:
+            experiments = list(map(load, subdir_paths, subdirs))
+        else:
+            executor_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+            chunksize = max(1, len(subdirs) // (workers * 4))
+            with executor_class(max_workers=workers) as executor:
+                experiments = list(executor.map(load, subdir_paths, subdirs, chunksize=chunksize))
+        experiments = [experiment for experiment in experiments if experiment is not None]
         experiments.sort(key=lambda exp: exp.label[0, 0])
         return experiments
 
+    def schema(self, attr) -> SensorSchema:
+        # Column types of a sensor, None if its array holds plain numbers
+        getattr(self, attr)
+        return self.schemas.get(attr)
+
+    def decoded(self, attr) -> np.ndarray:
+        """
+        The array of a sensor with its text columns decoded, i.e. the object array of the CSV file as returned by
+        read_from_file, which the format_* methods expect.
+        """
+        data = getattr(self, attr)
+        schema = self.schema(attr)
+        return data if schema is None else schema.decode(data)
+
     def get_time_range(self):
         return self.label[0, 0], self.label[-1, 0]
 
+    def timestamps(self, attr) -> np.ndarray:
+        # Contiguous copy of the timestamp column, built once per sensor
+        if attr not in self.time_index:
+            data = getattr(self, attr)
+            self.time_index[attr] = data[:, 0].astype(np.float64) if data.size > 0 else np.array([])
+        return self.time_index[attr]
+
+    def time_slice(self, attr, start_timestamp: int, end_timestamp: int) -> slice:
+        # Rows of one sensor within [start_timestamp, end_timestamp], found by binary search on the sorted timestamps
+        timestamps = self.timestamps(attr)
+        return slice(np.searchsorted(timestamps, start_timestamp, side='left'),
+                     np.searchsorted(timestamps, end_timestamp, side='right'))
+
+    @profiled
     def filter_by_timestamp(self, start_timestamp: int, end_timestamp: int) -> 'Experiment':
-        # Helper function to filter data based on timestamp
-        def filter_data(data: np.ndarray) -> np.ndarray:
+        # Sensors are sorted by time at load, so every sensor is sliced as a view instead of copied through a mask
+        sliced, time_index = {}, {}
+        for attr in SENSOR_FILES:
+            data = getattr(self, attr)
             if data.size == 0:
-                return data
-            return data[(data[:, 0] >= start_timestamp) & (data[:, 0] <= end_timestamp)]
-
-        return Experiment(
-            name=self.name,
-            accelerometer=filter_data(self.accelerometer),
-            location=filter_data(self.location),
-            gyroscope=filter_data(self.gyroscope),
-            step_counter=filter_data(self.step_counter),
-            game_rotation=filter_data(self.game_rotation),
-            cellular=filter_data(self.cellular),
-            satellite=filter_data(self.satellite),
-            magnetometer=filter_data(self.magnetometer),
-            wifi=filter_data(self.wifi),
-            gravity=filter_data(self.gravity),
-            label=filter_data(self.label),
-            linear_accelerometer=filter_data(self.linear_accelerometer),
-            audio=self.audio,  # Audio remains unchanged
-            bluetooth=filter_data(self.bluetooth),
-            rotation=filter_data(self.rotation),
-            proximity=filter_data(self.proximity),
-            light=filter_data(self.light),
-            pressure=filter_data(self.pressure)
-        )
+                sliced[attr] = data
+                continue
+            rows = self.time_slice(attr, start_timestamp, end_timestamp)
+            sliced[attr] = data[rows]
+            time_index[attr] = self.time_index[attr][rows]
+
+        experiment = Experiment(name=self.name, audio=self.audio, schemas=self.schemas, **sliced)  # Audio remains unchanged
+        experiment.time_index.update(time_index)
+        return experiment
 
     @staticmethod
     def format_simple_sensor(data: np.ndarray) -> Dict[str, Union[int, float]]:
@@ -270,6 +788,58 @@ class Experiment:
         }
 
 
+class LazyExperiment(Experiment):
+    """
+    An Experiment whose sensor arrays are only loaded on first attribute access and then cached.
+
+    Sensors without a loader (e.g. excluded by a whitelist) are empty arrays.
+    """
+
+    def __init__(self, name: str, loaders: Dict[str, Callable[[], tuple]], audio=None):
+        """
+        Parameters:
+        name (str): The session name.
+        loaders (dict): Sensor attribute -> function returning (array, SensorSchema or None) of the sensor.
+        audio: The audio of the session, if read.
+        """
+        self.name = name
+        self.audio = audio
+        self.time_index = {}
+        self.schemas = {}
+        self.loaders = dict(loaders)
+        for attr in SENSOR_FILES:
+            if attr not in self.loaders:
+                setattr(self, attr, np.array([]))
+
+    def __getattr__(self, attr):
+        # Only called when the attribute is not loaded yet
+        loaders = self.__dict__.get('loaders')
+        if loaders is None or attr not in loaders:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{attr}'")
+        data, schema = loaders.pop(attr)()
+        if schema is not None:
+            self.schemas[attr] = schema
+        setattr(self, attr, data)
+        return data
+
+    def __repr__(self):
+        # The dataclass repr would load every sensor
+        return f"LazyExperiment(name={self.name!r}, pending={list(self.loaders)})"
+
+    def filter_sensor(self, attr, start_timestamp: int, end_timestamp: int) -> tuple:
+        data = getattr(self, attr)
+        if data.size == 0:
+            return data, None
+        return data[self.time_slice(attr, start_timestamp, end_timestamp)], self.schemas.get(attr)
+
+    @profiled
+    def filter_by_timestamp(self, start_timestamp: int, end_timestamp: int) -> 'LazyExperiment':
+        # The sliced sensors stay lazy as well, so only the sensors used downstream are loaded and filtered
+        loaders = {attr: partial(self.filter_sensor, attr, start_timestamp, end_timestamp)
+                   for attr in SENSOR_FILES if attr in self.loaders or getattr(self, attr).size > 0}
+        return LazyExperiment(self.name, loaders, audio=self.audio)
+
+
 # Load data into the Experiment class
 # subdir_path = r'data/j240322'
 # experiment_data = Experiment.from_directory(subdir_path)
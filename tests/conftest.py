@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+class StubGisHandler(BaseHTTPRequestHandler):
+    # Answers /geocode like the Geocoding API and /staticmap with fake image bytes
+
+    def do_GET(self):
+        stub = self.server.stub
+        with stub.lock:
+            stub.requests.append(self.path)
+            fail = stub.failures > 0
+            if fail:
+                stub.failures -= 1
+        if fail:
+            self.reply(503, b'', {'Retry-After': '0'})
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/geocode':
+            body = json.dumps({'results': [{'formatted_address': 'Place at %s' % query['latlng'][0]}]})
+            self.reply(200, body.encode('utf-8'), {'Content-Type': 'application/json'})
+        elif url.path == '/staticmap':
+            self.reply(200, ('PNG %s' % query['center'][0]).encode('utf-8'), {'Content-Type': 'image/png'})
+        else:
+            self.reply(404, b'', {})
+
+    def reply(self, status, body, headers):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubGisServer:
+    """
+    A local HTTP server standing in for the GIS APIs, recording the paths of the requests it receives.
+    The next `failures` requests are answered with 503.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGisHandler)
+        self.server.stub = self
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def gis_server():
+    server = StubGisServer()
+    yield server
+    server.close()
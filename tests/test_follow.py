@@ -0,0 +1,77 @@
+import os
+import shutil
+import threading
+import time
+
+from process_template import follow_daily_activity, infer_daily_activity
+from sensortool import SessionWatcher
+from synthetic import generate_experiment, generate_session
+
+
+def read_outputs(path):
+    # File name -> content of every journal and of the log
+    outputs = {}
+    for file_name in sorted(os.listdir(path)):
+        with open(os.path.join(path, file_name), 'r', encoding='utf-8') as file:
+            outputs[file_name] = file.read()
+    return outputs
+
+
+def test_watcher_waits_for_labels_and_requeues_changed_sessions(tmp_path):
+    watcher = SessionWatcher(str(tmp_path), settle_time=0)
+    session = tmp_path / 'session'
+    session.mkdir()
+    (session / 'Label.csv').write_text('')
+    assert watcher.poll() == [] and watcher.poll() == []
+
+    generate_session(str(session), 1736679625787, duration=5)
+    assert watcher.poll() == []
+    assert watcher.poll() == [(str(session), 'session')]
+    assert watcher.poll() == []
+
+    # The session is resumed after it was reported
+    with open(session / 'Light.csv', 'a') as file:
+        file.write('1736679630000,300\n')
+    assert watcher.poll() == []
+    assert watcher.poll() == [(str(session), 'session')]
+
+
+def test_follow_matches_batch(tmp_path):
+    source, folder = str(tmp_path / 'source'), str(tmp_path / 'experiment')
+    os.makedirs(folder)
+    names = [os.path.basename(path) for path in generate_experiment(source, num_sessions=4, duration=10)]
+    infer_daily_activity(source, str(tmp_path / 'batch'), quiet=True)
+
+    def record():
+        # Sessions appear one file at a time. Labels come last so that no session is complete before all its files
+        # are copied, however slow the copy.
+        for name in names:
+            os.makedirs(os.path.join(folder, name))
+            files = sorted(os.listdir(os.path.join(source, name)), key=lambda file_name: file_name == 'Label.csv')
+            for file_name in files:
+                if not file_name.startswith('.'):
+                    shutil.copy(os.path.join(source, name, file_name), os.path.join(folder, name))
+            time.sleep(0.1)
+
+    recorder = threading.Thread(target=record)
+    recorder.start()
+    follow_daily_activity(folder, str(tmp_path / 'follow'), quiet=True, poll_interval=0.05, settle_time=2,
+                          idle_timeout=1)
+    recorder.join()
+    assert read_outputs(str(tmp_path / 'follow')) == read_outputs(str(tmp_path / 'batch'))
+
+
+def test_follow_skips_broken_session(tmp_path):
+    folder = str(tmp_path / 'experiment')
+    generate_experiment(folder, num_sessions=2, duration=10)
+    broken = os.path.join(folder, '00_00_00')
+    generate_session(broken, 1736600000000, duration=10)
+    # A truncated row followed by complete ones cannot be parsed
+    with open(os.path.join(broken, 'Accelerometer.csv'), 'w') as file:
+        file.write('1736600000001,0.1\n1736600000002,0.1,0.2,9.8\n')
+
+    follow_daily_activity(folder, str(tmp_path / 'follow'), quiet=True, poll_interval=0.05, settle_time=0.1,
+                          idle_timeout=0.5)
+    outputs = read_outputs(str(tmp_path / 'follow'))
+    assert 'Failed to load session {%s}' % broken in outputs['log.txt']
+    assert len(outputs) > 1
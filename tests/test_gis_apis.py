@@ -0,0 +1,67 @@
+import threading
+import time
+
+from algorithm.gis_apis import GisClient, get_location_names, get_map_images
+from algorithm.gis_cache import MapImageStore
+
+
+def test_client_retries_unavailable_server(gis_server):
+    gis_server.failures = 2
+    client = GisClient(retries=3, backoff_factor=0)
+    response = client.get(gis_server.url + '/geocode', params={'latlng': '1,2'})
+    assert response.status_code == 200
+    assert len(gis_server.requests) == 3
+    client.close()
+
+
+def test_client_returns_last_response_when_retries_run_out(gis_server):
+    gis_server.failures = 5
+    client = GisClient(retries=1, backoff_factor=0)
+    assert client.get(gis_server.url + '/geocode', params={'latlng': '1,2'}).status_code == 503
+    assert len(gis_server.requests) == 2
+    client.close()
+
+
+def test_client_map_bounds_concurrency():
+    client = GisClient(max_workers=3)
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def call(item):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return item * 2
+
+    assert client.map(call, range(12)) == [item * 2 for item in range(12)]
+    assert peak[0] <= 3
+    client.close()
+
+
+def test_location_names_batch(gis_server):
+    coords = [(22.1, 114.1), (22.2, 114.2), (22.1, 114.1), (22.3, 114.3)]
+    client = GisClient(max_workers=4, rate=50, burst=1)
+    start = time.monotonic()
+    names = get_location_names(coords, 'key', client=client, base_url=gis_server.url + '/geocode')
+    # Results follow the input order and duplicates are requested once, at most 50 requests per second
+    assert names == ['Place at %s,%s' % coord for coord in coords]
+    assert len(gis_server.requests) == 3
+    assert time.monotonic() - start >= 2 / 50 * 0.9
+    client.close()
+
+
+def test_map_images_batch_with_store(tmp_path, gis_server):
+    coords = [(22.1, 114.1), (22.2, 114.2)]
+    store = MapImageStore(str(tmp_path / 'maps'))
+    client = GisClient(max_workers=2)
+    url = gis_server.url + '/staticmap'
+    images = get_map_images(coords, 'key', client=client, base_url=url, image_store=store)
+    assert images == [b'PNG 22.1,114.1', b'PNG 22.2,114.2']
+    # The stored images are served without new requests
+    assert get_map_images(coords, 'other key', client=client, base_url=url, image_store=store) == images
+    assert len(gis_server.requests) == 2
+    assert store.stats()['hits'] == 2
+    client.close()
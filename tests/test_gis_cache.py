@@ -0,0 +1,133 @@
+import os
+import time
+
+from algorithm.gis_apis import GisClient, TokenBucket, get_google_map_image, get_location_name
+from algorithm.gis_cache import GeoCache, MapImageStore, geohash_encode, snap_to_pixel_grid
+
+
+def test_geohash_encode():
+    assert geohash_encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert geohash_encode(42.6, -5.6, 5) == 'ezs42'
+
+
+def test_cache_hit_in_same_cell(tmp_path):
+    cache = GeoCache(str(tmp_path / 'geo.sqlite'), precision=7)
+    assert cache.get('location_name', 22.33630, 114.26340) is None
+    cache.put('location_name', 22.33630, 114.26340, 'HKUST')
+    # A few meters away falls in the same cell, the other namespace does not share entries
+    assert cache.get('location_name', 22.33632, 114.26342) == 'HKUST'
+    assert cache.get('point_of_interest', 22.33630, 114.26340) is None
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'entries': 1}
+    cache.close()
+
+    # Entries persist across instances
+    cache = GeoCache(str(tmp_path / 'geo.sqlite'), precision=7)
+    assert cache.get('location_name', 22.33630, 114.26340) == 'HKUST'
+    cache.close()
+
+
+def test_cache_ttl_expiry(tmp_path):
+    cache = GeoCache(str(tmp_path / 'geo.sqlite'), ttl=0.05)
+    cache.put('location_name', 22.3363, 114.2634, 'HKUST')
+    assert cache.get('location_name', 22.3363, 114.2634) == 'HKUST'
+    time.sleep(0.1)
+    assert cache.get('location_name', 22.3363, 114.2634) is None
+    assert cache.stats()['entries'] == 0
+    cache.close()
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = GeoCache(str(tmp_path / 'geo.sqlite'), max_entries=2)
+    cache.put('location_name', 10.0, 10.0, 'a')
+    time.sleep(0.01)
+    cache.put('location_name', 20.0, 20.0, 'b')
+    time.sleep(0.01)
+    assert cache.get('location_name', 10.0, 10.0) == 'a'
+    time.sleep(0.01)
+    cache.put('location_name', 30.0, 30.0, 'c')
+    assert cache.get('location_name', 20.0, 20.0) is None
+    assert cache.get('location_name', 10.0, 10.0) == 'a'
+    assert cache.get('location_name', 30.0, 30.0) == 'c'
+    cache.close()
+
+
+def test_location_name_cache_skips_request(tmp_path, gis_server):
+    cache = GeoCache(str(tmp_path / 'geo.sqlite'), precision=7)
+    client = GisClient(retries=0)
+    url = gis_server.url + '/geocode'
+    first = get_location_name(22.33630, 114.26340, 'key', cache=cache, base_url=url, client=client)
+    second = get_location_name(22.33632, 114.26342, 'key', cache=cache, base_url=url, client=client)
+    assert first == second == 'Place at 22.3363,114.2634'
+    assert len(gis_server.requests) == 1
+    client.close()
+    cache.close()
+
+
+def test_token_bucket_waits():
+    bucket = TokenBucket(rate=20, capacity=3)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    # The burst is served at once, then one token every 1 / rate seconds
+    assert time.monotonic() - start < 0.04
+    for _ in range(4):
+        bucket.acquire()
+    assert time.monotonic() - start >= 4 / 20 * 0.9
+
+
+def test_map_store_evicts_least_recently_used_to_low_water(tmp_path, monkeypatch):
+    store = MapImageStore(str(tmp_path / 'maps'), max_bytes=1000, low_water=0.5)
+    url = 'https://maps.example/staticmap'
+    for i in range(10):
+        store.put(url, {'center': str(i)}, b'x' * 100)
+        # Distinct access times, image 0 being the least recently used
+        os.utime(store.image_path(store.address(url, {'center': str(i)})), (1000 + i, 1000 + i))
+    assert store.total_bytes == 1000
+    scans = []
+    list_images = store.list_images
+    monkeypatch.setattr(store, 'list_images', lambda: scans.append(1) or list_images())
+
+    store.put(url, {'center': '10'}, b'x' * 100)
+    assert len(scans) == 1
+    assert store.total_bytes == 500
+    kept = [i for i in range(11) if store.get(url, {'center': str(i)}) is not None]
+    assert kept == [6, 7, 8, 9, 10]
+    # The store is below max_bytes again, so the next images do not scan it
+    for i in range(11, 16):
+        store.put(url, {'center': str(i)}, b'x' * 100)
+    assert len(scans) == 1
+    assert store.total_bytes == 1000
+
+
+def test_map_store_address_ignores_key_and_rounds_floats():
+    url = 'https://maps.example/staticmap'
+    params = {'center': '22.1,114.1', 'zoom': 18, 'coords': [[114.1, 22.1]], 'key': 'a'}
+    same = {'center': '22.1,114.1', 'zoom': 18, 'coords': [[114.1 + 1e-12, 22.1]], 'key': 'b'}
+    assert MapImageStore.address(url, params) == MapImageStore.address(url, same)
+    assert MapImageStore.address(url, params) != MapImageStore.address(url, dict(params, zoom=17))
+
+
+def test_snap_to_pixel_grid():
+    # Points a few meters apart snap to the same grid point, which is within the grid spacing
+    first = snap_to_pixel_grid(22.336300, 114.263400, 18, 64)
+    assert snap_to_pixel_grid(22.336310, 114.263410, 18, 64) == first
+    assert abs(first[0] - 22.3363) < 1e-3 and abs(first[1] - 114.2634) < 1e-3
+    assert snap_to_pixel_grid(22.3463, 114.2734, 18, 64) != first
+
+
+def test_map_store_shares_images_of_nearby_centers(tmp_path, gis_server):
+    client = GisClient(retries=0)
+    url = gis_server.url + '/staticmap'
+    store = MapImageStore(str(tmp_path / 'maps'))
+    # Without snapping, centers are only rounded to 7 decimals
+    first = get_google_map_image(22.1, 114.1, 'key', base_url=url, client=client, image_store=store)
+    assert get_google_map_image(22.1 + 1e-9, 114.1, 'key', base_url=url, client=client, image_store=store) == first
+    assert len(gis_server.requests) == 1
+
+    snapped = MapImageStore(str(tmp_path / 'snapped'), snap_pixels=64)
+    image = get_google_map_image(22.336300, 114.263400, 'key', base_url=url, client=client, image_store=snapped)
+    assert get_google_map_image(22.336310, 114.263410, 'key', base_url=url, client=client,
+                                image_store=snapped) == image
+    assert len(gis_server.requests) == 2
+    assert snapped.stats()['hits'] == 1
+    client.close()
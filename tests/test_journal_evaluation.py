@@ -0,0 +1,175 @@
+import json
+import os
+import warnings
+
+import pytest
+
+import journal_evaluation
+from journal_evaluation import MetricEngine, MetricStore, evaluate, evaluate_stream, ngram_counts
+
+nltk = pytest.importorskip('nltk')
+from nltk.translate.bleu_score import sentence_bleu
+from nltk.translate.chrf_score import sentence_chrf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope='module')
+def pairs():
+    # (reference, candidate) pairs of the sample journals: their own references, which overlap a lot, and the
+    # references of other windows, which barely overlap
+    with open(os.path.join(ROOT, 'journals_generated_sample.json'), 'r', encoding='utf-8') as file:
+        generated = json.load(file)
+    with open(os.path.join(ROOT, 'journals_reference.json'), 'r', encoding='utf-8') as file:
+        reference = json.load(file)
+    candidates = [journal for journals in generated.values() for journal in journals]
+    references = [journal for key in generated for journal in reference[key]['reference_journals']]
+    references += [journal for value in list(reference.values())[10:20] for journal in value['reference_journals']]
+    return [(j_ref, j_gen) for j_ref in references for j_gen in candidates]
+
+
+def test_chrf_matches_nltk(pairs):
+    engine = MetricEngine(['chrF'])
+    for reference, candidate in pairs:
+        expected = sentence_chrf(reference.lower(), candidate.lower())
+        assert engine.score(reference, candidate)['chrF'] == pytest.approx(expected, rel=TOLERANCE)
+
+
+def test_rouge_matches_rouge_package(pairs):
+    rouge = pytest.importorskip('rouge')
+    engine = MetricEngine(['ROUGE'])
+    for reference, candidate in pairs:
+        expected = rouge.Rouge().get_scores(candidate.lower(), reference.lower())[0]
+        scores = engine.score(reference, candidate)
+        for name, key in [('ROUGE-1', 'rouge-1'), ('ROUGE-2', 'rouge-2'), ('ROUGE-l', 'rouge-l')]:
+            for part in 'fpr':
+                assert scores['%s %s' % (name, part)] == pytest.approx(expected[key][part], rel=TOLERANCE)
+
+
+def test_bleu_matches_nltk(pairs):
+    # The n-gram statistics are built from whitespace tokens, so that the comparison does not need nltk's punkt data
+    def stats(text):
+        tokens = text.lower().split()
+        return {'tokens': tokens, 'bleu': [ngram_counts(tokens, n) for n in range(1, 5)]}
+
+    with warnings.catch_warnings():
+        # nltk warns about the n-gram orders without any match
+        warnings.simplefilter('ignore')
+        for reference, candidate in pairs:
+            expected = sentence_bleu([reference.lower().split()], candidate.lower().split())
+            assert MetricEngine.bleu(stats(reference), stats(candidate)) == pytest.approx(expected, rel=TOLERANCE)
+
+
+def test_engine_bleu_with_nltk_tokenizer(pairs):
+    try:
+        nltk.data.find('tokenizers/punkt_tab')
+    except LookupError:
+        pytest.skip('nltk punkt_tab data is not installed')
+    from nltk.tokenize import word_tokenize
+    engine = MetricEngine(['BLEU'])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for reference, candidate in pairs:
+            expected = sentence_bleu([word_tokenize(reference.lower())], word_tokenize(candidate.lower()))
+            assert engine.score(reference, candidate)['BLEU'] == pytest.approx(expected, rel=TOLERANCE)
+
+
+def test_evaluate_stream_retries_failed_keys(tmp_path):
+    with open(os.path.join(ROOT, 'journals_generated_sample.json'), 'r', encoding='utf-8') as file:
+        generated = json.load(file)
+    with open(os.path.join(ROOT, 'journals_reference.json'), 'r', encoding='utf-8') as file:
+        reference = dict(list(json.load(file).items())[:3])
+    path_ref, path_results = str(tmp_path / 'reference.json'), str(tmp_path / 'results.jsonl')
+    path_partial, path_generated = str(tmp_path / 'partial.json'), str(tmp_path / 'generated.json')
+    for path, journals in [(path_ref, reference), (path_partial, dict(list(generated.items())[:1])),
+                           (path_generated, generated)]:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(journals, file)
+
+    assert len(evaluate_stream(path_ref, path_partial, path_results, ['chrF'])[0]) == 1
+    # The second generated journal is now available: its key is retried instead of staying failed
+    results = evaluate_stream(path_ref, path_generated, path_results, ['chrF'])
+    assert results == evaluate(path_ref, path_generated, ['chrF'])
+    with open(path_results, 'r', encoding='utf-8') as file:
+        rows = [json.loads(line) for line in file]
+    assert sorted(row['key'] for row in rows) == sorted(reference)
+    assert sum(1 for row in rows if row.get('failed')) == 1
+
+
+def write_journals(path, journals):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(journals, file)
+    return path
+
+
+@pytest.fixture
+def scored_pairs(monkeypatch):
+    # Number of pairs scored in this process
+    scored = []
+    score_pairs = MetricEngine.score_pairs
+    monkeypatch.setattr(MetricEngine, 'score_pairs', lambda engine, pairs: scored.extend(pairs) or
+                        score_pairs(engine, pairs))
+    return scored
+
+
+def test_metric_store_skips_scored_pairs(tmp_path, scored_pairs):
+    path_ref = os.path.join(ROOT, 'journals_reference.json')
+    path_gen = os.path.join(ROOT, 'journals_generated_sample.json')
+    metrics = ['chrF', 'ROUGE']
+    expected = evaluate(path_ref, path_gen, metrics)
+    assert len(scored_pairs) == 8
+
+    store = MetricStore(str(tmp_path / 'metrics.sqlite'))
+    assert evaluate(path_ref, path_gen, metrics, store=store) == expected
+    assert (store.hits, store.misses) == (0, 8)
+    del scored_pairs[:]
+    # Everything is in the store: nothing is scored and the output is the same, serial or with workers
+    assert evaluate(path_ref, path_gen, metrics, store=store) == expected
+    assert evaluate(path_ref, path_gen, metrics, workers=2, store=store) == expected
+    assert (store.hits, store.misses) == (16, 8)
+    assert scored_pairs == []
+    store.close()
+
+    # A store filled by workers gives the same results
+    store = MetricStore(str(tmp_path / 'workers.sqlite'))
+    assert evaluate(path_ref, path_gen, metrics, workers=2, store=store) == expected
+    assert evaluate(path_ref, path_gen, metrics, store=store) == expected
+    assert (store.hits, store.misses) == (8, 8)
+    store.close()
+
+
+def test_metric_store_rescores_changed_candidate(tmp_path, scored_pairs):
+    path_ref = os.path.join(ROOT, 'journals_reference.json')
+    with open(os.path.join(ROOT, 'journals_generated_sample.json'), 'r', encoding='utf-8') as file:
+        generated = json.load(file)
+    metrics = ['chrF']
+    store = MetricStore(str(tmp_path / 'metrics.sqlite'))
+    evaluate(path_ref, write_journals(str(tmp_path / 'generated.json'), generated), metrics, store=store)
+
+    key = list(generated)[0]
+    generated[key][0] = 'In the afternoon, the user walks around the campus.'
+    path_changed = write_journals(str(tmp_path / 'changed.json'), generated)
+    del scored_pairs[:]
+    store.hits, store.misses = 0, 0
+    results = evaluate(path_ref, path_changed, metrics, store=store)
+    # Only the pairs of the changed candidate, one per reference journal, are scored again
+    assert (store.hits, store.misses) == (6, 2)
+    assert [candidate for _, candidate in scored_pairs] == [generated[key][0]] * 2
+    assert results == evaluate(path_ref, path_changed, metrics)
+    store.close()
+
+
+def test_metric_store_version_invalidates_entries(tmp_path, monkeypatch):
+    path_ref = os.path.join(ROOT, 'journals_reference.json')
+    path_gen = os.path.join(ROOT, 'journals_generated_sample.json')
+    path = str(tmp_path / 'metrics.sqlite')
+    store = MetricStore(path)
+    evaluate(path_ref, path_gen, ['chrF'], store=store)
+    store.close()
+
+    monkeypatch.setattr(journal_evaluation, 'METRIC_ENGINE_VERSION', journal_evaluation.METRIC_ENGINE_VERSION + 1)
+    store = MetricStore(path)
+    evaluate(path_ref, path_gen, ['chrF'], store=store)
+    assert (store.hits, store.misses) == (0, 8)
+    store.close()
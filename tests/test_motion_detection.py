@@ -0,0 +1,247 @@
+import itertools
+
+import numpy as np
+import pytest
+from scipy import signal
+from scipy.interpolate import interp1d
+
+from algorithm.motion_detection import (MOTION_RULE_THRESHOLDS, RULE_MOTIONS, StepDetector, detect_motion_rule,
+                                        detect_motion_rule_batch, format_motions, interpolate_linear, resample_data,
+                                        step_counter, step_detect, step_detect_batch)
+
+START = 1736679625787
+
+# Repeated timestamps give the same divisions by zero in interp1d and interpolate_linear
+pytestmark = pytest.mark.filterwarnings('ignore::RuntimeWarning')
+
+
+def reference_resample_data(data, target_rate):
+    # resample_data with one interp1d per column, as it was written before interpolate_linear
+    timestamps = (data[:, 0] - data[0, 0]) / 1000.0
+    new_timestamps = np.arange(timestamps[0], timestamps[-1], 1 / target_rate)
+    interpolated_data = np.zeros((len(new_timestamps), data.shape[1] - 1))
+    for i in range(data.shape[1] - 1):
+        interpolator = interp1d(timestamps, data[:, i + 1], kind='linear', fill_value="extrapolate")
+        interpolated_data[:, i] = interpolator(new_timestamps)
+    return np.column_stack((new_timestamps * 1000, interpolated_data))
+
+
+def reference_step_detect(acce, filter_frequency=2.0, fs=None, fs_default=30, count=True):
+    # step_detect of a single window, with its own filter design and sosfilt call
+    if acce.size == 0:
+        return None
+    if fs is None:
+        acc = reference_resample_data(acce, fs_default)[:, 1:]
+        fs = fs_default
+    else:
+        acc = acce[:, 1:]
+    acce_processed = np.linalg.norm(acc, axis=1)
+    acce_processed -= np.mean(acce_processed)
+    sos = signal.butter(2, filter_frequency, btype='lowpass', output='sos', fs=fs)
+    acce_filtered = signal.sosfilt(sos, acce_processed)
+    sm1 = acce_filtered - np.roll(acce_filtered, -1)
+    sm1[-1] = 0.0
+    sm2 = acce_filtered - np.roll(acce_filtered, 1)
+    sm2[0] = 0.0
+    peaks = (acce_filtered > 0.3) & (sm1 > 0) & (sm2 > 0)
+    return np.sum(peaks) if count else peaks
+
+
+def reference_step_counter(data):
+    # step_counter with its loop over the samples
+    if data.size == 0:
+        return 0
+    acc_magnitude = np.sqrt(data[:, 1]**2 + data[:, 2]**2 + data[:, 3]**2)
+    acc_mean = np.convolve(acc_magnitude, np.ones(5) / 5, mode='valid')
+    acc_centered = acc_magnitude[len(acc_magnitude) - len(acc_mean):] - acc_mean
+    steps = 0
+    last_step_time = None
+    for i in range(1, len(acc_centered) - 1):
+        if acc_centered[i] > 0.2 and acc_centered[i] > acc_centered[i - 1] and acc_centered[i] > acc_centered[i + 1]:
+            current_time = data[i, 0]
+            if last_step_time is None or (current_time - last_step_time) > 300:
+                steps += 1
+                last_step_time = current_time
+    return steps
+
+
+def make_windows(seed=0, count=40):
+    # Accelerometer windows with irregular timestamps, walking (2 Hz swing) or still, of various lengths. Some have
+    # unsorted or repeated timestamps, which interp1d handles by a stable sort.
+    rng = np.random.default_rng(seed)
+    windows = []
+    for k in range(count):
+        n = int(rng.integers(2, 1500))
+        timestamps = np.sort(rng.integers(0, n * 20, n)).astype(np.float64) + START
+        if k % 5 == 0:
+            timestamps = timestamps[rng.permutation(n)]
+        if k % 7 == 0:
+            timestamps[::3] = timestamps[0]
+        acc = rng.standard_normal((n, 3)) * 0.05 + [0.2, 0.3, 9.8]
+        if k % 2:
+            acc[:, 2] += 2.5 * np.sin(2 * np.pi * 2 * (timestamps - START) / 1000)
+        windows.append(np.column_stack([timestamps, acc]))
+    return windows
+
+
+@pytest.mark.parametrize('rate', [30, 50])
+def test_resample_data_matches_interp1d(rate):
+    for window in make_windows():
+        assert np.array_equal(resample_data(window, rate), reference_resample_data(window, rate), equal_nan=True)
+
+
+def test_interpolate_linear_matches_interp1d():
+    rng = np.random.default_rng(1)
+    x = np.concatenate([np.sort(rng.uniform(0, 10, 50)), [3.0, 3.0]])
+    x_new = np.linspace(-2, 12, 200)
+    for y in [rng.standard_normal((len(x), 3)), rng.integers(-100, 100, (len(x), 2)),
+              rng.standard_normal((len(x), 1)).astype(np.float32)]:
+        expected = np.column_stack([interp1d(x, y[:, i], kind='linear', fill_value="extrapolate")(x_new)
+                                    for i in range(y.shape[1])])
+        result = interpolate_linear(x, y, x_new)
+        assert result.dtype == np.float64
+        assert np.array_equal(result, expected, equal_nan=True)
+
+
+def test_step_detect_batch_matches_single_windows():
+    windows = [window for window in make_windows() if len(reference_resample_data(window, 30))]
+    windows.insert(3, np.zeros((0, 4)))
+    expected = [reference_step_detect(window) for window in windows]
+    assert step_detect_batch(windows) == expected
+    assert [step_detect(window) for window in windows] == expected
+    for result, window in zip(step_detect_batch(windows, fs=50, count=False), windows):
+        if window.size:
+            assert np.array_equal(result, reference_step_detect(window, fs=50, count=False))
+        else:
+            assert result is None
+
+
+def test_step_detect_raises_without_resampled_sample():
+    # All samples at the same time: nothing to resample
+    window = np.array([[START, 0.2, 0.3, 9.8], [START, 0.2, 0.3, 9.8]])
+    with pytest.raises(ValueError):
+        reference_step_detect(window)
+    with pytest.raises(ValueError):
+        step_detect_batch([make_windows()[1], window])
+
+
+def test_step_counter_matches_loop():
+    rng = np.random.default_rng(2)
+    windows = make_windows() + [np.column_stack([np.arange(n) * 20.0, rng.standard_normal((n, 3))])
+                                for n in range(5, 9)] + [np.zeros((0, 4))]
+    for window in windows:
+        assert step_counter(window) == reference_step_counter(window)
+    with pytest.raises(ValueError):
+        step_counter(np.zeros((3, 3)))
+
+
+def make_recording(seed=0, n=12000):
+    # About 4 minutes at 50 Hz with jittered timestamps, walking every other minute
+    rng = np.random.default_rng(seed)
+    timestamps = np.cumsum(rng.integers(15, 25, n)).astype(np.float64) + START
+    walking = ((timestamps - timestamps[0]) // 60000) % 2 == 0
+    acc = rng.standard_normal((n, 3)) * 0.05 + [0.2, 0.3, 9.8]
+    acc[walking, 2] += 2.5 * np.sin(2 * np.pi * 2 * (timestamps[walking] - START) / 1000)
+    return np.column_stack([timestamps, acc])
+
+
+def stream_steps(detector, data, cuts):
+    steps = [detector.process(data[start:end]) for start, end in zip(cuts[:-1], cuts[1:])]
+    return np.concatenate(steps)
+
+
+@pytest.mark.parametrize('resample', [True, False])
+def test_step_detector_independent_of_chunks(resample):
+    data = make_recording()
+    detector = StepDetector(fs=30 if resample else 50, resample=resample)
+    whole = stream_steps(detector, data, [0, len(data)])
+    assert detector.steps == len(whole) > 100
+    rng = np.random.default_rng(3)
+    cut_sets = [[0, 1, 2, 3], [0, 500], list(range(0, len(data), 997))]
+    cut_sets += [sorted(rng.choice(np.arange(1, len(data)), 150, replace=False)) for _ in range(3)]
+    for cuts in cut_sets:
+        # Empty chunks and chunks of a single sample included
+        cuts = [0] + [int(cut) for cut in cuts] + [len(data)]
+        detector.reset()
+        assert np.array_equal(stream_steps(detector, data, cuts), whole)
+        assert detector.steps == len(whole)
+
+
+def test_step_detector_counts_close_to_step_detect():
+    data = make_recording()
+    steps = stream_steps(StepDetector(), data, [0, len(data)])
+    for minute in range(4):
+        start, end = np.searchsorted(data[:, 0], data[0, 0] + minute * 60000 + np.array([10000, 30000]))
+        window = data[start:end]
+        count = np.sum((steps >= window[0, 0]) & (steps < window[-1, 0]))
+        assert abs(count - step_detect(window)) <= 2
+
+
+def around(values):
+    # Each threshold and the closest floats on both sides
+    values = np.array(sorted(set(values)), dtype=np.float64)
+    return sorted(set(np.concatenate([values, np.nextafter(values, -np.inf), np.nextafter(values, np.inf)])))
+
+
+def rule_inputs():
+    # Every combination of values at and around the thresholds, with None for missing values
+    t = MOTION_RULE_THRESHOLDS
+    steps = around([0, t['stationary_steps'], t['vehicle_steps'], t['limited_steps'], t['walking_steps'],
+                    t['jogging_steps'], t['running_steps'], 200]) + [None]
+    accelerations = around([0, t['stationary_acceleration'], t['walking_acceleration'], t['jogging_acceleration'],
+                            t['running_acceleration']]) + [None]
+    altitudes = around([0, t['stationary_altitude'], -t['limited_altitude'], t['escalator_altitude'],
+                        -t['escalator_altitude']]) + [None]
+    speeds = around([0, t['stationary_speed'], t['limited_speed'], t['walking_speed'], t['jogging_speed_min'],
+                     t['vehicle_speed_fast'], t['jogging_speed_max']]) + [None]
+    return list(itertools.product(steps, accelerations, altitudes, speeds))
+
+
+def as_array(values):
+    return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+
+def test_detect_motion_rule_batch_matches_scalar():
+    inputs = rule_inputs()
+    motions, determined = detect_motion_rule_batch(*map(as_array, zip(*inputs)))
+    assert motions.shape == (len(inputs), 6) and determined.shape == (len(inputs),)
+    compared = 0
+    # The whole grid with the default output, every 5th window with the other ones
+    for return_str, motion_previous, stride in [(False, None, 1), (True, None, 5), (False, ['walking'], 5),
+                                                (True, ['walking'], 5)]:
+        results = format_motions(motions[::stride], determined[::stride], return_str=return_str,
+                                 motion_previous=motion_previous)
+        for i, result in enumerate(results):
+            step_count, acceleration, altitude_change, speed = inputs[i * stride]
+            try:
+                expected = detect_motion_rule(step_count, acceleration, altitude_change, speed, return_str=return_str,
+                                              motion_previous=motion_previous)
+            except ValueError:
+                # The scalar rule removes a 'walking' label it did not give, the batch gives the running label instead
+                assert step_count > MOTION_RULE_THRESHOLDS['running_steps']
+                assert motions[i * stride, RULE_MOTIONS.index('jogging/running/cycling')]
+                assert not motions[i * stride, RULE_MOTIONS.index('walking')]
+                continue
+            assert result == expected, (step_count, acceleration, altitude_change, speed)
+            compared += 1
+    assert compared > 0.9 * 1.6 * len(inputs)
+
+
+def test_detect_motion_rule_batch_without_altitude_or_speed():
+    inputs = [(step_count, acceleration) for step_count, acceleration, _, _ in rule_inputs()[::37]]
+    step_counts, accelerations = map(as_array, zip(*inputs))
+    results = format_motions(*detect_motion_rule_batch(step_counts, accelerations), return_str=True)
+    for (step_count, acceleration), result in zip(inputs, results):
+        assert result == detect_motion_rule(step_count, acceleration, None, return_str=True)
+
+
+def test_detect_motion_rule_batch_threshold_grid():
+    step_counts, accelerations, altitudes, speeds = map(as_array, zip(*rule_inputs()[::11]))
+    walking_steps = np.array([20.0, 30.0, 40.0])
+    motions, determined = detect_motion_rule_batch(step_counts, accelerations, altitudes, speeds,
+                                                   thresholds={'walking_steps': walking_steps[:, None]})
+    assert motions.shape == (3, len(step_counts), 6)
+    for g, value in enumerate(walking_steps):
+        expected = detect_motion_rule_batch(step_counts, accelerations, altitudes, speeds,
+                                            thresholds={'walking_steps': value})
+        assert np.array_equal(motions[g], expected[0]) and np.array_equal(determined[g], expected[1])
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+
+from sensortool import CACHE_FILE_NAME, SENSOR_FILES, Experiment, session_signature
+from synthetic import generate_session
+
+START = 1736679625787
+
+
+def make_session(tmp_path, duration=20):
+    path = str(tmp_path / '10_00_25')
+    generate_session(path, START, duration=duration)
+    return path
+
+
+def append_light(path):
+    with open(os.path.join(path, 'Light.csv'), 'a') as file:
+        file.write('%d,321.5\n' % (START + 19999))
+
+
+def assert_same_sensors(exp, other):
+    for attr in SENSOR_FILES:
+        assert np.array_equal(getattr(exp, attr), getattr(other, attr), equal_nan=True), attr
+
+
+def test_cache_matches_csv(tmp_path):
+    path = make_session(tmp_path)
+    parsed = Experiment.from_directory(path, 'session', use_cache=False, encode=True)
+    assert not os.path.exists(os.path.join(path, CACHE_FILE_NAME))
+    Experiment.from_directory(path, 'session', encode=True)
+    assert Experiment.is_cache_valid(path)
+    cached = Experiment.from_directory(path, 'session', encode=True)
+    assert_same_sensors(cached, parsed)
+    assert cached.schemas.keys() == parsed.schemas.keys()
+    assert cached.decoded('wifi').tolist() == parsed.decoded('wifi').tolist()
+
+
+def test_cache_invalidated_when_csv_changes(tmp_path):
+    path = make_session(tmp_path)
+    rows = len(Experiment.from_directory(path, 'session').light)
+    append_light(path)
+    assert not Experiment.is_cache_valid(path)
+    assert len(Experiment.from_directory(path, 'session').light) == rows + 1
+    # The rebuilt cache serves the new row
+    assert Experiment.is_cache_valid(path)
+    assert len(Experiment.from_directory(path, 'session').light) == rows + 1
+
+
+def test_cache_not_written_when_csv_changes_during_load(tmp_path, monkeypatch):
+    path = make_session(tmp_path)
+    read_sensor_file = Experiment.read_sensor_file
+
+    def read_and_append(dir_path, attr, encode=False):
+        # A row is recorded right after Light.csv was parsed
+        result = read_sensor_file(dir_path, attr, encode)
+        if attr == 'light':
+            append_light(dir_path)
+        return result
+
+    monkeypatch.setattr(Experiment, 'read_sensor_file', staticmethod(read_and_append))
+    rows = len(Experiment.from_directory(path, 'session').light)
+    monkeypatch.undo()
+    assert not Experiment.is_cache_valid(path)
+    assert len(Experiment.from_directory(path, 'session').light) == rows + 1
+
+
+def test_cache_tagged_with_signature_before_load(tmp_path):
+    path = make_session(tmp_path)
+    signature = session_signature(path)
+    light, _ = Experiment.read_sensor_file(path, 'light', encode=True)
+    append_light(path)
+    sensors = {attr: Experiment.read_sensor_file(path, attr, encode=True)[0] for attr in SENSOR_FILES}
+    sensors['light'] = light
+    Experiment.write_to_cache(path, sensors, signature=signature)
+    assert not Experiment.is_cache_valid(path)
+
+
+def test_sorted_sessions_reads_labels_from_cache(tmp_path, monkeypatch):
+    folder = tmp_path / 'experiment'
+    for name, start in [('b', START), ('a', START + 60000), ('c', START - 60000)]:
+        generate_session(str(folder / name), start, duration=5)
+    (folder / 'empty').mkdir()
+    (folder / 'empty' / 'Label.csv').write_text('')
+    expected = [(str(folder / name), name) for name in ['c', 'b', 'a']]
+    assert Experiment.sorted_sessions(str(folder)) == expected
+
+    for path, name in expected:
+        Experiment.from_directory(path, name)
+    read_frame = Experiment.read_frame
+    parsed = []
+    monkeypatch.setattr(Experiment, 'read_frame', staticmethod(
+        lambda file_path, fix=False: parsed.append(file_path) or read_frame(file_path, fix)))
+    assert Experiment.sorted_sessions(str(folder)) == expected
+    # Only the session without cache is parsed
+    assert parsed == [str(folder / 'empty' / 'Label.csv')]
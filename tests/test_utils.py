@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from utils import JOURNAL_SINKS, FileJournalSink, JsonlJournalSink, Printer, SqliteJournalSink, open_journal_sink
+
+
+def test_printer_streams_and_rotates(tmp_path):
+    path = str(tmp_path / 'log')
+    line_size = len('line 0'.encode('utf-8')) + len(os.linesep)
+    printer = Printer(path, buffer_size=2, max_bytes=4 * line_size, quiet=True)
+    for i in range(6):
+        printer.print('line %d' % i)
+    printer.save()
+    with open(path + '.txt.1', 'r', encoding='utf-8') as file:
+        assert file.read() == ''.join('line %d\n' % i for i in range(4))
+    with open(path + '.txt', 'r', encoding='utf-8') as file:
+        assert file.read() == 'line 4\nline 5\n'
+
+
+def test_printer_appends_after_save(tmp_path):
+    path = str(tmp_path / 'log')
+    printer = Printer(path, quiet=True)
+    printer.print('before save')
+    printer.save()
+    printer.print('after save')
+    # Messages printed after save are in the log file without saving again
+    with open(path + '.txt', 'r', encoding='utf-8') as file:
+        assert file.read() == 'before save\nafter save\n'
+    printer.save()
+    assert printer.info_list == []
+
+
+JOURNALS = [('2024-03-22 171700', 'walks to the bus stop'), ('2024-03-22 171720', 'takes the bus'),
+            ('2024-03-22 171740', 'arrives at Hang Hau'), ('2024-03-22 171800', 'enters the mall')]
+
+
+def saved_journals(sink, folder_path):
+    # The journals on disk, read with a separate sink or connection
+    if sink == 'file':
+        return FileJournalSink(folder_path).read_range('', '~')
+    if sink == 'jsonl':
+        with open(os.path.join(folder_path, 'journals.jsonl'), 'r', encoding='utf-8') as file:
+            return sorted({record['name']: record['journal'] for record in map(json.loads, file)}.items())
+    connection = sqlite3.connect(os.path.join(folder_path, 'journals.db'))
+    try:
+        return connection.execute("SELECT name, journal FROM journals ORDER BY name").fetchall()
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('sink', list(JOURNAL_SINKS))
+def test_journal_sink_read_range(tmp_path, sink):
+    with open_journal_sink(sink, str(tmp_path)) as journal_sink:
+        for name, journal in reversed(JOURNALS):
+            journal_sink.write(name, journal)
+        # Bounds are inclusive and journals are sorted by name
+        assert journal_sink.read_range(JOURNALS[1][0], JOURNALS[2][0]) == JOURNALS[1:3]
+        assert journal_sink.read_range('2024-03-22 171710', '2024-03-22 171759') == JOURNALS[1:3]
+        assert journal_sink.read_range('2024-03-22', '2024-03-23') == JOURNALS
+        assert journal_sink.read_range('2024-03-23', '2024-03-24') == []
+
+
+@pytest.mark.parametrize('sink', list(JOURNAL_SINKS))
+def test_journal_sink_later_duplicate_replaces_earlier(tmp_path, sink):
+    with open_journal_sink(sink, str(tmp_path)) as journal_sink:
+        journal_sink.write(*JOURNALS[0])
+        journal_sink.write(JOURNALS[0][0], 'stays at home')
+        assert journal_sink.read_range('', '~') == [(JOURNALS[0][0], 'stays at home')]
+    assert saved_journals(sink, str(tmp_path)) == [(JOURNALS[0][0], 'stays at home')]
+
+
+@pytest.mark.parametrize('sink', list(JOURNAL_SINKS))
+def test_journal_sink_reopens_existing_output(tmp_path, sink):
+    with open_journal_sink(sink, str(tmp_path)) as journal_sink:
+        for name, journal in JOURNALS[:2]:
+            journal_sink.write(name, journal)
+    with open_journal_sink(sink, str(tmp_path)) as journal_sink:
+        assert journal_sink.read_range('', '~') == JOURNALS[:2]
+        for name, journal in JOURNALS[2:]:
+            journal_sink.write(name, journal)
+        journal_sink.write(JOURNALS[0][0], 'stays at home')
+    assert saved_journals(sink, str(tmp_path)) == [(JOURNALS[0][0], 'stays at home')] + JOURNALS[1:]
+
+
+@pytest.mark.parametrize('sink, sink_class, file_name', [('jsonl', JsonlJournalSink, 'journals.jsonl'),
+                                                         ('sqlite', SqliteJournalSink, 'journals.db')])
+def test_buffered_journal_sink_writes_on_flush_and_close(tmp_path, sink, sink_class, file_name):
+    journal_sink = sink_class(str(tmp_path / file_name), buffer_size=3, flush_interval=3600)
+    journal_sink.write(*JOURNALS[0])
+    assert saved_journals(sink, str(tmp_path)) == []
+    journal_sink.flush()
+    assert saved_journals(sink, str(tmp_path)) == JOURNALS[:1]
+    # A full buffer is written without flush
+    for name, journal in JOURNALS[1:]:
+        journal_sink.write(name, journal)
+    assert saved_journals(sink, str(tmp_path)) == JOURNALS
+    journal_sink.write('2024-03-22 171820', 'goes home')
+    journal_sink.close()
+    assert saved_journals(sink, str(tmp_path)) == JOURNALS + [('2024-03-22 171820', 'goes home')]
@@ -10,6 +10,9 @@ import json
 import os
 import random
 import copy
+import shutil
+import sqlite3
+import time
 from abc import abstractmethod
 from collections import Counter
 
@@ -38,21 +41,91 @@ def log_append(log, key, content):
 
 
 class Printer:
+    """
+    Prints messages and keeps them for saving to a log file.
 
-    def __init__(self):
+    By default messages are kept in memory until save(). With path set, they are streamed to path + '.txt' instead,
+    in batches of buffer_size messages, so memory stays bounded and a crash only loses the last batch. When
+    max_bytes is set, the log is rotated like logging's RotatingFileHandler, keeping backup_count older logs as
+    path.txt.1, path.txt.2, ... Once saved, later messages are appended to the log file straight away. With quiet
+    set, messages are only logged, not printed.
+    """
+
+    def __init__(self, path=None, buffer_size=100, max_bytes=None, backup_count=3, quiet=False):
         self.info_list = []
+        self.quiet = quiet
+        self.path = path
+        self.buffer_size = buffer_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = self.open_log('w')
+
+    def open_log(self, mode):
+        # Lines end with os.linesep like in the files written by save without a path
+        file = open(self.path + '.txt', mode, encoding='utf-8', newline=None)
+        self.size = os.path.getsize(self.path + '.txt')
+        return file
 
     def print(self, info, p=True):
-        if p: print(info)
+        if p and not self.quiet: print(info)
         self.info_list.append(info)
+        if self.path is None:
+            return
+        if self.file is None:
+            # The log was saved, the message is appended to it at once
+            self.file = self.open_log('a')
+            self.flush()
+            self.file.close()
+            self.file = None
+        elif len(self.info_list) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        # Write the buffered messages to the log file, rotating it when it would exceed max_bytes
+        if self.file is None:
+            return
+        for info in self.info_list:
+            size = len(info.encode('utf-8')) + len(os.linesep)
+            if self.max_bytes and self.size > 0 and self.size + size > self.max_bytes:
+                self.rotate()
+            self.file.write(info + '\n')
+            self.size += size
+        self.file.flush()
+        self.info_list.clear()
+
+    def rotate(self):
+        log_path = self.path + '.txt'
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists('%s.%d' % (log_path, i)):
+                os.replace('%s.%d' % (log_path, i), '%s.%d' % (log_path, i + 1))
+        if self.backup_count > 0:
+            os.replace(log_path, log_path + '.1')
+        self.file = self.open_log('w')
 
-    def save(self, saved_path):
-        with open(saved_path + '.txt', 'w', encoding='utf-8') as file:
-            # iterate over each log in the log list
-            for info in self.info_list:
-                # write each log to a new line in the file
-                file.write(info + '\n')
-        print('Print info saved at %s' % saved_path)
+    def save(self, saved_path=None):
+        if self.path is not None:
+            # Streamed messages are already in the log file, which is copied if another path is given
+            if self.file is not None:
+                self.flush()
+                self.file.close()
+                self.file = None
+            if saved_path is not None and os.path.abspath(saved_path) != os.path.abspath(self.path):
+                shutil.copyfile(self.path + '.txt', saved_path + '.txt')
+            else:
+                saved_path = self.path
+        else:
+            with open(saved_path + '.txt', 'w', encoding='utf-8') as file:
+                # iterate over each log in the log list
+                for info in self.info_list:
+                    # write each log to a new line in the file
+                    file.write(info + '\n')
+        if not self.quiet:
+            print('Print info saved at %s' % saved_path)
         self.info_list.clear()
 
 
@@ -65,6 +138,169 @@ def save_journal(folder_path, file_name, journal, replace=True):
             file.write(journal)
 
 
+class JournalSink:
+    """
+    Destination of the journals of every time window.
+
+    Journal names start with the date and time of their window ('%Y-%m-%d %H%M%S'), so sorting names sorts journals
+    by time and read_range can select a time range by name.
+    """
+
+    @abstractmethod
+    def write(self, name, journal):
+        pass
+
+    @abstractmethod
+    def read_range(self, start, end):
+        """
+        Returns:
+        list: (name, journal) of the journals with start <= name <= end, sorted by name.
+        """
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FileJournalSink(JournalSink):
+    """
+    Writes every journal to its own .txt file, like save_journal.
+    """
+
+    def __init__(self, folder_path, replace=True):
+        os.makedirs(folder_path, exist_ok=True)
+        self.folder_path = folder_path
+        self.replace = replace
+
+    def write(self, name, journal):
+        full_path = os.path.join(self.folder_path, name + '.txt')
+        if self.replace or not os.path.exists(full_path):
+            with open(full_path, 'w', encoding='utf-8') as file:
+                file.write(journal)
+
+    def read_range(self, start, end):
+        journals = []
+        for file_name in sorted(os.listdir(self.folder_path)):
+            name = file_name[:-len('.txt')]
+            if file_name.endswith('.txt') and start <= name <= end:
+                with open(os.path.join(self.folder_path, file_name), 'r', encoding='utf-8') as file:
+                    journals.append((name, file.read()))
+        return journals
+
+
+class BufferedJournalSink(JournalSink):
+    """
+    Buffers journals in memory and writes them in batches, once buffer_size journals are pending or flush_interval
+    seconds have passed since the last write.
+    """
+
+    def __init__(self, buffer_size=1000, flush_interval=10.0):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def write(self, name, journal):
+        self.buffer.append((name, journal))
+        if len(self.buffer) >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    @abstractmethod
+    def write_batch(self, journals):
+        pass
+
+
+class JsonlJournalSink(BufferedJournalSink):
+    """
+    Appends journals to one JSONL file of {"name": ..., "journal": ...} records. A journal written again under the
+    same name replaces the earlier one when reading.
+    """
+
+    def __init__(self, path, buffer_size=1000, flush_interval=10.0):
+        super().__init__(buffer_size, flush_interval)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write_batch(self, journals):
+        self.file.write(''.join(json.dumps({'name': name, 'journal': journal}, ensure_ascii=False) + '\n'
+                                for name, journal in journals))
+        self.file.flush()
+
+    def read_range(self, start, end):
+        self.flush()
+        journals = {}
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                record = json.loads(line)
+                if start <= record['name'] <= end:
+                    journals[record['name']] = record['journal']
+        return sorted(journals.items())
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class SqliteJournalSink(BufferedJournalSink):
+    """
+    Stores journals in a SQLite table indexed by name, so that read_range does not scan the whole output.
+    """
+
+    def __init__(self, path, buffer_size=1000, flush_interval=10.0):
+        super().__init__(buffer_size, flush_interval)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS journals (name TEXT PRIMARY KEY, journal TEXT)")
+
+    def write_batch(self, journals):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO journals VALUES (?, ?)", journals)
+
+    def read_range(self, start, end):
+        self.flush()
+        return self.connection.execute("SELECT name, journal FROM journals WHERE name BETWEEN ? AND ? ORDER BY name",
+                                       (start, end)).fetchall()
+
+    def close(self):
+        super().close()
+        self.connection.close()
+
+
+# Journal sinks by name, created from the output folder
+JOURNAL_SINKS = {
+    'file': lambda folder_path: FileJournalSink(folder_path),
+    'jsonl': lambda folder_path: JsonlJournalSink(os.path.join(folder_path, 'journals.jsonl')),
+    'sqlite': lambda folder_path: SqliteJournalSink(os.path.join(folder_path, 'journals.db')),
+}
+
+
+def open_journal_sink(sink, folder_path):
+    if sink not in JOURNAL_SINKS:
+        raise ValueError("Unknown journal sink '%s', available: %s" % (sink, list(JOURNAL_SINKS)))
+    return JOURNAL_SINKS[sink](folder_path)
+
+
 def remove_nan_rows(arr):
     # Use boolean indexing to select only rows without NaN values
     if len(arr) == 0: